@@ -0,0 +1,76 @@
+"""Compare two load-test results (e.g. from two commits) operation by operation.
+
+Exits 1 when any operation's p99 latency or error rate got worse than the
+thresholds allow, so it can gate a CI job.
+
+    python benchmarks/loadtest/compare.py before.json after.json \\
+        --max-p99-regression 0.2
+"""
+
+import sys
+import json
+import argparse
+
+
+def load(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def change(before, after):
+    if before in (None, 0) or after is None:
+        return None
+    return (after - before) / before
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("before")
+    parser.add_argument("after")
+    parser.add_argument(
+        "--max-p99-regression",
+        type=float,
+        default=0.2,
+        help="allowed relative p99 increase",
+    )
+    parser.add_argument(
+        "--max-error-rate-increase",
+        type=float,
+        default=0.01,
+        help="allowed absolute increase",
+    )
+    args = parser.parse_args(argv)
+
+    before, after = load(args.before), load(args.after)
+    print(
+        f"{before['scenario']}: {before['revision']} ({before['label']})"
+        f" -> {after['revision']} ({after['label']})"
+    )
+    print(f"{'operation':<22}{'req/s':>18}{'p50 ms':>20}{'p99 ms':>20}{'errors':>16}")
+    regressions = []
+    for name in sorted(set(before["operations"]) | set(after["operations"])):
+        old, new = before["operations"].get(name), after["operations"].get(name)
+        if old is None or new is None:
+            print(f"{name:<22} only in {'after' if old is None else 'before'}")
+            continue
+        old_ms, new_ms = old["latency_ms"], new["latency_ms"]
+        p99_change = change(old_ms["p99"], new_ms["p99"])
+        error_change = new["error_rate"] - old["error_rate"]
+        print(
+            f"{name:<22}"
+            f"{old['throughput_per_s']:>8.0f} ->{new['throughput_per_s']:>7.0f}"
+            f"{old_ms['p50'] or 0:>9.1f} ->{new_ms['p50'] or 0:>8.1f}"
+            f"{old_ms['p99'] or 0:>9.1f} ->{new_ms['p99'] or 0:>8.1f}"
+            f"{old['error_rate']:>7.1%} ->{new['error_rate']:>6.1%}"
+        )
+        if p99_change is not None and p99_change > args.max_p99_regression:
+            regressions.append(f"{name}: p99 up {p99_change:.0%}")
+        if error_change > args.max_error_rate_increase:
+            regressions.append(f"{name}: error rate up {error_change:.1%}")
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,91 @@
+"""Load-test driver for the gateway and the services behind it.
+
+Runs one scenario against a base URL (the gateway on :8080, a single service,
+or the echo server) and prints throughput, error rate and latency percentiles
+per operation as JSON. Save runs from two commits and diff them with
+compare.py.
+
+    python benchmarks/loadtest/run.py echo --url http://localhost:6969
+    python benchmarks/loadtest/run.py login_storm --url http://localhost:8080 \\
+        --out before.json
+    python benchmarks/loadtest/run.py websocket_tables --url http://localhost:8001 \\
+        --tables 20 --table-players 6
+    python benchmarks/loadtest/run.py websocket_joins --url http://localhost:8001 \\
+        --join-auth token
+"""
+
+import sys
+import json
+import random
+import asyncio
+import argparse
+import platform
+
+from scenarios import SCENARIOS
+from stats import Recorder, git_revision
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("scenario", choices=sorted(SCENARIOS))
+    parser.add_argument("--url", default="http://localhost:8080")
+    parser.add_argument(
+        "--label", default="run", help="free-form tag stored with the results"
+    )
+    parser.add_argument(
+        "--out", help="write the JSON results here as well as to stdout"
+    )
+    parser.add_argument("--duration", type=float, default=30)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--timeout", type=float, default=10)
+    parser.add_argument("--seed", type=int, default=7)
+    # User scenarios.
+    parser.add_argument(
+        "--players", type=int, default=200, help="players registered up front"
+    )
+    parser.add_argument("--first-user-id", type=int, default=5_000_000)
+    parser.add_argument("--register-ratio", type=float, default=0.05)
+    parser.add_argument("--miss-ratio", type=float, default=0.1)
+    parser.add_argument("--lookup-ratio", type=float, default=0.1)
+    # WebSocket tables.
+    parser.add_argument("--tables", type=int, default=10)
+    parser.add_argument("--table-players", type=int, default=5)
+    parser.add_argument("--rate", type=float, default=2, help="messages/s per player")
+    # WebSocket joins.
+    parser.add_argument("--join-auth", choices=["name", "token"], default="token")
+    return parser.parse_args(argv)
+
+
+async def main(argv=None):
+    args = parse_args(argv)
+    random.seed(args.seed)
+    recorder = Recorder()
+    await SCENARIOS[args.scenario](args, recorder)
+    recorder.stop()
+
+    results = {
+        "scenario": args.scenario,
+        "label": args.label,
+        "revision": git_revision(),
+        "url": args.url,
+        "config": {
+            key: value
+            for key, value in vars(args).items()
+            if key not in ("scenario", "label", "out")
+        },
+        "python": platform.python_version(),
+        **recorder.summary(),
+    }
+    output = json.dumps(results, indent=2)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(output + "\n")
+    print(output)
+    failed = any(
+        op["count"] and op["error_rate"] == 1 for op in results["operations"].values()
+    )
+    return 1 if failed or not results["operations"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
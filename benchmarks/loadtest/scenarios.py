@@ -0,0 +1,314 @@
+import os
+import sys
+import json
+import time
+import uuid
+import random
+import asyncio
+
+import httpx
+import websockets
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "..", "services"))
+
+from common.token import create_jwt  # noqa: E402
+
+PASSWORD = "correct horse battery staple"
+
+
+async def closed_loop(recorder, args, operation):
+    """Run `operation(client)` back to back from `args.concurrency` workers until the
+    deadline.
+
+    Each worker gets its own single-connection client: one shared httpx pool
+    serializes on its lock and caps the driver well below what servers sustain.
+    """
+    recorder.begin()
+    deadline = time.perf_counter() + args.duration
+
+    async def worker():
+        async with http_client(args, connections=1) as client:
+            while time.perf_counter() < deadline:
+                await operation(client)
+
+    await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+
+
+async def timed(recorder, name: str, request, expect=(200,)):
+    """Await an httpx request coroutine, recording its latency or why it failed."""
+    started = time.perf_counter()
+    try:
+        response = await request
+    except httpx.HTTPError as exc:
+        recorder.error(name, type(exc).__name__)
+        return None
+    if response.status_code not in expect:
+        recorder.error(name, response.status_code)
+        return response
+    recorder.ok(name, time.perf_counter() - started)
+    return response
+
+
+def http_client(args, connections: int = 8) -> httpx.AsyncClient:
+    limits = httpx.Limits(
+        max_connections=connections, max_keepalive_connections=connections
+    )
+    return httpx.AsyncClient(base_url=args.url, limits=limits, timeout=args.timeout)
+
+
+def player(user_id: int) -> dict:
+    return {
+        "user_id": user_id,
+        "user_name": f"load-player-{user_id}",
+        "user_password": PASSWORD,
+        "user_bio": "load test",
+        "user_archtype": "bard",
+    }
+
+
+async def register_players(client, recorder, first_id: int, count: int) -> list:
+    user_ids = list(range(first_id, first_id + count))
+    for start in range(0, count, 500):
+        batch = [player(user_id) for user_id in user_ids[start : start + 500]]
+        await timed(
+            recorder,
+            "setup:register_bulk",
+            client.post("/users/bulk", json={"users": batch}),
+        )
+    return user_ids
+
+
+# --- Scenarios ---
+# Each takes (args, recorder) and drives load until args.duration elapses.
+
+
+async def echo(args, recorder):
+    """GET and POST against the echo server, to check the harness and network path."""
+    body = json.dumps({"message": "x" * 256})
+
+    async def operation(client):
+        if random.random() < 0.5:
+            await timed(recorder, "echo:get", client.get("/"))
+        else:
+            await timed(recorder, "echo:post", client.post("/", content=body))
+
+    await closed_loop(recorder, args, operation)
+
+
+async def login_storm(args, recorder):
+    """Registration followed by many concurrent logins; bcrypt bound."""
+    async with http_client(args) as client:
+        user_ids = await register_players(
+            client, recorder, args.first_user_id, args.players
+        )
+
+    async def operation(client):
+        if random.random() < args.register_ratio:
+            user_id = args.first_user_id + args.players + random.randrange(1_000_000)
+            await timed(
+                recorder,
+                "register",
+                client.post("/register", json=player(user_id)),
+                (201, 400),
+            )
+        else:
+            name = player(random.choice(user_ids))["user_name"]
+            await timed(
+                recorder,
+                "login",
+                client.post(
+                    "/login", json={"user_name": name, "user_password": PASSWORD}
+                ),
+            )
+
+    await closed_loop(recorder, args, operation)
+
+
+async def profile_reads(args, recorder):
+    """Profile reads mixing cache hits, misses for unknown players, and bulk lookups."""
+    async with http_client(args) as client:
+        user_ids = await register_players(
+            client, recorder, args.first_user_id, args.players
+        )
+
+    async def operation(client):
+        roll = random.random()
+        if roll < args.miss_ratio:
+            missing = args.first_user_id - 1 - random.randrange(1_000_000)
+            await timed(
+                recorder, "profile:missing", client.get(f"/user/{missing}"), (404,)
+            )
+        elif roll < args.miss_ratio + args.lookup_ratio:
+            batch = random.sample(user_ids, min(50, len(user_ids)))
+            await timed(
+                recorder,
+                "profile:lookup",
+                client.post("/users/lookup", json={"user_ids": batch}),
+            )
+        else:
+            await timed(
+                recorder, "profile:get", client.get(f"/user/{random.choice(user_ids)}")
+            )
+
+    await closed_loop(recorder, args, operation)
+
+
+async def session_crud(args, recorder):
+    """Session creation interleaved with paginated listing."""
+
+    async def operation(client):
+        if random.random() < 0.3:
+            await timed(recorder, "session:create", client.post("/session"), (201,))
+            return
+        cursor, pages = None, 0
+        while pages < 3:
+            params = {"limit": 100}
+            if cursor:
+                params["cursor"] = cursor
+            response = await timed(
+                recorder, "session:list", client.get("/session", params=params)
+            )
+            if response is None or response.status_code != 200:
+                return
+            cursor = response.json().get("next_cursor")
+            pages += 1
+            if not cursor:
+                return
+
+    await closed_loop(recorder, args, operation)
+
+
+async def websocket_tables(args, recorder):
+    """`tables` sessions with `players` WebSocket players each, each player chatting
+    at `rate` messages/s.
+
+    Every message carries its send time, so listeners record end-to-end delivery
+    latency ("ws:deliver") and the table's fan-out rate.
+    """
+    ws_url = args.url.replace("http://", "ws://", 1).replace("https://", "wss://", 1)
+    async with http_client(args) as client:
+        tables = []
+        for _ in range(args.tables):
+            response = await timed(
+                recorder, "setup:session_create", client.post("/session"), (201,)
+            )
+            if response is None or response.status_code != 201:
+                continue
+            session_id = response.json()["session_id"]
+            names = [f"p{i}-{uuid.uuid4().hex[:6]}" for i in range(args.table_players)]
+            await timed(
+                recorder,
+                "setup:allow_players",
+                client.post(
+                    f"/session/{session_id}/allowed_users", json={"users": names}
+                ),
+            )
+            tables.append((session_id, names))
+
+    recorder.begin()
+    deadline = time.perf_counter() + args.duration
+
+    async def play(session_id, name):
+        started = time.perf_counter()
+        joined = False
+        try:
+            async with websockets.connect(
+                f"{ws_url}/session/{session_id}", open_timeout=args.timeout
+            ) as ws:
+                await ws.send(
+                    create_jwt({"name": name}) if args.join_auth == "token" else name
+                )
+                await ws.recv()  # "server:: You've joined."
+                recorder.ok("ws:join", time.perf_counter() - started)
+                joined = True
+
+                async def listen():
+                    async for frame in ws:
+                        _, _, body = frame.partition("::  ")
+                        if body.startswith("t="):
+                            recorder.ok("ws:deliver", time.time() - float(body[2:]))
+                        elif frame == "server:: ping":
+                            await ws.send("pong")
+
+                listener = asyncio.create_task(listen())
+                while time.perf_counter() < deadline:
+                    await ws.send(f"t={time.time()}")
+                    await asyncio.sleep(random.expovariate(args.rate))
+                # Let the last messages arrive before hanging up.
+                await asyncio.sleep(0.5)
+                listener.cancel()
+        except (OSError, asyncio.TimeoutError, websockets.WebSocketException) as exc:
+            recorder.error("ws:session" if joined else "ws:join", type(exc).__name__)
+
+    await asyncio.gather(
+        *(play(session_id, name) for session_id, names in tables for name in names)
+    )
+
+
+async def websocket_joins(args, recorder):
+    """Players joining (and leaving) one session back to back, to measure the join rate.
+
+    With --join-auth token every join presents a JWT, minted here with the
+    shared JWT_SECRET, so runs against JOIN_AUTH=off, local and remote show
+    what token validation adds to a join; --join-auth name sends plain names,
+    which the server only lets in with JOIN_AUTH=off or JOIN_AUTH_REQUIRED=false.
+    """
+    ws_url = args.url.replace("http://", "ws://", 1).replace("https://", "wss://", 1)
+    names = [f"joiner-{i}-{uuid.uuid4().hex[:6]}" for i in range(args.players)]
+    async with http_client(args) as client:
+        response = await timed(
+            recorder, "setup:session_create", client.post("/session"), (201,)
+        )
+        if response is None or response.status_code != 201:
+            return
+        session_id = response.json()["session_id"]
+        for start in range(0, len(names), 100):
+            await timed(
+                recorder,
+                "setup:allow_players",
+                client.post(
+                    f"/session/{session_id}/allowed_users",
+                    json={"users": names[start : start + 100]},
+                ),
+            )
+    if args.join_auth == "token":
+        credentials = [
+            create_jwt({"user_id": i, "name": name}) for i, name in enumerate(names)
+        ]
+    else:
+        credentials = names
+
+    recorder.begin()
+    deadline = time.perf_counter() + args.duration
+
+    async def joiner():
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            try:
+                async with websockets.connect(
+                    f"{ws_url}/session/{session_id}", open_timeout=args.timeout
+                ) as ws:
+                    await ws.send(random.choice(credentials))
+                    reply = await asyncio.wait_for(ws.recv(), args.timeout)
+                if reply == "server:: You've joined.":
+                    recorder.ok("ws:join", time.perf_counter() - started)
+                else:
+                    recorder.error("ws:join", reply)
+            except (
+                OSError,
+                asyncio.TimeoutError,
+                websockets.WebSocketException,
+            ) as exc:
+                recorder.error("ws:join", type(exc).__name__)
+
+    await asyncio.gather(*(joiner() for _ in range(args.concurrency)))
+
+
+SCENARIOS = {
+    "echo": echo,
+    "login_storm": login_storm,
+    "profile_reads": profile_reads,
+    "session_crud": session_crud,
+    "websocket_joins": websocket_joins,
+    "websocket_tables": websocket_tables,
+}
@@ -0,0 +1,73 @@
+import time
+import subprocess
+import statistics
+
+
+class Recorder:
+    """Latencies and errors per operation name, summarized as JSON-ready dicts."""
+
+    def __init__(self):
+        self.latencies = {}
+        self.errors = {}
+        self.started = time.perf_counter()
+        self.finished = None
+
+    def begin(self):
+        """Start the throughput clock once setup (registrations, sessions) is done."""
+        self.started = time.perf_counter()
+
+    def ok(self, operation: str, seconds: float):
+        self.latencies.setdefault(operation, []).append(seconds)
+
+    def error(self, operation: str, reason):
+        errors = self.errors.setdefault(operation, {})
+        errors[str(reason)] = errors.get(str(reason), 0) + 1
+
+    def stop(self):
+        self.finished = time.perf_counter()
+
+    def summary(self) -> dict:
+        elapsed = (self.finished or time.perf_counter()) - self.started
+        operations = {}
+        for name in sorted(set(self.latencies) | set(self.errors)):
+            samples = self.latencies.get(name, [])
+            errors = sum(self.errors.get(name, {}).values())
+            total = len(samples) + errors
+            operations[name] = {
+                "count": total,
+                "errors": errors,
+                "error_rate": errors / total if total else 0.0,
+                "error_reasons": self.errors.get(name, {}),
+                "throughput_per_s": len(samples) / elapsed if elapsed else 0.0,
+                "latency_ms": latency_summary(samples),
+            }
+        return {"elapsed_s": elapsed, "operations": operations}
+
+
+def latency_summary(samples) -> dict:
+    if not samples:
+        return {"p50": None, "p90": None, "p99": None, "max": None, "mean": None}
+    if len(samples) == 1:
+        value = samples[0] * 1000
+        return {"p50": value, "p90": value, "p99": value, "max": value, "mean": value}
+    quantiles = statistics.quantiles(samples, n=100, method="inclusive")
+    return {
+        "p50": quantiles[49] * 1000,
+        "p90": quantiles[89] * 1000,
+        "p99": quantiles[98] * 1000,
+        "max": max(samples) * 1000,
+        "mean": statistics.mean(samples) * 1000,
+    }
+
+
+def git_revision() -> str:
+    """Commit the tree under test was built from, so runs can be compared."""
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
@@ -0,0 +1,69 @@
+"""Per-request overhead of the shared Prometheus middleware.
+
+Drives a bare ASGI app directly, with and without PrometheusMiddleware, so the
+numbers isolate the middleware from routing, serialization and the network.
+
+    python benchmarks/metrics_middleware.py
+"""
+
+import os
+import sys
+import time
+import asyncio
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "services"))
+
+from common.instrumentation import PrometheusMiddleware  # noqa: E402
+
+
+class Route:
+    path = "/user/{user_id}"
+
+
+ROUTE = Route()
+BODY = b'{"message": "Successfully returned the user data."}'
+
+
+async def endpoint(scope, receive, send):
+    # Stand-in for the router: record the matched route, send a small JSON body.
+    scope["route"] = ROUTE
+    await send({"type": "http.response.start", "status": 200, "headers": []})
+    await send({"type": "http.response.body", "body": BODY})
+
+
+async def receive():
+    return {"type": "http.request", "body": b"", "more_body": False}
+
+
+async def send(message):
+    pass
+
+
+async def drive(app, requests):
+    started = time.perf_counter()
+    for i in range(requests):
+        scope = {"type": "http", "method": "GET", "path": f"/user/{i}"}
+        await app(scope, receive, send)
+    return time.perf_counter() - started
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=200_000)
+    args = parser.parse_args()
+
+    wrapped = PrometheusMiddleware(endpoint)
+    # Warm up label children so both runs measure steady state.
+    await drive(wrapped, 1000)
+
+    bare = await drive(endpoint, args.requests)
+    instrumented = await drive(wrapped, args.requests)
+    overhead_us = (instrumented - bare) / args.requests * 1e6
+    print(f"bare          {bare / args.requests * 1e6:8.2f} us/request")
+    print(f"instrumented  {instrumented / args.requests * 1e6:8.2f} us/request")
+    print(f"overhead      {overhead_us:8.2f} us/request")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,136 @@
+"""Delivery latency of session broadcasts, sequential sends vs. the broadcast hub.
+
+Every room has one sender, a deliberately slow listener and N-2 healthy
+listeners. Messages are scheduled open-loop at a fixed interval and latency is
+measured from the scheduled send time, so a sender that gets stuck behind the
+slow listener shows up as queueing delay for everyone else. Reports p50/p99
+delivery latency seen by the healthy listeners, and how many frames were
+delivered and dropped.
+
+    python benchmarks/session_broadcast.py
+"""
+
+import os
+import sys
+import time
+import asyncio
+import argparse
+import statistics
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "services", "session"))
+
+from utils.broadcast import BroadcastHub  # noqa: E402
+
+CLIENT_COUNTS = [2, 8, 64, 256]
+# Longest the hub run waits for the writers to deliver what is still queued.
+DRAIN_TIMEOUT = 60.0
+
+
+class SimulatedClient:
+    def __init__(self, delay: float = 0.0):
+        self.delay = delay
+        self.latencies = []
+
+    async def send_text(self, frame: str):
+        # Every send yields to the loop, like a real socket write would.
+        await asyncio.sleep(self.delay)
+        sent_at = float(frame.rsplit("::  ", 1)[1])
+        self.latencies.append(time.perf_counter() - sent_at)
+
+    async def close(self, code: int = 1000):
+        pass
+
+
+def percentile(values, pct):
+    if not values:
+        return float("nan")
+    if len(values) == 1:
+        return values[0]
+    return statistics.quantiles(values, n=100, method="inclusive")[pct - 1]
+
+
+async def schedule(messages, interval):
+    """Yield the scheduled send time of each message, sleeping until it is due."""
+    start = time.perf_counter()
+    for i in range(messages):
+        due = start + i * interval
+        delay = due - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        yield due
+
+
+async def run_sequential(clients, messages, interval, name="dm"):
+    sender = clients[0]
+    async for due in schedule(messages, interval):
+        for client in clients:
+            if client is not sender:
+                await client.send_text(f"{name}::  {due}")
+    return 0
+
+
+async def run_hub(clients, messages, interval, name="dm"):
+    hub = BroadcastHub(overflow_policy="drop")
+    connections = [hub.join("bench", client, name) for client in clients]
+    sender = connections[0]
+    async for due in schedule(messages, interval):
+        await hub.broadcast("bench", sender, str(due))
+    # Close only once every listener got all that was queued for it, so the
+    # slow listener's backlog is measured rather than thrown away.
+    listeners = list(zip(clients[1:], connections[1:]))
+    deadline = time.perf_counter() + DRAIN_TIMEOUT
+    while time.perf_counter() < deadline and any(
+        len(client.latencies) < messages - conn.dropped for client, conn in listeners
+    ):
+        await asyncio.sleep(0.01)
+    await hub.close_room("bench")
+    return sum(conn.dropped for conn in connections[1:])
+
+
+async def measure(mode, count, messages, interval, slow_delay):
+    slow = SimulatedClient(delay=slow_delay)
+    clients = [SimulatedClient(), slow] + [SimulatedClient() for _ in range(count - 2)]
+    runner = run_sequential if mode == "sequential" else run_hub
+    started = time.perf_counter()
+    dropped = await runner(clients, messages, interval)
+    elapsed = time.perf_counter() - started
+    latencies = [lat for client in clients[2:] for lat in client.latencies]
+    if count == 2:
+        # With two players the only listener is the slow one.
+        latencies = slow.latencies
+    return {
+        "mode": mode,
+        "clients": count,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "delivered": len(latencies),
+        "dropped": dropped,
+        "elapsed_s": elapsed,
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--messages", type=int, default=50)
+    parser.add_argument("--interval", type=float, default=0.005)
+    parser.add_argument("--slow-delay", type=float, default=0.05)
+    args = parser.parse_args()
+
+    print(
+        f"{'mode':<12}{'clients':>8}{'p50 ms':>10}{'p99 ms':>10}"
+        f"{'delivered':>11}{'dropped':>9}{'elapsed s':>11}"
+    )
+    for count in CLIENT_COUNTS:
+        for mode in ("sequential", "hub"):
+            row = await measure(
+                mode, count, args.messages, args.interval, args.slow_delay
+            )
+            print(
+                f"{row['mode']:<12}{row['clients']:>8}{row['p50_ms']:>10.3f}"
+                f"{row['p99_ms']:>10.3f}{row['delivered']:>11}{row['dropped']:>9}"
+                f"{row['elapsed_s']:>11.2f}"
+            )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
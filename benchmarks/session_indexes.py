@@ -0,0 +1,94 @@
+"""Session lookup latency before and after the index bootstrap.
+
+Seeds a scratch database on a local mongod with 100k sessions, measures
+`find_one({"session_id": ...})` latency without secondary indexes, creates the
+service's indexes and measures again.
+
+    MONGO_URL=mongodb://localhost:27017 python benchmarks/session_indexes.py
+"""
+
+import os
+import sys
+import time
+import uuid
+import random
+import asyncio
+import argparse
+import statistics
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "services", "session"))
+
+from motor.motor_asyncio import AsyncIOMotorClient  # noqa: E402
+
+from repository.db import ensure_indexes  # noqa: E402
+from repository.diagnostics import explain_hot_queries  # noqa: E402
+
+
+async def seed(collection, count, batch_size=10_000):
+    await collection.drop()
+    session_ids = []
+    now = time.time()
+    for start in range(0, count, batch_size):
+        batch = []
+        for i in range(start, min(start + batch_size, count)):
+            session_id = str(uuid.uuid4())
+            session_ids.append(session_id)
+            batch.append(
+                {
+                    "session_id": session_id,
+                    "created_at": now + i,
+                    "allowed_users": ["dm", f"player-{i % 50}"],
+                    "active_users": [],
+                }
+            )
+        await collection.insert_many(batch, ordered=False)
+    return session_ids
+
+
+async def measure(collection, session_ids, lookups):
+    samples = []
+    for session_id in random.choices(session_ids, k=lookups):
+        started = time.perf_counter()
+        await collection.find_one({"session_id": session_id})
+        samples.append((time.perf_counter() - started) * 1000)
+    quantiles = statistics.quantiles(samples, n=100)
+    return {
+        "p50_ms": quantiles[49],
+        "p99_ms": quantiles[98],
+        "mean_ms": statistics.mean(samples),
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--url", default=os.getenv("MONGO_URL", "mongodb://localhost:27017")
+    )
+    parser.add_argument("--sessions", type=int, default=100_000)
+    parser.add_argument("--lookups", type=int, default=500)
+    args = parser.parse_args()
+
+    client = AsyncIOMotorClient(args.url)
+    collection = client.session_bench.sessions
+    print(f"Seeding {args.sessions} sessions...")
+    session_ids = await seed(collection, args.sessions)
+
+    before = await measure(collection, session_ids, args.lookups)
+    await ensure_indexes(collection)
+    after = await measure(collection, session_ids, args.lookups)
+
+    print(f"{'':<8}{'p50 ms':>10}{'p99 ms':>10}{'mean ms':>10}")
+    for label, row in (("before", before), ("after", after)):
+        print(
+            f"{label:<8}{row['p50_ms']:>10.3f}{row['p99_ms']:>10.3f}"
+            f"{row['mean_ms']:>10.3f}"
+        )
+    for name, result in (await explain_hot_queries(collection)).items():
+        print(f"{name:<22} {' <- '.join(result['stages'])}")
+
+    await client.drop_database("session_bench")
+    client.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,157 @@
+"""Bytes on the wire and delivery rate of the session text protocol vs. msgpack.
+
+Pushes a mixed stream of chat messages, dice rolls and map moves through the
+broadcast hub to in-process listeners and compares the text protocol, msgpack
+frames sent one by one, and msgpack frames coalesced by the writer. Bytes are
+also reported after permessage-deflate (raw deflate with context takeover and
+a sync flush per frame, as browsers negotiate it by default).
+
+    python benchmarks/session_wire_protocol.py
+"""
+
+import os
+import sys
+import time
+import zlib
+import random
+import asyncio
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "services", "session"))
+
+import utils.broadcast as broadcast  # noqa: E402
+from utils.broadcast import BroadcastHub  # noqa: E402
+
+
+class CountingClient:
+    """Counts frames and bytes, deflated as a permessage-deflate socket would."""
+
+    def __init__(self):
+        self.frames = 0
+        self.events = 0
+        self.raw_bytes = 0
+        self.deflated_bytes = 0
+        self.compressor = zlib.compressobj(wbits=-15)
+        self.done = asyncio.Event()
+        self.expected = 0
+
+    def record(self, payload: bytes, events: int):
+        self.frames += 1
+        self.events += events
+        self.raw_bytes += len(payload)
+        compressed = self.compressor.compress(payload) + self.compressor.flush(
+            zlib.Z_SYNC_FLUSH
+        )
+        # The 00 00 ff ff sync-flush trailer is stripped on the wire.
+        self.deflated_bytes += len(compressed) - 4
+        if self.events >= self.expected:
+            self.done.set()
+
+    async def send_text(self, frame: str):
+        self.record(frame.encode(), 1)
+
+    async def send_bytes(self, frame: bytes):
+        # Coalesced frames are msgpack arrays: fixarray/array16/array32 headers.
+        if 0x90 <= frame[0] <= 0x9F:
+            events = frame[0] & 0x0F
+        elif frame[0] == 0xDC:
+            events = int.from_bytes(frame[1:3], "big")
+        elif frame[0] == 0xDD:
+            events = int.from_bytes(frame[1:5], "big")
+        else:
+            events = 1
+        self.record(frame, events)
+
+    async def close(self, code: int = 1000):
+        pass
+
+
+def workload(count):
+    rng = random.Random(7)
+    events = []
+    for i in range(count):
+        kind = rng.choice(["chat", "chat", "dice", "move"])
+        if kind == "chat":
+            events.append(("chat", f"The goblin swings at the paladin, round {i}!"))
+        elif kind == "dice":
+            events.append(
+                (
+                    "dice",
+                    {"die": 20, "count": 1, "roll": rng.randint(1, 20), "modifier": 3},
+                )
+            )
+        else:
+            events.append(
+                (
+                    "move",
+                    {
+                        "token": "paladin",
+                        "x": rng.randint(0, 40),
+                        "y": rng.randint(0, 40),
+                    },
+                )
+            )
+    return events
+
+
+async def run(mode, listeners, events, burst):
+    broadcast.COALESCE_WINDOW = 0.002 if mode == "msgpack+coalesce" else 0
+    broadcast.COALESCE_MAX = 64 if mode == "msgpack+coalesce" else 1
+    hub = BroadcastHub(overflow_policy="drop")
+    sender = hub.join("bench", CountingClient(), "dm")
+    clients = []
+    for i in range(listeners):
+        client = CountingClient()
+        client.expected = len(events)
+        connection = hub.join("bench", client, f"player-{i}", binary=mode != "text")
+        # Unbounded queues, so the sender outrunning the writers sheds nothing.
+        connection.queue = asyncio.Queue()
+        clients.append(client)
+
+    started = time.perf_counter()
+    for i, (kind, data) in enumerate(events):
+        await hub.broadcast("bench", sender, data, kind)
+        if i % burst == burst - 1:
+            # Players act in bursts; give the writers a chance to run in between.
+            await asyncio.sleep(0)
+    await asyncio.wait_for(
+        asyncio.gather(*(client.done.wait() for client in clients)), 60
+    )
+    elapsed = time.perf_counter() - started
+
+    for connection in list(hub.rooms["bench"].values()):
+        await hub.leave("bench", connection)
+    delivered = sum(client.events for client in clients)
+    return {
+        "frames": sum(client.frames for client in clients),
+        "raw": sum(client.raw_bytes for client in clients) / delivered,
+        "deflated": sum(client.deflated_bytes for client in clients) / delivered,
+        "rate": delivered / elapsed,
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--listeners", type=int, default=16)
+    parser.add_argument("--events", type=int, default=20_000)
+    parser.add_argument(
+        "--burst", type=int, default=8, help="events broadcast between yields"
+    )
+    args = parser.parse_args()
+
+    events = workload(args.events)
+    print(f"{args.events} events to {args.listeners} listeners, bursts of {args.burst}")
+    print(
+        f"{'protocol':<18}{'frames':>10}{'B/event':>10}"
+        f"{'B/event deflate':>17}{'events/s':>12}"
+    )
+    for mode in ("text", "msgpack", "msgpack+coalesce"):
+        row = await run(mode, args.listeners, events, args.burst)
+        print(
+            f"{mode:<18}{row['frames']:>10}{row['raw']:>10.1f}"
+            f"{row['deflated']:>17.1f}{row['rate']:>12.0f}"
+        )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
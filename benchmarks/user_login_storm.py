@@ -0,0 +1,114 @@
+"""Login throughput and /user/status latency during a login storm.
+
+Registers a pool of players, then hammers POST /login from many concurrent
+clients while a probe polls GET /user/status. Run it against a build before
+and after a change and compare the JSON summaries.
+
+    python benchmarks/user_login_storm.py --url http://localhost:8004 --label after
+"""
+
+import json
+import time
+import random
+import asyncio
+import argparse
+import statistics
+
+import httpx
+
+
+def summarize(samples):
+    if len(samples) < 2:
+        return {"p50_ms": None, "p99_ms": None, "count": len(samples)}
+    quantiles = statistics.quantiles(samples, n=100)
+    return {
+        "p50_ms": quantiles[49] * 1000,
+        "p99_ms": quantiles[98] * 1000,
+        "count": len(samples),
+    }
+
+
+async def register_players(client, players, password):
+    for user_id, name in players:
+        await client.post(
+            "/register",
+            json={
+                "user_id": user_id,
+                "user_name": name,
+                "user_password": password,
+                "user_bio": "bench",
+                "user_archtype": "bard",
+            },
+        )
+
+
+async def login_worker(client, players, password, deadline, results):
+    while time.perf_counter() < deadline:
+        _, name = random.choice(players)
+        started = time.perf_counter()
+        response = await client.post(
+            "/login", json={"user_name": name, "user_password": password}
+        )
+        results.setdefault(response.status_code, []).append(
+            time.perf_counter() - started
+        )
+
+
+async def status_probe(client, deadline, samples, interval):
+    while time.perf_counter() < deadline:
+        started = time.perf_counter()
+        await client.get("/user/status")
+        samples.append(time.perf_counter() - started)
+        await asyncio.sleep(interval)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", default="http://localhost:8004")
+    parser.add_argument("--label", default="run")
+    parser.add_argument("--players", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--duration", type=float, default=20)
+    parser.add_argument("--probe-interval", type=float, default=0.01)
+    parser.add_argument("--skip-register", action="store_true")
+    args = parser.parse_args()
+
+    password = "correct horse battery staple"
+    players = [(str(900_000 + i), f"bench-player-{i}") for i in range(args.players)]
+    limits = httpx.Limits(max_connections=args.concurrency + 1)
+    async with httpx.AsyncClient(
+        base_url=args.url, limits=limits, timeout=30
+    ) as client:
+        if not args.skip_register:
+            await register_players(client, players, password)
+
+        results, probe = {}, []
+        deadline = time.perf_counter() + args.duration
+        await asyncio.gather(
+            status_probe(client, deadline, probe, args.probe_interval),
+            *(
+                login_worker(client, players, password, deadline, results)
+                for _ in range(args.concurrency)
+            ),
+        )
+
+    ok = results.get(200, [])
+    print(
+        json.dumps(
+            {
+                "label": args.label,
+                "concurrency": args.concurrency,
+                "logins_per_sec": len(ok) / args.duration,
+                "login_latency": summarize(ok),
+                "status_codes": {
+                    str(code): len(samples) for code, samples in results.items()
+                },
+                "status_latency": summarize(probe),
+            },
+            indent=2,
+        )
+    )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
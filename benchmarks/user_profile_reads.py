@@ -0,0 +1,87 @@
+"""Requests/sec for GET /user/{user_id} under concurrent clients.
+
+Point it at one or more running user-service builds (e.g. the old sync
+SQLAlchemy build and the async one) and compare throughput and latency.
+
+    python benchmarks/user_profile_reads.py \\
+        --target sync=http://localhost:8004 --target async=http://localhost:8005
+"""
+
+import json
+import time
+import random
+import asyncio
+import argparse
+import statistics
+
+import httpx
+
+
+async def client_loop(client, user_ids, deadline, latencies, errors):
+    while time.perf_counter() < deadline:
+        started = time.perf_counter()
+        try:
+            response = await client.get(f"/user/{random.choice(user_ids)}")
+            if response.status_code != 200:
+                errors.append(response.status_code)
+                continue
+        except httpx.HTTPError as exc:
+            errors.append(type(exc).__name__)
+            continue
+        latencies.append(time.perf_counter() - started)
+
+
+async def run_target(label, url, user_ids, concurrency, duration):
+    latencies, errors = [], []
+    limits = httpx.Limits(
+        max_connections=concurrency, max_keepalive_connections=concurrency
+    )
+    async with httpx.AsyncClient(base_url=url, limits=limits, timeout=30) as client:
+        deadline = time.perf_counter() + duration
+        await asyncio.gather(
+            *(
+                client_loop(client, user_ids, deadline, latencies, errors)
+                for _ in range(concurrency)
+            )
+        )
+    quantiles = (
+        statistics.quantiles(latencies, n=100)
+        if len(latencies) > 1
+        else [float("nan")] * 99
+    )
+    return {
+        "label": label,
+        "url": url,
+        "concurrency": concurrency,
+        "requests_per_sec": len(latencies) / duration,
+        "p50_ms": quantiles[49] * 1000,
+        "p99_ms": quantiles[98] * 1000,
+        "errors": len(errors),
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--target", action="append", default=[], help="label=url, repeatable"
+    )
+    parser.add_argument(
+        "--user-ids", default="1", help="comma separated ids that exist in the database"
+    )
+    parser.add_argument("--concurrency", type=int, default=200)
+    parser.add_argument("--duration", type=float, default=20)
+    args = parser.parse_args()
+
+    targets = [t.split("=", 1) for t in args.target] or [
+        ["default", "http://localhost:8004"]
+    ]
+    user_ids = args.user_ids.split(",")
+    results = [
+        await run_target(label, url, user_ids, args.concurrency, args.duration)
+        for label, url in targets
+    ]
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,42 @@
+"""Token validations/sec with a hot and a cold verified-token cache.
+
+python benchmarks/user_token_validation.py
+"""
+
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "services"))
+
+from common.token import create_jwt, decode_jwt, token_cache, verify_token  # noqa: E402
+
+
+def rate(label, func, tokens):
+    started = time.perf_counter()
+    for token in tokens:
+        func(token)
+    elapsed = time.perf_counter() - started
+    print(f"{label:<28}{len(tokens) / elapsed:>14,.0f} validations/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--tokens", type=int, default=1000)
+    parser.add_argument("--rounds", type=int, default=50)
+    args = parser.parse_args()
+
+    tokens = [
+        create_jwt({"user_id": i, "name": f"player-{i}"}) for i in range(args.tokens)
+    ]
+    workload = tokens * args.rounds
+
+    rate("decode_jwt (no cache)", decode_jwt, workload)
+    token_cache.clear()
+    rate("verify_token cold", verify_token, tokens)
+    rate("verify_token hot", verify_token, workload)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,27 +1,331 @@
-from http.server import HTTPServer, BaseHTTPRequestHandler
-
-
-class MyHandler(BaseHTTPRequestHandler):
-    def do_GET(self):
-        self.send_response(200)
-        self.end_headers()
-        self.wfile.write(bytes("It Works!", "utf-8"))
-
-    def do_POST(self):
-        print("Processing a POST request:")
-        print(self.request)
-        print(self.headers)
-        content_length = int(self.headers.get("Content-Length"))
-        if not content_length:
-            print("There isn't a content_length")
+"""Echo server used as a stand-in upstream for gateway benchmarks.
+
+GET answers "It Works!" and POST echoes the body back, as before, but the
+server is now an asyncio HTTP/1.1 server with keep-alive that can behave like
+a slow or flaky backend. Everything can be set on the command line, through
+ECHO_* environment variables, or per request with query parameters:
+
+    latency   injected delay before responding, e.g. "0.02", "uniform:0.01:0.05",
+              "exp:0.02" (mean), "lognormal:0.02:0.5" (median, sigma) or
+              "pareto:0.01:2.5" (minimum, shape) for a heavy tail
+    error     fraction of requests answered with `error_status` instead (0-1)
+    size      GET response body size in bytes (default: "It Works!")
+    chunks    stream the body with chunked encoding in this many pieces,
+              `chunk_delay` seconds apart
+
+Counters are served as JSON from GET /_echo/stats.
+
+    python echo_server.py --latency exp:0.02 --error 0.01 --size 2048
+    curl 'localhost:6969/anything?latency=0.5&chunks=5'
+"""
+
+import os
+import json
+import math
+import time
+import random
+import asyncio
+import argparse
+from urllib.parse import parse_qsl, urlsplit
+
+STATS_PATH = "/_echo/stats"
+MAX_HEADER_BYTES = 64 * 1024
+REASONS = {
+    200: "OK",
+    400: "Bad Request",
+    404: "Not Found",
+    500: "Internal Server Error",
+    502: "Bad Gateway",
+    503: "Service Unavailable",
+    504: "Gateway Timeout",
+}
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Configurable asyncio echo server")
+    parser.add_argument("--host", default=os.getenv("ECHO_HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("ECHO_PORT", 6969)))
+    parser.add_argument("--latency", default=os.getenv("ECHO_LATENCY", "0"))
+    parser.add_argument(
+        "--error", type=float, default=float(os.getenv("ECHO_ERROR_RATE", 0))
+    )
+    parser.add_argument(
+        "--error-status", type=int, default=int(os.getenv("ECHO_ERROR_STATUS", 503))
+    )
+    parser.add_argument(
+        "--size", type=int, default=int(os.getenv("ECHO_RESPONSE_BYTES", -1))
+    )
+    parser.add_argument(
+        "--chunks", type=int, default=int(os.getenv("ECHO_STREAM_CHUNKS", 0))
+    )
+    parser.add_argument(
+        "--chunk-delay", type=float, default=float(os.getenv("ECHO_CHUNK_DELAY", 0.01))
+    )
+    parser.add_argument(
+        "--keepalive-timeout",
+        type=float,
+        default=float(os.getenv("ECHO_KEEPALIVE_TIMEOUT", 75)),
+    )
+    parser.add_argument(
+        "--verbose", action="store_true", default=os.getenv("ECHO_VERBOSE") == "true"
+    )
+    return parser.parse_args(argv)
+
+
+# Parameter names of each latency distribution, in spec order.
+DISTRIBUTIONS = {
+    "uniform": ("low", "high"),
+    "exp": ("mean",),
+    "lognormal": ("median", "sigma"),
+    "pareto": ("minimum", "shape"),
+}
+
+
+def sample_latency(spec: str) -> float:
+    """Draw one delay in seconds from a latency spec (see the module docstring).
+
+    Raises ValueError for a malformed spec, so callers can answer 400.
+    """
+    kind, _, params = spec.partition(":")
+    if not params:
+        delay = float(kind)
+        if not math.isfinite(delay):
+            raise ValueError(f"Latency must be a number of seconds, not {kind!r}")
+        return max(delay, 0.0)
+    names = DISTRIBUTIONS.get(kind)
+    if names is None:
+        raise ValueError(f"Unknown latency distribution {kind!r}")
+    values = [float(value) for value in params.split(":")]
+    if len(values) != len(names):
+        raise ValueError(f"{kind} latency takes {':'.join(names)}, got {params!r}")
+    if not all(math.isfinite(value) and value >= 0 for value in values):
+        raise ValueError(f"{kind} latency parameters must be >= 0, got {params!r}")
+    if kind == "uniform":
+        low, high = values
+        if low > high:
+            raise ValueError(f"uniform latency needs low <= high, got {params!r}")
+        return random.uniform(low, high)
+    if kind == "exp":
+        return random.expovariate(1 / values[0]) if values[0] > 0 else 0.0
+    if kind == "lognormal":
+        return values[0] * random.lognormvariate(0, values[1])
+    if values[1] == 0:
+        raise ValueError(f"pareto latency needs a shape above 0, got {params!r}")
+    return values[0] * random.paretovariate(values[1])
+
+
+async def read_chunked(reader) -> bytes:
+    body = bytearray()
+    while True:
+        size = int((await reader.readuntil(b"\r\n")).split(b";", 1)[0], 16)
+        if size == 0:
+            # Skip any trailers up to the blank line.
+            while await reader.readuntil(b"\r\n") != b"\r\n":
+                pass
+            return bytes(body)
+        body += await reader.readexactly(size)
+        await reader.readexactly(2)
+
+
+class Stats:
+    def __init__(self):
+        self.started = time.time()
+        self.connections_open = 0
+        self.connections_total = 0
+        self.requests = 0
+        self.reused = 0
+        self.statuses = {}
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.injected_latency = 0.0
+
+    def to_dict(self) -> dict:
+        return {
+            "uptime_s": time.time() - self.started,
+            "connections_open": self.connections_open,
+            "connections_total": self.connections_total,
+            "requests": self.requests,
+            "keepalive_reused": self.reused,
+            "statuses": {
+                str(status): count for status, count in sorted(self.statuses.items())
+            },
+            "bytes_in": self.bytes_in,
+            "bytes_out": self.bytes_out,
+            "injected_latency_s": self.injected_latency,
+        }
+
+
+class EchoServer:
+    def __init__(self, config):
+        self.config = config
+        self.stats = Stats()
+        self.body_cache = {}
+
+    def body_of_size(self, size: int) -> bytes:
+        if size not in self.body_cache:
+            self.body_cache[size] = (b"It Works! " * (size // 10 + 1))[:size]
+        return self.body_cache[size]
+
+    async def handle_connection(self, reader, writer):
+        self.stats.connections_open += 1
+        self.stats.connections_total += 1
+        served = 0
+        try:
+            while True:
+                try:
+                    head = await asyncio.wait_for(
+                        reader.readuntil(b"\r\n\r\n"), self.config.keepalive_timeout
+                    )
+                except (
+                    asyncio.TimeoutError,
+                    asyncio.IncompleteReadError,
+                    asyncio.LimitOverrunError,
+                ):
+                    return
+                if served:
+                    self.stats.reused += 1
+                served += 1
+                keep_alive = await self.handle_request(head, reader, writer)
+                if not keep_alive:
+                    return
+        except (ConnectionError, ValueError):
             return
-        body = self.rfile.read(content_length)
+        finally:
+            self.stats.connections_open -= 1
+            writer.close()
+
+    async def handle_request(self, head: bytes, reader, writer) -> bool:
+        lines = head.decode("latin-1").split("\r\n")
+        method, target, version = lines[0].split(" ", 2)
+        headers = {}
+        for line in lines[1:]:
+            if line:
+                name, _, value = line.partition(":")
+                headers[name.strip().lower()] = value.strip()
+        if headers.get("transfer-encoding", "").lower() == "chunked":
+            body = await read_chunked(reader)
+        else:
+            length = int(headers.get("content-length") or 0)
+            body = await reader.readexactly(length) if length else b""
+        self.stats.requests += 1
+        self.stats.bytes_in += len(head) + len(body)
+
+        connection = headers.get("connection", "").lower()
+        keep_alive = (
+            connection != "close"
+            if version == "HTTP/1.1"
+            else connection == "keep-alive"
+        )
+        if self.config.verbose:
+            print(f"{method} {target} {len(body)} bytes")
+
+        url = urlsplit(target)
+        if url.path == STATS_PATH:
+            payload = json.dumps(self.stats.to_dict()).encode()
+            await self.respond(writer, 200, payload, keep_alive, "application/json")
+            return keep_alive
+
+        params = dict(parse_qsl(url.query))
+        try:
+            delay = sample_latency(params.get("latency", self.config.latency))
+            error_rate = float(params.get("error", self.config.error))
+            size = int(params.get("size", self.config.size))
+            chunks = int(params.get("chunks", self.config.chunks))
+            chunk_delay = float(params.get("chunk_delay", self.config.chunk_delay))
+            error_status = int(params.get("error_status", self.config.error_status))
+            if not 100 <= error_status <= 599:
+                raise ValueError(
+                    f"error_status must be an HTTP status, not {error_status}"
+                )
+        except (ValueError, OverflowError) as exc:
+            await self.respond(writer, 400, str(exc).encode(), keep_alive)
+            return keep_alive
+
+        if delay > 0:
+            self.stats.injected_latency += delay
+            await asyncio.sleep(delay)
+        if random.random() < error_rate:
+            await self.respond(writer, error_status, b"Injected failure", keep_alive)
+            return keep_alive
+
+        if method == "POST" or (method == "PUT" and body):
+            payload = body
+        elif size >= 0:
+            payload = self.body_of_size(size)
+        else:
+            payload = b"It Works!"
+        if chunks > 0:
+            await self.stream(writer, payload, chunks, chunk_delay, keep_alive)
+        else:
+            await self.respond(writer, 200, payload, keep_alive)
+        return keep_alive
+
+    def head(
+        self, status: int, keep_alive: bool, content_type: str, extra: str
+    ) -> bytes:
+        return (
+            f"HTTP/1.1 {status} {REASONS.get(status, 'Unknown')}\r\n"
+            f"Content-Type: {content_type}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n"
+            f"{extra}\r\n"
+        ).encode()
+
+    async def respond(
+        self,
+        writer,
+        status: int,
+        payload: bytes,
+        keep_alive: bool,
+        content_type="text/plain",
+    ):
+        head = self.head(
+            status, keep_alive, content_type, f"Content-Length: {len(payload)}\r\n"
+        )
+        writer.write(head + payload)
+        await writer.drain()
+        self.stats.statuses[status] = self.stats.statuses.get(status, 0) + 1
+        self.stats.bytes_out += len(head) + len(payload)
+
+    async def stream(
+        self, writer, payload: bytes, chunks: int, delay: float, keep_alive: bool
+    ):
+        head = self.head(
+            200, keep_alive, "text/plain", "Transfer-Encoding: chunked\r\n"
+        )
+        writer.write(head)
+        sent = len(head)
+        step = max(len(payload) // chunks, 1)
+        for start in range(0, len(payload), step):
+            piece = payload[start : start + step]
+            frame = f"{len(piece):x}\r\n".encode() + piece + b"\r\n"
+            writer.write(frame)
+            await writer.drain()
+            sent += len(frame)
+            await asyncio.sleep(delay)
+        writer.write(b"0\r\n\r\n")
+        await writer.drain()
+        self.stats.statuses[200] = self.stats.statuses.get(200, 0) + 1
+        self.stats.bytes_out += sent + 5
+
 
-        self.send_response(200)
-        self.end_headers()
-        self.wfile.write(body)
+async def main(argv=None):
+    config = parse_args(argv)
+    sample_latency(config.latency)  # Fail fast on a bad spec.
+    echo = EchoServer(config)
+    server = await asyncio.start_server(
+        echo.handle_connection,
+        config.host,
+        config.port,
+        limit=MAX_HEADER_BYTES,
+        backlog=1024,
+    )
+    print(f"Listening on port :{config.port}")
+    async with server:
+        await server.serve_forever()
 
 
-print("Listening on port :6969")
-httpd = HTTPServer(("0.0.0.0", 6969), MyHandler)
-httpd.serve_forever()
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,233 @@
+import os
+import time
+import asyncio
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+from starlette.responses import Response
+
+# Requests that didn't match any route share one label instead of one per URL.
+UNMATCHED_ROUTE = "<unmatched>"
+
+# Interactive game traffic: most requests should land well under 100 ms, the
+# long tail (bcrypt logins, big listings) up to a couple of seconds.
+LATENCY_BUCKETS = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.075,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+)
+SIZE_BUCKETS = (64, 256, 1024, 4096, 16384, 65536, 262144, 1048576)
+WEBSOCKET_SAMPLE_INTERVAL = float(os.getenv("WEBSOCKET_SAMPLE_INTERVAL", 1))
+
+# --- Prometheus Metrics ---
+REQUEST_COUNT = Counter(
+    "request_count",
+    "Total number of HTTP requests",
+    ["method", "endpoint", "http_status"],
+)
+REQUEST_DURATION = Histogram(
+    "request_duration_seconds",
+    "HTTP request duration by route template",
+    ["method", "endpoint"],
+    buckets=LATENCY_BUCKETS,
+)
+RESPONSE_SIZE = Histogram(
+    "response_size_bytes",
+    "HTTP response body size by route template",
+    ["method", "endpoint"],
+    buckets=SIZE_BUCKETS,
+)
+REQUESTS_IN_FLIGHT = Gauge(
+    "requests_in_flight",
+    "HTTP requests currently being served",
+    multiprocess_mode="livesum",
+)
+WEBSOCKET_CONNECTIONS = Gauge(
+    "websocket_connections",
+    "Open WebSocket connections per session",
+    ["session_id"],
+    multiprocess_mode="livesum",
+)
+WEBSOCKET_QUEUE_DEPTH = Gauge(
+    "websocket_send_queue_depth",
+    "Frames waiting in send queues per session",
+    ["session_id"],
+    multiprocess_mode="livesum",
+)
+WEBSOCKET_MESSAGES_RECEIVED = Counter(
+    "websocket_messages_received", "Chat messages received from players"
+)
+WEBSOCKET_FRAMES_SENT = Counter(
+    "websocket_frames_sent", "Frames queued for delivery to players"
+)
+WEBSOCKET_FRAMES_DROPPED = Counter(
+    "websocket_frames_dropped", "Frames dropped because a send queue was full"
+)
+STARTUP_DURATION = Gauge(
+    "startup_duration_seconds",
+    "Seconds from process start until the app finished its startup",
+    multiprocess_mode="max",
+)
+TIME_TO_FIRST_REQUEST = Gauge(
+    "time_to_first_request_seconds",
+    "Seconds from process start until the first HTTP request was answered",
+    multiprocess_mode="max",
+)
+
+
+def process_start_time() -> float:
+    """Wall-clock time this process was started, from /proc when available."""
+    try:
+        with open("/proc/self/stat") as f:
+            start_ticks = int(f.read().rsplit(")", 1)[1].split()[19])
+        with open("/proc/stat") as f:
+            boot_time = next(
+                int(line.split()[1]) for line in f if line.startswith("btime")
+            )
+        return boot_time + start_ticks / os.sysconf("SC_CLK_TCK")
+    except (OSError, ValueError, StopIteration):
+        return _IMPORTED_AT
+
+
+_IMPORTED_AT = time.time()
+PROCESS_STARTED_AT = process_start_time()
+
+
+def mark_started() -> float:
+    """Record the cold-start time; call at the end of the lifespan startup."""
+    elapsed = time.time() - PROCESS_STARTED_AT
+    STARTUP_DURATION.set(elapsed)
+    print(f"Started in {elapsed:.3f}s")
+    return elapsed
+
+
+class PrometheusMiddleware:
+    """Pure ASGI middleware recording request count, latency, size and concurrency.
+
+    Requests are labelled with the matched route template (`/user/{user_id}`),
+    never the raw path, so the number of series stays bounded.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        # (method, endpoint, status) -> labelled children; `.labels()` is the
+        # expensive part of recording, and the key space is small and bounded.
+        self._children = {}
+        self._first_request_seen = False
+
+    def _metrics_for(self, method, endpoint, status_code):
+        key = (method, endpoint, status_code)
+        children = self._children.get(key)
+        if children is None:
+            children = self._children[key] = (
+                REQUEST_COUNT.labels(method, endpoint, status_code),
+                REQUEST_DURATION.labels(method, endpoint),
+                RESPONSE_SIZE.labels(method, endpoint),
+            )
+        return children
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500
+        size = 0
+
+        async def send_wrapper(message):
+            nonlocal status_code, size
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            elif message["type"] == "http.response.body":
+                size += len(message.get("body", b""))
+            await send(message)
+
+        REQUESTS_IN_FLIGHT.inc()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            duration = time.perf_counter() - started
+            REQUESTS_IN_FLIGHT.dec()
+            # The router stores the matched route in the scope on the way in.
+            route = scope.get("route")
+            endpoint = getattr(route, "path", None) or UNMATCHED_ROUTE
+            count, latency, response_size = self._metrics_for(
+                scope["method"], endpoint, status_code
+            )
+            count.inc()
+            latency.observe(duration)
+            response_size.observe(size)
+            if not self._first_request_seen:
+                self._first_request_seen = True
+                TIME_TO_FIRST_REQUEST.set(time.time() - PROCESS_STARTED_AT)
+
+
+async def sample_websocket_stats(snapshot, interval: float = WEBSOCKET_SAMPLE_INTERVAL):
+    """Copy WebSocket room stats into metrics periodically, off the broadcast path.
+
+    `snapshot()` must return {"rooms": {session_id: {"connections": int,
+    "queue_depth": int}}, "messages_received": int, "frames_sent": int,
+    "frames_dropped": int}; the three totals only ever grow.
+    """
+    exported = {"messages_received": 0, "frames_sent": 0, "frames_dropped": 0}
+    counters = {
+        "messages_received": WEBSOCKET_MESSAGES_RECEIVED,
+        "frames_sent": WEBSOCKET_FRAMES_SENT,
+        "frames_dropped": WEBSOCKET_FRAMES_DROPPED,
+    }
+    sessions = set()
+    while True:
+        stats = snapshot()
+        for name, counter in counters.items():
+            counter.inc(stats[name] - exported[name])
+            exported[name] = stats[name]
+        for session_id, room in stats["rooms"].items():
+            WEBSOCKET_CONNECTIONS.labels(session_id).set(room["connections"])
+            WEBSOCKET_QUEUE_DEPTH.labels(session_id).set(room["queue_depth"])
+        for session_id in sessions - stats["rooms"].keys():
+            # Zero before removing: in multiprocess mode the last value would linger.
+            for gauge in (WEBSOCKET_CONNECTIONS, WEBSOCKET_QUEUE_DEPTH):
+                gauge.labels(session_id).set(0)
+                gauge.remove(session_id)
+        sessions = set(stats["rooms"].keys())
+        await asyncio.sleep(interval)
+
+
+# With several workers every process writes its samples to PROMETHEUS_MULTIPROC_DIR
+# and /metrics aggregates them, whichever worker happens to serve the scrape.
+_multiprocess_registry = None
+
+
+def metrics_response() -> Response:
+    global _multiprocess_registry
+    if "PROMETHEUS_MULTIPROC_DIR" not in os.environ:
+        return Response(content=generate_latest(), media_type=CONTENT_TYPE_LATEST)
+    if _multiprocess_registry is None:
+        _multiprocess_registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(_multiprocess_registry)
+    return Response(
+        content=generate_latest(_multiprocess_registry), media_type=CONTENT_TYPE_LATEST
+    )
+
+
+def shutdown_metrics():
+    """Drop this worker's live gauges from the multiprocess aggregate."""
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        multiprocess.mark_process_dead(os.getpid())
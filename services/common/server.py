@@ -0,0 +1,135 @@
+import os
+import glob
+import asyncio
+import tempfile
+
+import uvicorn
+from uvicorn.supervisors import ChangeReload, Multiprocess
+
+# --- Serving settings ---
+# Worker processes per container; each one runs its own event loop on its own core.
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", 1))
+# Development only: restart the server when the code changes.
+RELOAD = os.getenv("RELOAD", "false").lower() == "true"
+# Seconds in-flight requests get to finish on shutdown or on a SIGHUP worker restart.
+GRACEFUL_SHUTDOWN_TIMEOUT = float(os.getenv("GRACEFUL_SHUTDOWN_TIMEOUT", 30))
+# Negotiate permessage-deflate with WebSocket clients that offer it.
+WS_PER_MESSAGE_DEFLATE = os.getenv("WS_PER_MESSAGE_DEFLATE", "true").lower() == "true"
+# Protocol-level WebSocket pings; every client library answers them, and a
+# socket that doesn't within WS_PING_TIMEOUT is closed as half-open.
+WS_PING_INTERVAL = float(os.getenv("WS_PING_INTERVAL", 20))
+WS_PING_TIMEOUT = float(os.getenv("WS_PING_TIMEOUT", 20))
+# Largest WebSocket message uvicorn accepts; bigger ones are refused while they
+# arrive, before they're buffered, and the connection is closed with 1009.
+WS_MAX_SIZE = int(os.getenv("WS_MAX_SIZE", 16 * 1024 * 1024))
+# Development only: apply schema migrations on startup instead of running
+# migrate.py first.
+RUN_MIGRATIONS = os.getenv("RUN_MIGRATIONS", "false").lower() == "true"
+# Startup waits at most this long for connection pools to warm; they fill
+# lazily otherwise.
+WARMUP_TIMEOUT = float(os.getenv("WARMUP_TIMEOUT", 2))
+# Seconds the app's drain hooks get on shutdown, before uvicorn closes the
+# remaining connections.
+DRAIN_TIMEOUT = float(os.getenv("DRAIN_TIMEOUT", 10))
+
+# --- Drain hooks ---
+# uvicorn closes open WebSockets (1012) before the lifespan shutdown runs, so
+# anything that must happen while clients are still connected is registered
+# here and awaited first, with the listener still open.
+_drain_hooks = []
+
+
+def add_drain_hook(hook):
+    """Register `async hook(timeout)` to run when the server starts shutting down."""
+    _drain_hooks.append(hook)
+
+
+def remove_drain_hook(hook):
+    if hook in _drain_hooks:
+        _drain_hooks.remove(hook)
+
+
+class DrainingServer(uvicorn.Server):
+    async def shutdown(self, sockets=None):
+        if _drain_hooks and not self.force_exit:
+            print(f"Draining connections for up to {DRAIN_TIMEOUT}s")
+            try:
+                await asyncio.wait_for(
+                    asyncio.gather(
+                        *(hook(DRAIN_TIMEOUT) for hook in list(_drain_hooks))
+                    ),
+                    DRAIN_TIMEOUT + 1,
+                )
+            except asyncio.TimeoutError:
+                print("Drain timed out, closing the remaining connections")
+        await super().shutdown(sockets=sockets)
+
+
+async def warm_up(name: str, warmer, timeout: float = WARMUP_TIMEOUT):
+    """Await `warmer` (a coroutine) for at most `timeout`.
+
+    A failure only costs the first requests, which open connections themselves.
+    """
+    try:
+        await asyncio.wait_for(warmer, timeout)
+    except Exception as exc:
+        print(f"Warming {name} failed, connections will open on demand: {exc!r}")
+
+
+def prepare_metrics_dir(workers: int):
+    """Point prometheus_client at a shared directory, so metrics add up across workers.
+
+    The workers are spawned as fresh interpreters, so setting the variable here,
+    before they start, is enough for them to pick multiprocess mode.
+    """
+    if workers <= 1:
+        return None
+    path = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+    if path:
+        os.makedirs(path, exist_ok=True)
+        # Samples from a previous run would otherwise be added to this one.
+        for stale in glob.glob(os.path.join(path, "*.db")):
+            os.remove(stale)
+    else:
+        path = tempfile.mkdtemp(prefix="prometheus-")
+        os.environ["PROMETHEUS_MULTIPROC_DIR"] = path
+    return path
+
+
+def serve(
+    app: str,
+    port,
+    workers: int = WEB_CONCURRENCY,
+    reload: bool = RELOAD,
+    ws_max_size: int = WS_MAX_SIZE,
+):
+    """Run `app` ("module:attribute") under uvicorn, with one or more workers.
+
+    uvicorn picks uvloop and httptools automatically when they are installed.
+    Sending SIGHUP to the supervisor restarts the workers. On SIGTERM each
+    worker runs its drain hooks, then drains its requests within
+    GRACEFUL_SHUTDOWN_TIMEOUT.
+    """
+    prepare_metrics_dir(workers)
+    config = uvicorn.Config(
+        app,
+        host="0.0.0.0",
+        port=int(port),
+        workers=workers,
+        reload=reload,
+        loop="auto",
+        http="auto",
+        timeout_graceful_shutdown=GRACEFUL_SHUTDOWN_TIMEOUT,
+        ws_per_message_deflate=WS_PER_MESSAGE_DEFLATE,
+        ws_max_size=ws_max_size,
+        ws_ping_interval=WS_PING_INTERVAL,
+        ws_ping_timeout=WS_PING_TIMEOUT,
+    )
+    # Same dispatch as uvicorn.run(), but with the draining server.
+    server = DrainingServer(config=config)
+    if config.should_reload:
+        ChangeReload(config, target=server.run, sockets=[config.bind_socket()]).run()
+    elif config.workers > 1:
+        Multiprocess(config, target=server.run, sockets=[config.bind_socket()]).run()
+    else:
+        server.run()
@@ -0,0 +1,95 @@
+import os
+import jwt
+import time
+import hashlib
+import datetime
+from collections import OrderedDict
+
+# Shared by the user service, which issues tokens, and the session service,
+# which verifies them on join.
+SECRET_KEY = os.getenv("JWT_SECRET", "mysecretkey")  # Change this to a secure key
+
+# --- Verified token cache ---
+# The gateway revalidates the same tokens on nearly every request, so verified
+# claims are kept until the token's own expiry instead of re-running the HMAC.
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", 50_000))
+
+
+def create_jwt(payload: dict, expires_in=3600):
+    expiration = datetime.datetime.now() + datetime.timedelta(seconds=expires_in)
+    payload["exp"] = expiration  # Add expiration
+    token = jwt.encode(payload, SECRET_KEY, algorithm="HS256")
+    return token
+
+
+def decode_jwt(token: str):
+    try:
+        decoded_payload = jwt.decode(token, SECRET_KEY, algorithms=["HS256"])
+        return decoded_payload
+    except jwt.ExpiredSignatureError:
+        return "Token has expired"
+    except jwt.InvalidTokenError:
+        return "Invalid token"
+
+
+class TokenCache:
+    """Bounded LRU of verified claims, keyed by a token digest, evicted at `exp`."""
+
+    def __init__(self, maxsize: int = TOKEN_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()  # sha256(token) -> (exp, claims)
+
+    @staticmethod
+    def _key(token: str) -> bytes:
+        return hashlib.sha256(token.encode()).digest()
+
+    def get(self, token: str):
+        key = self._key(token)
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        exp, claims = entry
+        if exp <= time.time():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return claims
+
+    def put(self, token: str, claims: dict):
+        exp = claims.get("exp")
+        # Tokens without an expiry can't be evicted on time, so they're never cached.
+        if not isinstance(exp, (int, float)):
+            return
+        self._entries[self._key(token)] = (exp, claims)
+        if len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        self._entries.clear()
+
+
+token_cache = TokenCache()
+
+
+def verify_token(token: str):
+    """Return the token's claims if it is valid, otherwise None."""
+    claims = token_cache.get(token)
+    if claims is not None:
+        return claims
+    response = decode_jwt(token)
+    if not isinstance(response, dict):
+        return None
+    token_cache.put(token, response)
+    return response
+
+
+def is_token_valid(token: str) -> bool:
+    return verify_token(token) is not None
+
+
+# # Example Usage
+# token = create_jwt({"user_id": 123})
+# print("Generated Token:", token)
+
+# decoded = decode_jwt(token)
+# print("Decoded Payload:", decoded)
@@ -1,66 +1,186 @@
 import os
+import json
+import time
 import uuid
-import uvicorn
+import asyncio
 import datetime
 from typing import Optional
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Request
-from fastapi.responses import JSONResponse, Response
-from motor.motor_asyncio import AsyncIOMotorClient
-from prometheus_client import Counter, generate_latest, CONTENT_TYPE_LATEST
-
-
-from models.session import Session, SessionRequest
-
-app = FastAPI(docs_url="/session/docs", openapi_url="/session/openapi.json")
-
-# --- MongoDB Setup ---
-# Use the MONGO_URL from environment or default to a Docker Compose host name.
-MONGO_URL = os.getenv("MONGO_URL", "mongodb://mongodb:27017")
-mongo_client = AsyncIOMotorClient(MONGO_URL)
-db = mongo_client.fastapi_db  # Database name: fastapi_db
-sessions_collection = db.sessions  # Collection name: sessions
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect
+from fastapi.responses import JSONResponse, StreamingResponse
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from common.instrumentation import (
+    PrometheusMiddleware,
+    mark_started,
+    metrics_response,
+    sample_websocket_stats,
+    shutdown_metrics,
+)
+from common.server import (
+    RUN_MIGRATIONS,
+    WEB_CONCURRENCY,
+    add_drain_hook,
+    remove_drain_hook,
+    serve,
+    warm_up,
+)
+from migrate import migrate
+from models.session import Session, SessionRequest, SessionUsersRequest
+from repository.db import (
+    sessions_collection,
+    events_collection,
+    snapshots_collection,
+    archive_collection,
+    warm_up as warm_up_mongo,
+)
+from repository.diagnostics import explain_hot_queries
+from utils.auth import (
+    AUTH_FAILED_CLOSE_CODE,
+    AUTH_UNAVAILABLE_CLOSE_CODE,
+    AuthUnavailable,
+    JoinAuthenticator,
+)
+from utils.cache import SessionCache
+from utils.broadcast import SERVICE_RESTART_CLOSE_CODE, BroadcastHub, Handoff
+from utils.backplane import create_backplane, InMemoryBackplane
+from utils.eventlog import EventLog
+from utils.expiry import SessionReaper, expiry_date
+from utils.presence import API_NODE, PresenceWriter, presence_update
+from utils.limits import (
+    CONNECTIONS_REAPED,
+    HANDSHAKE_TIMEOUT,
+    MAX_MESSAGE_BYTES,
+    MESSAGE_TOO_BIG_CLOSE_CODE,
+    MESSAGES_OVERSIZED,
+    REAPED_CLOSE_CODE,
+    MessageTooBig,
+)
+from utils.protocol import (
+    BINARY_SUBPROTOCOL,
+    EVENT_TYPES,
+    PONG,
+    Control,
+    unpack_client_frame,
+)
+from utils.resume import check_resume_secret, read_resume_token
+from utils.pagination import (
+    DEFAULT_PAGE_SIZE,
+    MAX_PAGE_SIZE,
+    PROJECTION,
+    SORT_ORDER,
+    after_cursor,
+    encode_cursor,
+)
 
 # --- In-memory storage for active WebSocket connections ---
-# Keys are session IDs; values are lists of active WebSocket connections.
-active_connections = {}
-
-# --- Prometheus Metrics ---
-REQUEST_COUNT = Counter(
-    "request_count",
-    "Total number of HTTP requests",
-    ["method", "endpoint", "http_status"],
+# The hub keeps one room per session ID and a writer task per connection; the
+# backplane relays broadcasts and active rooms between session-service replicas,
+# and the event log records every broadcast so reconnecting players can resume.
+# Joins and leaves are written behind to the sessions' active_users.
+event_log = EventLog(events_collection, snapshots_collection)
+presence = PresenceWriter(sessions_collection)
+hub = BroadcastHub(backplane=create_backplane(), event_log=event_log, presence=presence)
+
+# --- Session document cache ---
+# Serves the allowed_users check on WebSocket joins without a Mongo round trip.
+session_cache = SessionCache(sessions_collection)
+
+
+# --- Session expiry ---
+# Evicts empty rooms from memory and moves finished sessions to the archive.
+def forget_archived(session_ids: list):
+    for session_id in session_ids:
+        session_cache.invalidate(session_id)
+
+
+reaper = SessionReaper(
+    hub,
+    sessions_collection,
+    archive_collection,
+    snapshots_collection,
+    on_archived=forget_archived,
 )
 
+# --- Join authentication ---
+# Checks the player's token on join, locally or through the user service.
+join_auth = JoinAuthenticator()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Refuse to start with a resume token secret anyone could know.
+    check_resume_secret()
+    # Collections and indexes are created by migrate.py, run once per deploy.
+    if RUN_MIGRATIONS:
+        await migrate()
+    await asyncio.gather(
+        warm_up("mongo", warm_up_mongo()),
+        warm_up("user service", join_auth.warm_up()),
+    )
+    await hub.start()
+    cache_watcher = asyncio.create_task(session_cache.watch())
+    # Connections, queue depth and message counts are copied from the hub periodically.
+    stats_sampler = asyncio.create_task(sample_websocket_stats(hub.stats))
+    reaper_task = asyncio.create_task(reaper.run())
+    # On SIGTERM players are handed off to other replicas before uvicorn closes
+    # their sockets.
+    add_drain_hook(hub.drain)
+    mark_started()
+    yield
+    remove_drain_hook(hub.drain)
+    cache_watcher.cancel()
+    stats_sampler.cancel()
+    reaper_task.cancel()
+    await hub.stop()
+    await join_auth.close()
+    shutdown_metrics()
+
+
+app = FastAPI(
+    docs_url="/session/docs",
+    openapi_url="/session/openapi.json",
+    lifespan=lifespan,
+)
 
-# --- Middleware for Request Counting ---
-@app.middleware("http")
-async def metrics_middleware(request: Request, call_next):
-    response = await call_next(request)
-    # Increment the counter with the method, path, and response status code.
-    REQUEST_COUNT.labels(
-        method=request.method,
-        endpoint=request.url.path,
-        http_status=response.status_code,
-    ).inc()
-    return response
+# --- Prometheus Metrics ---
+# Request count, latency, response size and in-flight requests per route template.
+app.add_middleware(PrometheusMiddleware)
 
 
 # --- Metrics Endpoint for Prometheus ---
 @app.get("/metrics")
 async def metrics():
-    metrics_data = generate_latest()
-    return Response(content=metrics_data, media_type=CONTENT_TYPE_LATEST)
+    return metrics_response()
 
 
 @app.get("/session/status")
 async def status():
+    # Readiness: a draining replica reports unhealthy so no new players are routed here.
+    if hub.draining:
+        return JSONResponse(content={"message": "draining"}, status_code=503)
     return JSONResponse(content={"message": "healthy"}, status_code=200)
 
 
+@app.get("/session/diagnostics/indexes")
+async def index_diagnostics():
+    # Explain every hot query; a collection scan means an index is missing.
+    report = await explain_hot_queries()
+    collscans = [name for name, result in report.items() if result["collscan"]]
+    return JSONResponse(
+        content={"queries": report, "collscans": collscans},
+        status_code=500 if collscans else 200,
+    )
+
+
 @app.get("/session")
 async def list_sessions(
     session_id: Optional[str] = None,
     active: Optional[bool] = False,
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    stream: Optional[bool] = False,
 ):
     if session_id and active:
         return JSONResponse(
@@ -68,27 +188,57 @@ async def list_sessions(
             status_code=400,
         )
     if session_id:
-        session = await sessions_collection.find_one({"session_id": session_id})
-        if session:
-            session.pop("_id", None)
+        session = await sessions_collection.find_one(
+            {"session_id": session_id}, projection=PROJECTION
+        )
         return JSONResponse(
-            content={"sessions": [session.model_dump()] if session else []},
+            content={"sessions": [session] if session else []},
             status_code=200,
         )
+    if limit is not None and not 1 <= limit <= MAX_PAGE_SIZE:
+        return JSONResponse(
+            content={"message": f"limit must be between 1 and {MAX_PAGE_SIZE}."},
+            status_code=400,
+        )
+    query = {}
     if active:
-        # Filter sessions that have active connections (based on our in-memory store)
-        active_ids = list(active_connections.keys())
-        cursor = sessions_collection.find({"session_id": {"$in": active_ids}})
-        sessions_list = await cursor.to_list(length=None)
-        for doc in sessions_list:
-            doc.pop("_id", None)
-        return JSONResponse(content={"sessions": sessions_list}, status_code=200)
-    # Return all sessions from the database.
-    cursor = sessions_collection.find({})
-    sessions_list = await cursor.to_list(length=None)
-    for doc in sessions_list:
-        doc.pop("_id", None)
-    return JSONResponse(content={"sessions": sessions_list}, status_code=200)
+        # Sessions with players on any replica, as written by the presence writer.
+        query = {"active": True}
+    try:
+        query = after_cursor(query, cursor)
+    except ValueError as exc:
+        return JSONResponse(content={"message": str(exc)}, status_code=400)
+
+    if stream:
+        # Stream every matching session as NDJSON while the cursor produces it.
+        db_cursor = sessions_collection.find(query, projection=PROJECTION).sort(
+            SORT_ORDER
+        )
+        if limit is not None:
+            db_cursor = db_cursor.limit(limit)
+
+        async def ndjson():
+            async for doc in db_cursor:
+                yield json.dumps(doc) + "\n"
+
+        return StreamingResponse(ndjson(), media_type="application/x-ndjson")
+
+    # Fetch one extra document to know whether there is a next page.
+    page_size = limit or DEFAULT_PAGE_SIZE
+    db_cursor = (
+        sessions_collection.find(query, projection=PROJECTION)
+        .sort(SORT_ORDER)
+        .limit(page_size + 1)
+    )
+    sessions_list = await db_cursor.to_list(length=page_size + 1)
+    next_cursor = None
+    if len(sessions_list) > page_size:
+        sessions_list = sessions_list[:page_size]
+        next_cursor = encode_cursor(sessions_list[-1])
+    return JSONResponse(
+        content={"sessions": sessions_list, "next_cursor": next_cursor},
+        status_code=200,
+    )
 
     # if session_id and active:
     #     return JSONResponse(
@@ -121,15 +271,21 @@ async def list_sessions(
 @app.post("/session")
 async def create_session():
     session_id = str(uuid.uuid4())
+    created_at = datetime.datetime.now().timestamp()
     session_data = {
         "session_id": session_id,
-        "created_at": datetime.datetime.now().timestamp(),
+        "created_at": created_at,
+        "last_activity": created_at,
+        "expire_at": expiry_date(),
         "allowed_users": [],
+        "presence": [],
         "active_users": [],
+        "active": False,
+        "version": 0,
     }
     await sessions_collection.insert_one(session_data)
     # Initialize the in-memory active connections for this session.
-    active_connections[session_id] = []
+    hub.open_room(session_id)
     return JSONResponse(
         content={"message": "Session created.", "session_id": session_id},
         status_code=201,
@@ -145,19 +301,43 @@ async def create_session():
 
 @app.put("/session")
 async def update_session(session: Session):
-    existing = await sessions_collection.find_one({"session_id": session.session_id})
+    # Upsert the session document (update if exists, insert otherwise); the
+    # pre-image tells us whether it existed without a separate find_one. With a
+    # version the update only applies if the document is still at that version.
+    # Presence belongs to the server, so active_users is only set on insert.
+    query = {"session_id": session.session_id}
+    if session.version is not None:
+        query["version"] = version_filter(session.version)
+    try:
+        existing = await sessions_collection.find_one_and_update(
+            query,
+            {
+                "$set": {
+                    **session.model_dump(exclude={"version", "active_users"}),
+                    "expire_at": expiry_date(),
+                },
+                "$setOnInsert": {
+                    "presence": [],
+                    "active_users": [],
+                    "active": False,
+                    "last_activity": time.time(),
+                },
+                "$inc": {"version": 1},
+            },
+            projection={"_id": 1},
+            upsert=True,
+            return_document=ReturnDocument.BEFORE,
+        )
+    except DuplicateKeyError:
+        # The version didn't match, so the upsert tried to insert a second copy.
+        return await version_conflict(session.session_id)
+    session_cache.invalidate(session.session_id)
     if not existing:
         status_code_resp = 400
         message = "Session didn't exist, so it was created."
     else:
         status_code_resp = 200
         message = "Session updated."
-    # Upsert the session document (update if exists, insert otherwise)
-    await sessions_collection.update_one(
-        {"session_id": session.session_id},
-        {"$set": session.model_dump()},
-        upsert=True,
-    )
     return JSONResponse(content={"message": message}, status_code=status_code_resp)
 
     # response = {}
@@ -174,15 +354,100 @@ async def update_session(session: Session):
     # return response
 
 
+def version_filter(version: int):
+    # Sessions written before versioning have no version field; they are at 0.
+    return {"$in": [0, None]} if version == 0 else version
+
+
+async def version_conflict(session_id: str) -> JSONResponse:
+    current = await sessions_collection.find_one(
+        {"session_id": session_id}, projection={"_id": 0, "version": 1}
+    )
+    if current is None:
+        return JSONResponse(
+            content={"message": "Session wasn't found."}, status_code=400
+        )
+    return JSONResponse(
+        content={
+            "message": "Session was changed by someone else.",
+            "version": current.get("version", 0),
+        },
+        status_code=409,
+    )
+
+
+async def update_users(
+    session_id: str, field: str, operator: str, request: SessionUsersRequest
+):
+    """Add ($addToSet) or remove ($pull) players from one of the session's lists."""
+    query = {"session_id": session_id}
+    if request.expected_version is not None:
+        query["version"] = version_filter(request.expected_version)
+    if field == "active_users":
+        # Same update the presence writer uses, so the `active` flag stays in step.
+        joined, left = (
+            (request.users, ()) if operator == "$addToSet" else ((), request.users)
+        )
+        # Removing a player clears them from every replica's entries.
+        update = presence_update(API_NODE, joined, left, everywhere=True)
+        update.append(
+            {"$set": {"version": {"$add": [{"$ifNull": ["$version", 0]}, 1]}}}
+        )
+    else:
+        values = (
+            {"$each": request.users}
+            if operator == "$addToSet"
+            else {"$in": request.users}
+        )
+        update = {
+            operator: {field: values},
+            "$set": {"expire_at": expiry_date()},
+            "$inc": {"version": 1},
+        }
+    session = await sessions_collection.find_one_and_update(
+        query,
+        update,
+        projection=PROJECTION,
+        return_document=ReturnDocument.AFTER,
+    )
+    if session is None:
+        return await version_conflict(session_id)
+    session_cache.invalidate(session_id)
+    return JSONResponse(
+        content={"message": "Session updated.", "session": session}, status_code=200
+    )
+
+
+@app.post("/session/{session_id}/allowed_users")
+async def add_allowed_users(session_id: str, request: SessionUsersRequest):
+    return await update_users(session_id, "allowed_users", "$addToSet", request)
+
+
+@app.delete("/session/{session_id}/allowed_users")
+async def remove_allowed_users(session_id: str, request: SessionUsersRequest):
+    return await update_users(session_id, "allowed_users", "$pull", request)
+
+
+@app.post("/session/{session_id}/active_users")
+async def add_active_users(session_id: str, request: SessionUsersRequest):
+    return await update_users(session_id, "active_users", "$addToSet", request)
+
+
+@app.delete("/session/{session_id}/active_users")
+async def remove_active_users(session_id: str, request: SessionUsersRequest):
+    return await update_users(session_id, "active_users", "$pull", request)
+
+
 @app.delete("/session")
 async def delete_session(request: SessionRequest):
     result = await sessions_collection.delete_one({"session_id": request.session_id})
+    session_cache.invalidate(request.session_id)
     if result.deleted_count == 0:
         return JSONResponse(
             content={"message": "Session wasn't found."}, status_code=400
         )
     # Remove from active connections if present.
-    active_connections.pop(request.session_id, None)
+    await hub.close_room(request.session_id)
     return JSONResponse(content={"message": "Session was deleted."}, status_code=200)
 
     # if request.session_id not in sessions.keys():
@@ -207,46 +472,171 @@ async def create_invite(session_id: str):
     )
 
 
+async def notify(websocket: WebSocket, binary: bool, message, prefixed: bool = True):
+    """Send a server message before the player has joined a room."""
+    if binary:
+        await websocket.send_bytes(Control(message).packed)
+    else:
+        await websocket.send_text(Control(message).text if prefixed else message)
+
+
+async def receive_frame(websocket: WebSocket, types=None) -> tuple:
+    """Next (type, data) from the player; text frames are chat messages or "pong"."""
+    message = await websocket.receive()
+    if message["type"] == "websocket.disconnect":
+        raise WebSocketDisconnect(message.get("code", 1000))
+    text = message.get("text")
+    if text is not None:
+        if len(text.encode()) > MAX_MESSAGE_BYTES:
+            raise MessageTooBig(len(text.encode()))
+        return (PONG, None) if text == PONG else ("chat", text)
+    payload = message.get("bytes") or b""
+    if len(payload) > MAX_MESSAGE_BYTES:
+        raise MessageTooBig(len(payload))
+    return unpack_client_frame(payload, types)
+
+
 @app.websocket("/session/{session_id}")
 async def websocket_endpoint(websocket: WebSocket, session_id: str):
-    await websocket.accept()
+    # Clients offering the msgpack subprotocol get typed, coalesced binary frames.
+    binary = BINARY_SUBPROTOCOL in websocket.scope.get("subprotocols", ())
+    await websocket.accept(subprotocol=BINARY_SUBPROTOCOL if binary else None)
+
+    if hub.draining:
+        # Shutting down: send the player straight to another replica.
+        await notify(websocket, binary, {"reconnect": True, "session_id": session_id})
+        await websocket.close(code=SERVICE_RESTART_CLOSE_CODE)
+        return
 
-    # Check if the session exists in the database.
-    session = await sessions_collection.find_one({"session_id": session_id})
+    # Check if the session exists (served from the cache when possible).
+    session = await session_cache.get(session_id)
     if not session:
-        await websocket.send_text("Session does not exist. Please create it first.")
+        await notify(
+            websocket,
+            binary,
+            "Session does not exist. Please create it first.",
+            prefixed=False,
+        )
         await websocket.close()
         return
 
-    name = await websocket.receive_text()
+    # Players handed off by a draining replica present their resume token
+    # (?resume=<token>) instead of the name handshake and pick up where they left off.
+    resume_token = websocket.query_params.get("resume")
+    last_seq = websocket.query_params.get("last_seq")
+    if resume_token is not None:
+        try:
+            name, resumed_seq = read_resume_token(resume_token, session_id)
+        except ValueError as exc:
+            await notify(websocket, binary, str(exc), prefixed=False)
+            await websocket.close(code=REAPED_CLOSE_CODE)
+            return
+        last_seq = str(resumed_seq)
+        # Resume tokens are only issued to players who were allowed one.
+        resumable = True
+    else:
+        # The first frame is the player's token or name (a "join" envelope on the binary
+        # protocol), unless the token came as ?token=; sockets that never send it are
+        # closed rather than left holding a slot.
+        try:
+            credential = websocket.query_params.get("token")
+            if credential is None:
+                _, credential = await asyncio.wait_for(
+                    receive_frame(websocket, types={"chat", "join"}), HANDSHAKE_TIMEOUT
+                )
+                if not isinstance(credential, str):
+                    raise ValueError("A join must carry the player's name or token.")
+        except asyncio.TimeoutError:
+            CONNECTIONS_REAPED.labels(reason="handshake").inc()
+            await websocket.close(code=REAPED_CLOSE_CODE)
+            return
+        except MessageTooBig:
+            MESSAGES_OVERSIZED.inc()
+            await websocket.close(code=MESSAGE_TOO_BIG_CLOSE_CODE)
+            return
+        except (ValueError, WebSocketDisconnect):
+            await websocket.close()
+            return
+        try:
+            name, verified = await join_auth.identify(credential)
+        except AuthUnavailable:
+            await notify(
+                websocket,
+                binary,
+                "Can't check your token right now, please retry.",
+                prefixed=False,
+            )
+            await websocket.close(code=AUTH_UNAVAILABLE_CLOSE_CODE)
+            return
+        except ValueError as exc:
+            await notify(websocket, binary, str(exc), prefixed=False)
+            await websocket.close(code=AUTH_FAILED_CLOSE_CODE)
+            return
+        # A resume token skips the handshake, so with tokens required only a
+        # player who presented one may get a resume token.
+        resumable = verified or not join_auth.required
     if name not in session["allowed_users"]:
-        await websocket.send_text("You are not allowed in this session.")
+        await notify(
+            websocket, binary, "You are not allowed in this session.", prefixed=False
+        )
         await websocket.close()
         return
     else:
-        await websocket.send_text("server:: You've joined.")
+        await notify(websocket, binary, "You've joined.")
+
+    # Players who pass ?last_seq=<n> get sequence-numbered frames ("<seq>#name::  msg")
+    # and, on reconnect, everything they missed since <n>.
+    sequenced = last_seq is not None
+    resume_from = int(last_seq) if sequenced and last_seq.isdigit() else 0
+
+    if hub.draining:
+        # The drain began during the handshake, after the players in the rooms
+        # were handed off, so this one is handed off here instead.
+        handoff = Handoff(session_id, name, resumable=resumable)
+        await notify(websocket, binary, handoff.control(resume_from).message)
+        await websocket.close(code=SERVICE_RESTART_CLOSE_CODE)
+        return
 
-    # Add this WebSocket connection to the in-memory active connections.
-    if session_id not in active_connections:
-        active_connections[session_id] = []
-    active_connections[session_id].append(websocket)
+    # Add this WebSocket connection to the in-memory active connections. A
+    # resuming connection's writer waits until the replay has been sent.
+    connection = hub.join(
+        session_id,
+        websocket,
+        name,
+        sequenced=sequenced,
+        binary=binary,
+        start=not sequenced,
+        resumable=resumable,
+    )
 
     try:
+        if sequenced:
+            await hub.replay(session_id, connection, resume_from)
         while True:
-            message = await websocket.receive_text()
-            # Broadcast the message to all other active connections in this session.
-            for client in active_connections[session_id]:
-                if client != websocket:
-                    await client.send_text(f"{name}::  {message}")
+            try:
+                kind, data = await receive_frame(websocket, types=EVENT_TYPES | {PONG})
+            except ValueError as exc:
+                connection.offer(Control({"error": str(exc)}))
+                continue
+            if kind == PONG:
+                hub.touch(connection)
+                continue
+            # Over the player's or the session's rate limit the message is dropped.
+            if not hub.admit(session_id, connection):
+                continue
+            # Queue the event for all other active connections in this session;
+            # each connection's writer task delivers it at its own pace.
+            await hub.broadcast(session_id, connection, data, kind)
+    except MessageTooBig as exc:
+        print(f"Closing connection in session {session_id}: {exc.args[0]} byte message")
+        MESSAGES_OVERSIZED.inc()
+        await connection.close(code=MESSAGE_TOO_BIG_CLOSE_CODE)
     except WebSocketDisconnect:
         print(f"Client disconnected from session {session_id}")
     finally:
-        active_connections[session_id].remove(websocket)
-        # Optionally, if no active connections remain, you might update the session document,
-        # for example, setting a deletion timestamp or handling cleanup.
-        if not active_connections[session_id]:
-            # Here we choose to keep the persistent session intact.
-            pass
+        await hub.leave(session_id, connection)
+        # An empty room stays until the reaper evicts it (ROOM_IDLE_TIMEOUT); the
+        # session stays in Mongo.
 
     # await websocket.accept()
 
@@ -273,4 +663,12 @@ async def websocket_endpoint(websocket: WebSocket, session_id: str):
 
 
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=os.getenv("PORT", 8001))
+    # Workers each hold their own rooms; only a shared backplane lets players
+    # connected to different workers see each other.
+    if WEB_CONCURRENCY > 1 and isinstance(hub.backplane, InMemoryBackplane):
+        raise SystemExit(
+            "WEB_CONCURRENCY > 1 needs a shared backplane, "
+            "set BACKPLANE_URL=redis://..."
+        )
+    # uvicorn refuses frames over MAX_MESSAGE_BYTES before buffering them.
+    serve("main:app", port=os.getenv("PORT", 8001), ws_max_size=MAX_MESSAGE_BYTES)
@@ -0,0 +1,67 @@
+"""Create the session service's collections and indexes.
+
+Run once per deploy, before the replicas start (the compose `session-migrate`
+service does this); every step is idempotent.
+
+    python migrate.py
+"""
+
+import asyncio
+
+from repository.db import (
+    ensure_archive,
+    ensure_event_log,
+    ensure_indexes,
+    mongo_client,
+    sessions_collection,
+)
+from utils.expiry import expiry_date
+
+
+async def reset_presence():
+    # Sessions from before per-replica presence entries have active_users
+    # without them (client-written, in the oldest ones), so start them empty and
+    # let replicas record players as they join.
+    await sessions_collection.update_many(
+        {"presence": {"$exists": False}},
+        {"$set": {"presence": [], "active_users": [], "active": False}},
+    )
+
+
+async def backfill_expiry():
+    # Older sessions get a last_activity (when they were created) for the reaper
+    # and an expire_at for the TTL index, counted from this deploy.
+    await sessions_collection.update_many(
+        {"expire_at": {"$exists": False}},
+        [
+            {
+                "$set": {
+                    "last_activity": {"$ifNull": ["$last_activity", "$created_at"]},
+                    "expire_at": expiry_date(),
+                }
+            }
+        ],
+    )
+
+
+async def backfill_version():
+    # Sessions from before optimistic concurrency start at version 0, the
+    # number a 409 reports for them.
+    await sessions_collection.update_many(
+        {"version": {"$exists": False}}, {"$set": {"version": 0}}
+    )
+
+
+async def migrate():
+    await ensure_indexes()
+    await ensure_event_log()
+    await ensure_archive()
+    await reset_presence()
+    await backfill_expiry()
+    await backfill_version()
+
+
+if __name__ == "__main__":
+    asyncio.run(migrate())
+    mongo_client.close()
+    print("Session schema is up to date.")
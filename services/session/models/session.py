@@ -1,4 +1,5 @@
 import uuid
+from typing import Optional
 from pydantic import BaseModel, Field
 
 
@@ -7,7 +8,18 @@ class SessionRequest(BaseModel):
 
 
 class Session(BaseModel):
-    session_id: str = Field(default=str(uuid.uuid4()), validate_default=True)
+    session_id: str = Field(
+        default_factory=lambda: str(uuid.uuid4()), validate_default=True
+    )
     created_at: float = Field(default=0, validate_default=True)
     allowed_users: list = Field(default_factory=list)
-    active_users: list = Field(default_factory=list)
\ No newline at end of file
+    active_users: list = Field(default_factory=list)
+    # Bumped on every write; send the version you read to update only if nobody
+    # changed it since.
+    version: Optional[int] = None
+
+
+class SessionUsersRequest(BaseModel):
+    users: list[str] = Field(min_length=1, max_length=100)
+    # Optimistic concurrency: apply only if the session is still at this version.
+    expected_version: Optional[int] = None
@@ -0,0 +1,115 @@
+import os
+import asyncio
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ASCENDING, IndexModel
+from pymongo.errors import CollectionInvalid, OperationFailure
+
+# --- MongoDB Setup ---
+# Use the MONGO_URL from environment or default to a Docker Compose host name.
+MONGO_URL = os.getenv("MONGO_URL", "mongodb://mongodb:27017")
+# Connections the pool keeps open, and how many are opened before the first request.
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", 0))
+MONGO_WARM_CONNECTIONS = int(os.getenv("MONGO_WARM_CONNECTIONS", 4))
+# connect=False: no monitor threads or sockets until the lifespan warms the pool.
+mongo_client = AsyncIOMotorClient(
+    MONGO_URL, connect=False, minPoolSize=MONGO_MIN_POOL_SIZE
+)
+db = mongo_client.fastapi_db  # Database name: fastapi_db
+sessions_collection = db.sessions  # Collection name: sessions
+# Append-only log of chat events (capped, so old events age out on their own)
+# and the latest compact snapshot of each session.
+events_collection = db.session_events
+snapshots_collection = db.session_snapshots
+EVENT_LOG_BYTES = int(os.getenv("EVENT_LOG_BYTES", 256 * 1024 * 1024))
+# Finished sessions are moved here by the reaper (utils/expiry.py), zstd-compressed,
+# and deleted for good SESSION_ARCHIVE_TTL seconds later (0 keeps them forever).
+archive_collection = db.sessions_archive
+SESSION_ARCHIVE_TTL = int(os.getenv("SESSION_ARCHIVE_TTL", 365 * 24 * 3600))
+
+# --- Indexes ---
+# Every lookup, update, delete, presence write and WebSocket join filters on
+# session_id. Listing pages through sessions in (created_at, session_id) order,
+# and the active listing does the same among sessions with players connected.
+SESSION_INDEXES = [
+    IndexModel([("session_id", ASCENDING)], unique=True, name="session_id_unique"),
+    IndexModel(
+        [("created_at", ASCENDING), ("session_id", ASCENDING)],
+        name="created_at_session_id",
+    ),
+    IndexModel(
+        [("active", ASCENDING), ("created_at", ASCENDING), ("session_id", ASCENDING)],
+        name="active_created_at_session_id",
+    ),
+    # The reaper's scan for sessions nobody has played in for a while.
+    IndexModel(
+        [("active", ASCENDING), ("last_activity", ASCENDING)],
+        name="active_last_activity",
+    ),
+    # Backstop: Mongo deletes a session once its expire_at (pushed forward by
+    # every write and presence change) passes, should the reaper never archive it.
+    IndexModel([("expire_at", ASCENDING)], expireAfterSeconds=0, name="expire_at_ttl"),
+]
+
+
+EVENT_INDEXES = [
+    IndexModel([("session_id", ASCENDING), ("seq", ASCENDING)], name="session_id_seq"),
+]
+SNAPSHOT_INDEXES = [
+    IndexModel([("session_id", ASCENDING)], unique=True, name="session_id_unique"),
+]
+ARCHIVE_INDEXES = [
+    IndexModel([("session_id", ASCENDING)], unique=True, name="session_id_unique"),
+]
+
+
+async def warm_up(connections: int = MONGO_WARM_CONNECTIONS):
+    """Open `connections` pooled connections with concurrent pings."""
+    await asyncio.gather(*(db.command("ping") for _ in range(max(connections, 1))))
+
+
+async def ensure_indexes(collection=sessions_collection):
+    """Create the indexes the hot queries rely on; a no-op when they already exist."""
+    return await collection.create_indexes(SESSION_INDEXES)
+
+
+async def ensure_event_log():
+    """Create the capped event collection and the event/snapshot indexes."""
+    try:
+        await db.create_collection(
+            events_collection.name, capped=True, size=EVENT_LOG_BYTES
+        )
+    except CollectionInvalid:
+        pass  # Already exists.
+    await events_collection.create_indexes(EVENT_INDEXES)
+    await snapshots_collection.create_indexes(SNAPSHOT_INDEXES)
+
+
+async def ensure_archive():
+    """Create the compressed archive collection, its indexes and its TTL."""
+    try:
+        await db.create_collection(
+            archive_collection.name,
+            storageEngine={"wiredTiger": {"configString": "block_compressor=zstd"}},
+        )
+    except CollectionInvalid:
+        pass  # Already exists.
+    await archive_collection.create_indexes(ARCHIVE_INDEXES)
+    if SESSION_ARCHIVE_TTL <= 0:
+        return
+    ttl_index = IndexModel(
+        [("archived_at", ASCENDING)],
+        expireAfterSeconds=SESSION_ARCHIVE_TTL,
+        name="archived_at_ttl",
+    )
+    try:
+        await archive_collection.create_indexes([ttl_index])
+    except OperationFailure:
+        # The TTL changed since the index was built; collMod updates it in place.
+        await db.command(
+            "collMod",
+            archive_collection.name,
+            index={
+                "name": "archived_at_ttl",
+                "expireAfterSeconds": SESSION_ARCHIVE_TTL,
+            },
+        )
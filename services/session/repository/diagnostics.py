@@ -0,0 +1,79 @@
+"""Query-plan checks for the hot session queries.
+
+Run `python -m repository.diagnostics` from the service directory; it exits
+non-zero if any hot query would fall back to a collection scan.
+"""
+
+import sys
+import asyncio
+
+from repository.db import sessions_collection, ensure_indexes
+from utils.pagination import (
+    SORT_ORDER,
+    PROJECTION,
+    DEFAULT_PAGE_SIZE,
+    after_cursor,
+    encode_cursor,
+)
+
+SAMPLE_SESSION_ID = "00000000-0000-0000-0000-000000000000"
+SAMPLE_CURSOR = encode_cursor({"created_at": 0, "session_id": SAMPLE_SESSION_ID})
+
+
+def hot_queries(collection=sessions_collection):
+    """The queries issued by the session endpoints, keyed by a short name."""
+    by_id = {"session_id": SAMPLE_SESSION_ID}
+    page = dict(projection=PROJECTION, sort=SORT_ORDER, limit=DEFAULT_PAGE_SIZE + 1)
+    return {
+        # find_one in GET /session?session_id=, PUT/DELETE /session and the
+        # WebSocket join.
+        "find_by_session_id": collection.find(by_id, limit=1),
+        "list_first_page": collection.find({}, **page),
+        "list_next_page": collection.find(after_cursor({}, SAMPLE_CURSOR), **page),
+        "list_active": collection.find({"active": True}, **page),
+        # The reaper's scan for sessions to archive.
+        "find_archivable": collection.find(
+            {"active": False, "last_activity": {"$lt": 0}},
+            sort=[("last_activity", 1)],
+            limit=500,
+        ),
+    }
+
+
+def plan_stages(plan: dict) -> list:
+    """Flatten a winning plan into the list of its stage names."""
+    stages = [plan.get("stage")]
+    if "inputStage" in plan:
+        stages += plan_stages(plan["inputStage"])
+    for child in plan.get("inputStages", []):
+        stages += plan_stages(child)
+    if "queryPlan" in plan:
+        stages += plan_stages(plan["queryPlan"])
+    return [stage for stage in stages if stage]
+
+
+async def explain_hot_queries(collection=sessions_collection) -> dict:
+    """Return {query name: {"stages": [...], "collscan": bool}} for every hot query."""
+    report = {}
+    for name, cursor in hot_queries(collection).items():
+        explanation = await cursor.explain()
+        stages = plan_stages(explanation["queryPlanner"]["winningPlan"])
+        report[name] = {"stages": stages, "collscan": "COLLSCAN" in stages}
+    return report
+
+
+async def main():
+    await ensure_indexes()
+    report = await explain_hot_queries()
+    failed = False
+    for name, result in report.items():
+        verdict = "COLLSCAN" if result["collscan"] else "ok"
+        failed = failed or result["collscan"]
+        print(f"{name:<22} {verdict:<9} {' <- '.join(result['stages'])}")
+    if failed:
+        print("At least one hot query falls back to a collection scan.")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,33 @@
+import os
+import sys
+
+import pytest
+
+# The service runs from its own directory with the shared common/ package next
+# to it (see the Dockerfile), so the tests import it the same way.
+SERVICE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [SERVICE_DIR, os.path.dirname(SERVICE_DIR)]
+# Resume tokens can't be signed without a secret.
+os.environ.setdefault("JWT_SECRET", "test-secret")
+
+
+class FakeWebSocket:
+    """Records what the server sends to one player."""
+
+    def __init__(self):
+        self.sent = []
+        self.close_code = None
+
+    async def send_text(self, text: str):
+        self.sent.append(text)
+
+    async def send_bytes(self, data: bytes):
+        self.sent.append(data)
+
+    async def close(self, code: int = 1000):
+        self.close_code = code
+
+
+@pytest.fixture
+def websocket():
+    return FakeWebSocket
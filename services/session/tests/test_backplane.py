@@ -0,0 +1,110 @@
+import asyncio
+
+from utils import backplane as backplane_module
+from utils.backplane import InMemoryBackplane, InMemoryBus
+from utils.broadcast import BroadcastHub
+
+
+async def start_hubs(count: int = 2) -> list:
+    """Hubs standing in for session-service replicas, sharing one in-memory bus."""
+    bus = InMemoryBus()
+    hubs = [BroadcastHub(backplane=InMemoryBackplane(bus)) for _ in range(count)]
+    for hub in hubs:
+        await hub.start()
+    return hubs
+
+
+async def stop_hubs(hubs: list):
+    for hub in hubs:
+        await hub.stop()
+
+
+async def settle():
+    # Well past BACKPLANE_FLUSH_INTERVAL, so pending batches have been relayed.
+    await asyncio.sleep(0.05)
+
+
+def test_broadcast_reaches_players_on_other_replicas(websocket):
+    async def scenario():
+        hub_a, hub_b = await start_hubs()
+        alice, bob, carol = websocket(), websocket(), websocket()
+        sender = hub_a.join("s1", alice, "alice")
+        hub_a.join("s1", bob, "bob")
+        hub_b.join("s1", carol, "carol")
+        await hub_a.broadcast("s1", sender, "hello")
+        await settle()
+        await stop_hubs([hub_a, hub_b])
+        return alice, bob, carol
+
+    alice, bob, carol = asyncio.run(scenario())
+    assert alice.sent == []
+    assert bob.sent == ["alice::  hello"]
+    assert carol.sent == ["alice::  hello"]
+
+
+def test_relay_only_reaches_the_same_session(websocket):
+    async def scenario():
+        hub_a, hub_b = await start_hubs()
+        alice, dave = websocket(), websocket()
+        sender = hub_a.join("s1", alice, "alice")
+        hub_b.join("s2", dave, "dave")
+        await hub_a.broadcast("s1", sender, "hello")
+        await settle()
+        await stop_hubs([hub_a, hub_b])
+        return dave
+
+    assert asyncio.run(scenario()).sent == []
+
+
+def test_closing_a_room_closes_it_on_every_replica(websocket):
+    async def scenario():
+        hub_a, hub_b = await start_hubs()
+        alice, carol = websocket(), websocket()
+        hub_a.join("s1", alice, "alice")
+        hub_b.join("s1", carol, "carol")
+        await hub_a.close_room("s1")
+        await settle()
+        await stop_hubs([hub_a, hub_b])
+        return hub_b, alice, carol
+
+    hub_b, alice, carol = asyncio.run(scenario())
+    assert alice.close_code == 1000
+    assert carol.close_code == 1000
+    assert "s1" not in hub_b.rooms
+
+
+def test_registry_lists_rooms_of_every_replica(websocket):
+    async def scenario():
+        hub_a, hub_b = await start_hubs()
+        hub_a.join("s1", websocket(), "alice")
+        hub_b.open_room("s2")
+        await settle()
+        listed = await hub_a.active_session_ids()
+        await hub_b.close_room("s2")
+        await settle()
+        after_close = await hub_a.active_session_ids()
+        await stop_hubs([hub_a, hub_b])
+        return listed, after_close
+
+    listed, after_close = asyncio.run(scenario())
+    assert listed == {"s1", "s2"}
+    assert after_close == {"s1"}
+
+
+def test_registry_entries_expire_without_heartbeats(monkeypatch):
+    monkeypatch.setattr(backplane_module, "REGISTRY_TTL", 0.1)
+
+    async def scenario():
+        # Replica B announces its room once, then goes quiet as if it had died.
+        hub_a, hub_b = await start_hubs()
+        hub_b.open_room("s1")
+        await settle()
+        before = await hub_a.backplane.active_session_ids()
+        await asyncio.sleep(0.15)
+        after = await hub_a.backplane.active_session_ids()
+        await stop_hubs([hub_a, hub_b])
+        return before, after
+
+    before, after = asyncio.run(scenario())
+    assert before == {"s1"}
+    assert after == set()
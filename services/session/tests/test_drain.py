@@ -0,0 +1,27 @@
+import json
+import asyncio
+
+from utils.broadcast import BroadcastHub
+from utils.resume import read_resume_token
+
+
+def handoff_of(socket) -> dict:
+    return json.loads(socket.sent[-1].split(" ", 1)[1])
+
+
+def test_drain_hands_players_off_with_resume_tokens_only_when_allowed(websocket):
+    async def scenario():
+        hub = BroadcastHub()
+        alice, bob = websocket(), websocket()
+        hub.join("s1", alice, "alice")
+        # Bob's name wasn't vouched for by a token while tokens are required.
+        hub.join("s1", bob, "bob", resumable=False)
+        await hub.drain(timeout=0.1)
+        return alice, bob
+
+    alice, bob = asyncio.run(scenario())
+    assert alice.close_code == bob.close_code == 1012
+    token = handoff_of(alice)["resume_token"]
+    assert read_resume_token(token, "s1") == ("alice", 0)
+    assert handoff_of(bob)["reconnect"] is True
+    assert "resume_token" not in handoff_of(bob)
@@ -0,0 +1,54 @@
+import asyncio
+
+from utils.broadcast import BroadcastHub
+
+
+def test_rooms_emptied_by_the_heartbeat_reaper_are_evicted(websocket):
+    async def scenario():
+        hub = BroadcastHub()
+        connection = hub.join("s1", websocket(), "bob")
+        connection.closed = True
+        await hub.reap()
+        await hub.leave("s1", connection)
+        return hub, hub.evict_idle_rooms(0)
+
+    hub, evicted = asyncio.run(scenario())
+    assert evicted == 1
+    assert hub.rooms == {}
+    assert hub.emptied_at == {}
+
+
+def test_rooms_emptied_by_an_overflow_disconnect_are_evicted(websocket):
+    async def scenario():
+        hub = BroadcastHub(overflow_policy="disconnect")
+        connection = hub.join("s1", websocket(), "bob", start=False)
+        connection.queue = asyncio.Queue(maxsize=1)
+        hub.publish("s1", "first")
+        hub.publish("s1", "second")
+        await asyncio.sleep(0)
+        return hub, hub.evict_idle_rooms(0)
+
+    hub, evicted = asyncio.run(scenario())
+    assert evicted == 1
+    assert hub.rooms == {}
+
+
+def test_rooms_in_use_or_recently_emptied_are_kept(websocket):
+    async def scenario():
+        hub = BroadcastHub()
+        hub.join("busy", websocket(), "bob")
+        connection = hub.join("quiet", websocket(), "carol")
+        await hub.leave("quiet", connection)
+        return hub, hub.evict_idle_rooms(60)
+
+    hub, evicted = asyncio.run(scenario())
+    assert evicted == 0
+    assert set(hub.rooms) == {"busy", "quiet"}
+
+
+def test_empty_room_without_a_timestamp_is_put_on_the_idle_clock():
+    hub = BroadcastHub()
+    hub.rooms["s1"] = {}
+    assert hub.evict_idle_rooms(60) == 0
+    assert "s1" in hub.emptied_at
+    assert hub.evict_idle_rooms(0) == 1
@@ -0,0 +1,186 @@
+import time
+import asyncio
+from types import SimpleNamespace
+
+from utils.backplane import InMemoryBackplane, InMemoryBus
+from utils.broadcast import BroadcastHub
+from utils.expiry import SessionReaper
+from utils.presence import PRESENCE_ORPHAN_AFTER, PresenceWriter
+
+
+class FakeCursor:
+    def __init__(self, docs):
+        self.docs = docs
+
+    def limit(self, count):
+        return FakeCursor(self.docs[:count])
+
+    async def to_list(self, length):
+        return self.docs[:length]
+
+
+class FakeSessions:
+    """Records presence bulk writes and answers the orphan sweep's queries."""
+
+    def __init__(self, docs=()):
+        self.writes = []
+        self.docs = [dict(doc) for doc in docs]
+
+    async def bulk_write(self, operations, ordered=True):
+        self.writes.append(operations)
+
+    def _matches(self, doc, query):
+        if (
+            "session_id" in query
+            and doc["session_id"] not in query["session_id"]["$in"]
+        ):
+            return False
+        return (
+            doc["active"] == query["active"]
+            and doc["last_activity"] < query["last_activity"]["$lt"]
+        )
+
+    def find(self, query, projection=None):
+        return FakeCursor(
+            [
+                {"session_id": doc["session_id"]}
+                for doc in self.docs
+                if self._matches(doc, query)
+            ]
+        )
+
+    async def update_many(self, query, update):
+        matched = [doc for doc in self.docs if self._matches(doc, query)]
+        for doc in matched:
+            doc.update(update["$set"])
+        return SimpleNamespace(modified_count=len(matched))
+
+
+def make_hub(**kwargs) -> BroadcastHub:
+    return BroadcastHub(presence=PresenceWriter(FakeSessions()), **kwargs)
+
+
+async def join_and_flush(hub: BroadcastHub, websocket, **kwargs):
+    connection = hub.join("s1", websocket, "bob", **kwargs)
+    # The join itself is written; what's pending afterwards is what the removal did.
+    await hub.presence.flush()
+    return connection
+
+
+def test_leave_marks_the_player_gone_once(websocket):
+    async def scenario():
+        hub = make_hub()
+        connection = await join_and_flush(hub, websocket())
+        await hub.leave("s1", connection)
+        await hub.leave("s1", connection)
+        return hub
+
+    hub = asyncio.run(scenario())
+    assert hub.presence._pending == {"s1": {"bob": False}}
+    assert hub.presence.connected == {}
+    assert "s1" in hub.emptied_at
+
+
+def test_reaped_connection_leaves_presence_and_empties_the_room(websocket):
+    async def scenario():
+        hub = make_hub()
+        connection = await join_and_flush(hub, websocket())
+        # The writer failed, so the reaper finds the connection dead.
+        connection.closed = True
+        await hub.reap()
+        # The endpoint's own cleanup runs afterwards and must not undo anything.
+        await hub.leave("s1", connection)
+        return hub
+
+    hub = asyncio.run(scenario())
+    assert hub.rooms["s1"] == {}
+    assert hub.presence._pending == {"s1": {"bob": False}}
+    assert hub.presence.connected == {}
+    assert "s1" in hub.emptied_at
+
+
+def test_overflow_disconnect_leaves_presence_and_empties_the_room(websocket):
+    async def scenario():
+        hub = make_hub(overflow_policy="disconnect")
+        connection = await join_and_flush(hub, websocket(), start=False)
+        connection.queue = asyncio.Queue(maxsize=1)
+        hub.publish("s1", "first")
+        hub.publish("s1", "second")
+        await asyncio.sleep(0)
+        await hub.leave("s1", connection)
+        return hub, connection
+
+    hub, connection = asyncio.run(scenario())
+    assert connection.websocket.close_code == 1013
+    assert hub.rooms["s1"] == {}
+    assert hub.presence._pending == {"s1": {"bob": False}}
+    assert hub.presence.connected == {}
+    assert "s1" in hub.emptied_at
+
+
+def test_second_tab_keeps_the_player_present(websocket):
+    async def scenario():
+        hub = make_hub()
+        first = await join_and_flush(hub, websocket())
+        hub.join("s1", websocket(), "bob")
+        first.closed = True
+        await hub.reap()
+        return hub
+
+    hub = asyncio.run(scenario())
+    assert hub.presence._pending == {}
+    assert hub.presence.connected == {("s1", "bob"): 1}
+
+
+def test_reaper_resets_presence_of_sessions_no_replica_holds(websocket):
+    stale = time.time() - PRESENCE_ORPHAN_AFTER - 1
+    sessions = FakeSessions(
+        [
+            # Players on replica B, still running, with no join or leave lately.
+            {
+                "session_id": "live",
+                "active": True,
+                "active_users": ["bob"],
+                "last_activity": stale,
+            },
+            # Players on a replica that crashed: no room anywhere.
+            {
+                "session_id": "orphan",
+                "active": True,
+                "active_users": ["carol"],
+                "last_activity": stale,
+            },
+            # A join written moments ago; its room may not be announced yet.
+            {
+                "session_id": "new",
+                "active": True,
+                "active_users": ["dave"],
+                "last_activity": time.time(),
+            },
+        ]
+    )
+
+    async def scenario():
+        bus = InMemoryBus()
+        hub_a = BroadcastHub(
+            backplane=InMemoryBackplane(bus), presence=PresenceWriter(sessions)
+        )
+        hub_b = BroadcastHub(backplane=InMemoryBackplane(bus))
+        for hub in (hub_a, hub_b):
+            await hub.start()
+        hub_b.join("live", websocket(), "bob")
+        await asyncio.sleep(0.05)
+        cleared = await SessionReaper(
+            hub_a, sessions, None, None
+        ).clear_orphaned_presence()
+        for hub in (hub_a, hub_b):
+            await hub.stop()
+        return cleared
+
+    assert asyncio.run(scenario()) == 1
+    by_id = {doc["session_id"]: doc for doc in sessions.docs}
+    assert by_id["orphan"]["active"] is False
+    assert by_id["orphan"]["active_users"] == []
+    assert by_id["orphan"]["last_activity"] == stale
+    assert by_id["live"]["active_users"] == ["bob"]
+    assert by_id["new"]["active_users"] == ["dave"]
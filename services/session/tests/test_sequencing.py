@@ -0,0 +1,189 @@
+import asyncio
+
+import utils.backplane
+import utils.eventlog
+from utils.backplane import InMemoryBackplane, InMemoryBus
+from utils.broadcast import BroadcastHub
+from utils.eventlog import EventLog
+
+
+class FakeCollection:
+    """Just enough of a Motor collection for the event log's background flush."""
+
+    def __init__(self):
+        self.docs = []
+
+    async def insert_many(self, docs, ordered=True):
+        self.docs.extend(docs)
+
+
+class FlakyBackplane(InMemoryBackplane):
+    """In-memory backplane whose sequence counter can be taken down."""
+
+    down = False
+
+    async def _next_seqs(self, requests: list, seed: int) -> list:
+        if self.down:
+            raise ConnectionError("counter unreachable")
+        return await super()._next_seqs(requests, seed)
+
+
+async def start_hubs(count: int = 2, backplane=InMemoryBackplane) -> list:
+    bus = InMemoryBus()
+    hubs = [
+        BroadcastHub(
+            backplane=backplane(bus),
+            event_log=EventLog(FakeCollection(), FakeCollection()),
+        )
+        for _ in range(count)
+    ]
+    for hub in hubs:
+        await hub.start()
+    return hubs
+
+
+async def settle():
+    await asyncio.sleep(0.05)
+
+
+def test_sequence_numbers_increase_across_replicas(websocket):
+    async def scenario():
+        hub_a, hub_b = await start_hubs()
+        alice = hub_a.join("s1", websocket(), "alice")
+        carol = hub_b.join("s1", websocket(), "carol")
+        for _ in range(3):
+            await hub_a.broadcast("s1", alice, "a")
+            await hub_b.broadcast("s1", carol, "c")
+        await settle()
+        rings = [
+            [event.seq for event in hub.event_log.rings["s1"]] for hub in (hub_a, hub_b)
+        ]
+        for hub in (hub_a, hub_b):
+            await hub.stop()
+        return rings
+
+    ring_a, ring_b = asyncio.run(scenario())
+    assert ring_a == ring_b
+    assert len(ring_a) == 6
+    assert ring_a == sorted(set(ring_a))
+
+
+def test_relayed_event_older_than_a_delivered_one_still_arrives(websocket):
+    async def scenario():
+        hub_a, hub_b = await start_hubs()
+        bob_socket, carol_socket = websocket(), websocket()
+        alice = hub_a.join("s1", websocket(), "alice")
+        hub_a.join("s1", bob_socket, "bob")
+        # Carol resumes by sequence number, so every frame carries one.
+        hub_a.join("s1", carol_socket, "carol", sequenced=True)
+        dave = hub_b.join("s1", websocket(), "dave")
+        # Dave's event is numbered first but only reaches replica A after the
+        # backplane flush, by which time alice's newer one was delivered there.
+        await hub_b.broadcast("s1", dave, "first")
+        await hub_a.broadcast("s1", alice, "second")
+        await settle()
+        for hub in (hub_a, hub_b):
+            await hub.stop()
+        return bob_socket, carol_socket
+
+    bob, carol = asyncio.run(scenario())
+    assert bob.sent == ["alice::  second", "dave::  first"]
+    assert [frame.split("#", 1)[1] for frame in carol.sent] == bob.sent
+    seqs = [int(frame.split("#", 1)[0]) for frame in carol.sent]
+    assert seqs[1] < seqs[0]
+
+
+def test_resume_replays_missed_events_once(websocket):
+    async def scenario():
+        (hub,) = await start_hubs(1)
+        alice = hub.join("s1", websocket(), "alice")
+        await hub.broadcast("s1", alice, "one")
+        last_seq = hub.event_log.last_seq["s1"]
+        await hub.broadcast("s1", alice, "two")
+        # Bob rejoins having seen "one"; "three" is queued while his replay runs.
+        bob_socket = websocket()
+        bob = hub.join("s1", bob_socket, "bob", sequenced=True, start=False)
+        await hub.broadcast("s1", alice, "three")
+        await hub.replay("s1", bob, last_seq)
+        await hub.broadcast("s1", alice, "four")
+        await settle()
+        await hub.stop()
+        return bob_socket
+
+    bob = asyncio.run(scenario())
+    assert [frame.split("#", 1)[1] for frame in bob.sent] == [
+        "alice::  two",
+        "alice::  three",
+        "alice::  four",
+    ]
+
+
+def test_late_relayed_event_fits_into_a_full_ring(websocket, monkeypatch):
+    monkeypatch.setattr(utils.eventlog, "EVENT_RING_SIZE", 4)
+    # Hold relayed events back long enough for the ring to fill first.
+    monkeypatch.setattr(utils.backplane, "FLUSH_INTERVAL", 0.02)
+
+    async def scenario():
+        hub_a, hub_b = await start_hubs()
+        bob_socket = websocket()
+        alice = hub_a.join("s1", websocket(), "alice")
+        hub_a.join("s1", bob_socket, "bob")
+        dave = hub_b.join("s1", websocket(), "dave")
+        await hub_a.broadcast("s1", alice, "1")
+        await hub_a.broadcast("s1", alice, "2")
+        await hub_b.broadcast("s1", dave, "late")
+        await hub_a.broadcast("s1", alice, "3")
+        await hub_a.broadcast("s1", alice, "4")
+        await asyncio.sleep(0.1)
+        await hub_b.broadcast("s1", dave, "after")
+        await asyncio.sleep(0.1)
+        ring = [event.data for event in hub_a.event_log.rings["s1"]]
+        for hub in (hub_a, hub_b):
+            await hub.stop()
+        return bob_socket, ring
+
+    bob, ring = asyncio.run(scenario())
+    assert bob.sent == [
+        "alice::  1",
+        "alice::  2",
+        "alice::  3",
+        "alice::  4",
+        "dave::  late",
+        "dave::  after",
+    ]
+    assert ring == ["late", "3", "4", "after"]
+
+
+def test_relay_survives_a_bad_event(websocket):
+    async def scenario():
+        hub_a, hub_b = await start_hubs()
+        bob_socket = websocket()
+        hub_a.join("s1", bob_socket, "bob")
+        dave = hub_b.join("s1", websocket(), "dave")
+        hub_b.backplane.publish({"session_id": "s1"})
+        await hub_b.broadcast("s1", dave, "still here")
+        await settle()
+        for hub in (hub_a, hub_b):
+            await hub.stop()
+        return bob_socket
+
+    assert asyncio.run(scenario()).sent == ["dave::  still here"]
+
+
+def test_local_numbering_stays_in_step_with_the_shared_counter(websocket, capsys):
+    async def scenario():
+        (hub,) = await start_hubs(1, backplane=FlakyBackplane)
+        alice = hub.join("s1", websocket(), "alice")
+        seqs = []
+        for down in (False, True, True, False, False):
+            hub.backplane.down = down
+            await hub.broadcast("s1", alice, "x")
+            seqs.append(hub.event_log.last_seq["s1"])
+        await hub.stop()
+        return seqs
+
+    seqs = asyncio.run(scenario())
+    assert seqs == list(range(seqs[0], seqs[0] + 5))
+    log = capsys.readouterr().out
+    assert log.count("numbering locally") == 1
+    assert log.count("Shared sequence is back") == 1
@@ -0,0 +1,250 @@
+import os
+import time
+import asyncio
+import hashlib
+import itertools
+from collections import OrderedDict
+
+import httpx
+from prometheus_client import Counter, Histogram
+
+from common.token import verify_token
+
+# --- Join authentication settings ---
+# The join handshake (first frame, or ?token=) carries the player's JWT from
+# the user service's /login; the player's name then comes from its claims.
+#   "local"   verify the signature here with the shared JWT_SECRET (common/token.py)
+#   "remote"  ask the user service's GET /validate through a pooled client
+#   "off"     treat the handshake as a plain name, as before
+JOIN_AUTH = os.getenv("JOIN_AUTH", "local")
+# Plain names are refused unless this is turned off, e.g. while older clients
+# that only send a name are still around.
+JOIN_AUTH_REQUIRED = os.getenv("JOIN_AUTH_REQUIRED", "true").lower() == "true"
+AUTH_FAILED_CLOSE_CODE = 1008
+AUTH_UNAVAILABLE_CLOSE_CODE = 1013
+
+# --- Remote validation settings ---
+# Comma-separated user-service replicas (the ones the gateway balances over).
+# Requests rotate across them and a retry goes to the next one, so validation
+# doesn't hinge on one instance. Not the gateway: it caches by path, not body.
+USER_SERVICE_URL = os.getenv(
+    "USER_SERVICE_URL",
+    "http://user-service-1:8004,http://user-service-2:8005,http://user-service-3:8006",
+)
+# Upper bound on what validation adds to a join, retries included.
+AUTH_TIMEOUT = float(os.getenv("AUTH_TIMEOUT", 1.0))
+AUTH_CONNECT_TIMEOUT = float(os.getenv("AUTH_CONNECT_TIMEOUT", 0.25))
+AUTH_READ_TIMEOUT = float(os.getenv("AUTH_READ_TIMEOUT", 0.5))
+AUTH_RETRIES = int(os.getenv("AUTH_RETRIES", 2))
+AUTH_MAX_CONNECTIONS = int(os.getenv("AUTH_MAX_CONNECTIONS", 50))
+AUTH_MAX_KEEPALIVE = int(os.getenv("AUTH_MAX_KEEPALIVE", 20))
+# Verdicts are reused for a short while, so a table reconnecting at once costs
+# one call per player.
+AUTH_CACHE_SIZE = int(os.getenv("AUTH_CACHE_SIZE", 10_000))
+AUTH_CACHE_TTL = float(os.getenv("AUTH_CACHE_TTL", 30))
+AUTH_NEGATIVE_CACHE_TTL = float(os.getenv("AUTH_NEGATIVE_CACHE_TTL", 5))
+
+# --- Prometheus Metrics ---
+JOIN_AUTH_RESULTS = Counter(
+    "session_join_auth",
+    "Join handshakes by authentication outcome",
+    ["outcome"],
+)
+JOIN_AUTH_DURATION = Histogram(
+    "session_join_auth_duration_seconds",
+    "Time spent validating the token of a joining player",
+    ["mode"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0),
+)
+VERDICT_CACHE_HITS = Counter(
+    "session_auth_cache_hits", "Token verdicts served from the cache"
+)
+
+MISSING = object()
+
+
+class AuthUnavailable(Exception):
+    """No verdict from the user service within AUTH_TIMEOUT; the player should retry."""
+
+
+def looks_like_jwt(value) -> bool:
+    # Every JWT starts with the base64 of '{"'; player names don't.
+    return isinstance(value, str) and value.startswith("eyJ") and value.count(".") == 2
+
+
+class VerdictCache:
+    """LRU of recent verdicts, keyed by a digest of the token.
+
+    A verdict is the token's claims, or None for a rejected token.
+    """
+
+    def __init__(self, maxsize: int = AUTH_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()  # sha256(token) -> (expires_at, claims)
+
+    @staticmethod
+    def key(token: str) -> bytes:
+        return hashlib.sha256(token.encode()).digest()
+
+    def get(self, token: str):
+        key = self.key(token)
+        entry = self._entries.get(key)
+        if entry is None:
+            return MISSING
+        expires_at, claims = entry
+        if expires_at <= time.time():
+            del self._entries[key]
+            return MISSING
+        self._entries.move_to_end(key)
+        VERDICT_CACHE_HITS.inc()
+        return claims
+
+    def put(self, token: str, claims):
+        expires_at = time.time() + (
+            AUTH_CACHE_TTL if claims is not None else AUTH_NEGATIVE_CACHE_TTL
+        )
+        if claims is not None and isinstance(claims.get("exp"), (int, float)):
+            # Never trust a verdict past the token's own expiry.
+            expires_at = min(expires_at, claims["exp"])
+        self._entries[self.key(token)] = (expires_at, claims)
+        self._entries.move_to_end(self.key(token))
+        if len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+
+class RemoteValidator:
+    """Asks the user service's GET /validate over one keep-alive connection pool.
+
+    Concurrent joins with the same token share a single request, and each
+    verdict is cached briefly. Requests rotate across the replicas in
+    `base_url`; connection errors and 5xx answers are retried on the next one
+    with a short backoff, all within AUTH_TIMEOUT.
+    """
+
+    def __init__(
+        self,
+        base_url: str = USER_SERVICE_URL,
+        timeout: float = AUTH_TIMEOUT,
+        retries: int = AUTH_RETRIES,
+    ):
+        self.base_urls = [url.strip().rstrip("/") for url in base_url.split(",")]
+        self._next_url = itertools.cycle(self.base_urls)
+        self.timeout = timeout
+        self.retries = retries
+        self.cache = VerdictCache()
+        self._client = None
+        self._inflight = {}
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                timeout=httpx.Timeout(AUTH_READ_TIMEOUT, connect=AUTH_CONNECT_TIMEOUT),
+                limits=httpx.Limits(
+                    max_connections=AUTH_MAX_CONNECTIONS,
+                    max_keepalive_connections=AUTH_MAX_KEEPALIVE,
+                ),
+            )
+        return self._client
+
+    async def warm_up(self):
+        """Open a pooled connection to each replica before the first join needs one."""
+        await asyncio.gather(
+            *(self.client.get(f"{url}/user/status") for url in self.base_urls)
+        )
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def validate(self, token: str):
+        """Return the token's claims, or None if the user service rejects it."""
+        claims = self.cache.get(token)
+        if claims is not MISSING:
+            return claims
+        key = VerdictCache.key(token)
+        request = self._inflight.get(key)
+        if request is None:
+            request = self._inflight[key] = asyncio.create_task(self._fetch(token))
+            request.add_done_callback(lambda done: self._finished(key, done))
+        try:
+            return await asyncio.wait_for(asyncio.shield(request), self.timeout)
+        except asyncio.TimeoutError:
+            raise AuthUnavailable(
+                f"No verdict from the user service within {self.timeout}s"
+            )
+
+    def _finished(self, key: bytes, request: asyncio.Task):
+        self._inflight.pop(key, None)
+        if not request.cancelled():
+            request.exception()  # Retrieved here in case every waiter timed out.
+
+    async def _fetch(self, token: str):
+        headers = {"Authorization": f"Bearer {token}"}
+        for attempt in range(self.retries + 1):
+            try:
+                url = next(self._next_url)
+                response = await self.client.get(f"{url}/validate", headers=headers)
+                if response.status_code < 500:
+                    claims = (
+                        response.json()["claims"]
+                        if response.status_code == 200
+                        else None
+                    )
+                    self.cache.put(token, claims)
+                    return claims
+                error = f"status {response.status_code}"
+            except (httpx.TransportError, ValueError, KeyError) as exc:
+                error = exc.__class__.__name__
+            if attempt < self.retries:
+                await asyncio.sleep(0.05 * 2**attempt)
+        raise AuthUnavailable(f"User service validation failed: {error}")
+
+
+class JoinAuthenticator:
+    """Turns the join handshake into a player name, validating tokens as configured."""
+
+    def __init__(self, mode: str = JOIN_AUTH, required: bool = JOIN_AUTH_REQUIRED):
+        self.mode = mode
+        self.required = required and mode != "off"
+        self.remote = RemoteValidator() if mode == "remote" else None
+
+    async def warm_up(self):
+        if self.remote is not None:
+            await self.remote.warm_up()
+
+    async def close(self):
+        if self.remote is not None:
+            await self.remote.close()
+
+    async def identify(self, credential) -> tuple:
+        """(player name, whether a token vouched for it) for a handshake.
+
+        Raises ValueError if the handshake is refused, AuthUnavailable if no
+        verdict could be had.
+        """
+        if self.mode == "off" or not looks_like_jwt(credential):
+            if self.required:
+                JOIN_AUTH_RESULTS.labels(outcome="missing").inc()
+                raise ValueError("A valid token is required to join.")
+            JOIN_AUTH_RESULTS.labels(outcome="anonymous").inc()
+            return credential, False
+        started = time.perf_counter()
+        try:
+            if self.remote is not None:
+                claims = await self.remote.validate(credential)
+            else:
+                claims = verify_token(credential)
+        except AuthUnavailable:
+            JOIN_AUTH_RESULTS.labels(outcome="unavailable").inc()
+            raise
+        finally:
+            JOIN_AUTH_DURATION.labels(mode=self.mode).observe(
+                time.perf_counter() - started
+            )
+        if not claims or not claims.get("name"):
+            JOIN_AUTH_RESULTS.labels(outcome="rejected").inc()
+            raise ValueError("Invalid or expired token.")
+        JOIN_AUTH_RESULTS.labels(outcome="accepted").inc()
+        return claims["name"], True
@@ -0,0 +1,307 @@
+import os
+import json
+import time
+import uuid
+import asyncio
+
+# --- Backplane settings ---
+# "redis://..." relays broadcasts through Redis pub/sub so every session-service
+# replica sees every room; "memory://" keeps everything in-process (tests, single node).
+BACKPLANE_URL = os.getenv("BACKPLANE_URL", "redis://redis:6379/0")
+BACKPLANE_CHANNEL = os.getenv("BACKPLANE_CHANNEL", "session:broadcast")
+# Outgoing events are buffered and published together once per flush interval.
+FLUSH_INTERVAL = float(os.getenv("BACKPLANE_FLUSH_INTERVAL", 0.002))
+MAX_BATCH_SIZE = int(os.getenv("BACKPLANE_MAX_BATCH_SIZE", 256))
+# Each replica re-announces its rooms every heartbeat; entries expire after the TTL.
+HEARTBEAT_INTERVAL = float(os.getenv("BACKPLANE_HEARTBEAT_INTERVAL", 5))
+REGISTRY_TTL = float(os.getenv("BACKPLANE_REGISTRY_TTL", 15))
+REGISTRY_KEY = os.getenv("BACKPLANE_REGISTRY_KEY", "session:active")
+# Event sequence numbers come from one counter per session shared by every
+# replica, so they strictly increase whichever replica an event started on.
+# Counters unused for SEQUENCE_TTL seconds are dropped.
+SEQUENCE_KEY_PREFIX = os.getenv("BACKPLANE_SEQUENCE_PREFIX", "session:seq:")
+SEQUENCE_TTL = int(os.getenv("BACKPLANE_SEQUENCE_TTL", 24 * 3600))
+# Longest a broadcast waits for its number before the replica numbers locally.
+SEQUENCE_TIMEOUT = float(os.getenv("BACKPLANE_SEQUENCE_TIMEOUT", 0.1))
+
+# Bumps a session's counter, first raising it to the caller's floor (the highest
+# number the replica has seen) and seeding a new one at the clock.
+NEXT_SEQ_SCRIPT = """
+local seq = tonumber(redis.call("GET", KEYS[1]) or ARGV[2])
+seq = math.max(seq, tonumber(ARGV[1])) + 1
+redis.call("SET", KEYS[1], string.format("%d", seq), "EX", ARGV[3])
+return seq
+"""
+
+
+class Backplane:
+    """Relays room events between replicas, keeps the shared active-session registry
+    and hands out the sessions' event sequence numbers.
+
+    Subclasses implement the transport: `_send` ships a batch, `_listen` feeds
+    incoming batches to `_dispatch`, the `_registry_*` hooks persist the
+    session-ID -> expiry registry and `_next_seqs` bumps sessions' counters.
+    """
+
+    def __init__(self):
+        self.node_id = uuid.uuid4().hex
+        self.on_event = None
+        self.local_sessions = None
+        self._pending = []
+        self._announced = set()
+        self._retired = set()
+        self._wakeup = asyncio.Event()
+        # (session_id, floor, future) waiting for a sequence number.
+        self._seq_requests = []
+        self._seq_wakeup = asyncio.Event()
+        self._tasks = []
+
+    async def start(self, on_event, local_sessions):
+        """Start relaying.
+
+        `on_event(event)` receives remote events; `local_sessions()` lists the
+        rooms on this replica.
+        """
+        self.on_event = on_event
+        self.local_sessions = local_sessions
+        self._tasks = [
+            asyncio.create_task(self._flush_loop()),
+            asyncio.create_task(self._heartbeat_loop()),
+            asyncio.create_task(self._listen()),
+            asyncio.create_task(self._sequence_loop()),
+        ]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        await self.flush()
+
+    # --- Outgoing ---
+    def publish(self, event: dict):
+        self._pending.append(event)
+        self._wakeup.set()
+
+    def announce(self, session_id: str):
+        self._retired.discard(session_id)
+        self._announced.add(session_id)
+        self._wakeup.set()
+
+    def retire(self, session_id: str):
+        self._announced.discard(session_id)
+        self._retired.add(session_id)
+        self._wakeup.set()
+
+    async def flush(self):
+        events, self._pending = self._pending, []
+        announced, self._announced = self._announced, set()
+        retired, self._retired = self._retired, set()
+        if not (events or announced or retired):
+            return
+        payload = None
+        if events:
+            payload = json.dumps({"node": self.node_id, "events": events})
+        try:
+            await self._send(payload, announced, retired, time.time() + REGISTRY_TTL)
+        except Exception as exc:
+            print(f"Backplane flush failed, dropped {len(events)} events: {exc}")
+
+    async def _flush_loop(self):
+        while True:
+            await self._wakeup.wait()
+            # Let more events pile up so one publish carries the whole burst.
+            if len(self._pending) < MAX_BATCH_SIZE:
+                await asyncio.sleep(FLUSH_INTERVAL)
+            self._wakeup.clear()
+            await self.flush()
+
+    async def _heartbeat_loop(self):
+        while True:
+            self._announced.update(self.local_sessions())
+            self._wakeup.set()
+            await asyncio.sleep(HEARTBEAT_INTERVAL)
+
+    # --- Incoming ---
+    def _dispatch(self, payload):
+        batch = json.loads(payload)
+        if batch["node"] == self.node_id:
+            return
+        for event in batch["events"]:
+            try:
+                self.on_event(event)
+            except Exception as exc:
+                # One bad event must not take down the relay for the rest.
+                print(f"Dropped relayed event for {event.get('session_id')}: {exc!r}")
+
+    # --- Registry ---
+    async def active_session_ids(self) -> set:
+        return await self._registry_members(time.time())
+
+    # --- Sequence numbers ---
+    async def next_seq(self, session_id: str, floor: int = 0) -> int:
+        """Next sequence number for an event in the session, unique across replicas.
+
+        The number is above `floor`. Raises asyncio.TimeoutError if the counter
+        doesn't answer within SEQUENCE_TIMEOUT.
+        """
+        future = asyncio.get_running_loop().create_future()
+        self._seq_requests.append((session_id, floor, future))
+        self._seq_wakeup.set()
+        return await asyncio.wait_for(future, SEQUENCE_TIMEOUT)
+
+    async def _sequence_loop(self):
+        # Requests that arrive while a batch is out go together in the next one,
+        # so a busy replica pays one round trip per batch, not per broadcast.
+        while True:
+            await self._seq_wakeup.wait()
+            self._seq_wakeup.clear()
+            requests, self._seq_requests = self._seq_requests, []
+            requests = [request for request in requests if not request[2].done()]
+            if not requests:
+                continue
+            # A new counter starts at the clock (in microseconds), so it stays
+            # above the numbers of a counter that expired, and of events logged
+            # before.
+            seed = time.time_ns() // 1000
+            try:
+                seqs = await asyncio.wait_for(
+                    self._next_seqs([request[:2] for request in requests], seed),
+                    SEQUENCE_TIMEOUT,
+                )
+            except Exception as exc:
+                for _, _, future in requests:
+                    if not future.done():
+                        future.set_exception(exc)
+                continue
+            for (_, _, future), seq in zip(requests, seqs):
+                if not future.done():
+                    future.set_result(seq)
+
+    # --- Transport hooks ---
+    async def _send(self, payload, announced, retired, expires_at):
+        raise NotImplementedError
+
+    async def _listen(self):
+        raise NotImplementedError
+
+    async def _registry_members(self, now: float) -> set:
+        raise NotImplementedError
+
+    async def _next_seqs(self, requests: list, seed: int) -> list:
+        """Bump the counter once per (session_id, floor) request, in order."""
+        raise NotImplementedError
+
+
+class InMemoryBus:
+    """Stand-in for the Redis server, shared by in-process backplanes.
+
+    Holds the channel's subscribers, the registry and the sequence counters.
+    """
+
+    def __init__(self):
+        self.subscribers = []
+        self.registry = {}
+        self.sequences = {}
+
+
+class InMemoryBackplane(Backplane):
+    def __init__(self, bus: InMemoryBus = None):
+        super().__init__()
+        self.bus = bus if bus is not None else InMemoryBus()
+        self._inbox = asyncio.Queue()
+
+    async def _send(self, payload, announced, retired, expires_at):
+        for session_id in announced:
+            self.bus.registry[session_id] = expires_at
+        for session_id in retired:
+            self.bus.registry.pop(session_id, None)
+        if payload is not None:
+            for inbox in self.bus.subscribers:
+                inbox.put_nowait(payload)
+
+    async def _listen(self):
+        self.bus.subscribers.append(self._inbox)
+        try:
+            while True:
+                self._dispatch(await self._inbox.get())
+        finally:
+            self.bus.subscribers.remove(self._inbox)
+
+    async def _registry_members(self, now: float) -> set:
+        return {
+            sid for sid, expires_at in self.bus.registry.items() if expires_at > now
+        }
+
+    async def _next_seqs(self, requests: list, seed: int) -> list:
+        seqs = []
+        for session_id, floor in requests:
+            seq = max(self.bus.sequences.get(session_id, seed), floor) + 1
+            self.bus.sequences[session_id] = seq
+            seqs.append(seq)
+        return seqs
+
+
+class RedisBackplane(Backplane):
+    def __init__(self, url: str, channel: str = BACKPLANE_CHANNEL):
+        super().__init__()
+        # Imported here so the in-memory backplane works without the redis package.
+        import redis.asyncio as redis
+
+        # No socket timeout: the subscription blocks on reads between events.
+        # Sequence calls are bounded by SEQUENCE_TIMEOUT instead.
+        self.redis = redis.from_url(url, socket_connect_timeout=SEQUENCE_TIMEOUT * 10)
+        self.channel = channel
+        self._next_seq_script = self.redis.register_script(NEXT_SEQ_SCRIPT)
+
+    async def stop(self):
+        await super().stop()
+        await self.redis.aclose()
+
+    async def _send(self, payload, announced, retired, expires_at):
+        async with self.redis.pipeline(transaction=False) as pipe:
+            if payload is not None:
+                pipe.publish(self.channel, payload)
+            if announced:
+                pipe.zadd(REGISTRY_KEY, {sid: expires_at for sid in announced})
+            if retired:
+                pipe.zrem(REGISTRY_KEY, *retired)
+            await pipe.execute()
+
+    async def _listen(self):
+        while True:
+            pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+            try:
+                await pubsub.subscribe(self.channel)
+                async for message in pubsub.listen():
+                    self._dispatch(message["data"])
+            except asyncio.CancelledError:
+                raise
+            except Exception as exc:
+                print(f"Backplane subscription lost, retrying: {exc}")
+                await asyncio.sleep(1)
+            finally:
+                await pubsub.aclose()
+
+    async def _registry_members(self, now: float) -> set:
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.zremrangebyscore(REGISTRY_KEY, "-inf", now)
+            pipe.zrangebyscore(REGISTRY_KEY, now, "+inf")
+            _, members = await pipe.execute()
+        return {member.decode() for member in members}
+
+    async def _next_seqs(self, requests: list, seed: int) -> list:
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for session_id, floor in requests:
+                await self._next_seq_script(
+                    keys=[SEQUENCE_KEY_PREFIX + session_id],
+                    args=[floor, seed, SEQUENCE_TTL],
+                    client=pipe,
+                )
+            return await pipe.execute()
+
+
+def create_backplane(url: str = BACKPLANE_URL) -> Backplane:
+    if url.startswith("memory://"):
+        return InMemoryBackplane()
+    return RedisBackplane(url)
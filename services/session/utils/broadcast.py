@@ -0,0 +1,558 @@
+import os
+import json
+import time
+import asyncio
+
+from utils.limits import (
+    CONNECTIONS_REAPED,
+    HEARTBEAT_INTERVAL,
+    HEARTBEAT_TIMEOUT,
+    MESSAGES_THROTTLED,
+    RATE_BURST,
+    RATE_LIMIT,
+    REAPED_CLOSE_CODE,
+    SESSION_RATE_BURST,
+    SESSION_RATE_LIMIT,
+    TokenBucket,
+)
+from utils.protocol import COALESCE_MAX, COALESCE_WINDOW, Control, Event, pack_batch
+from utils.resume import issue_resume_token
+
+# --- Broadcast settings ---
+# Every connection gets its own bounded outbound queue drained by a dedicated
+# writer task, so a slow player can never stall the rest of the table.
+SEND_QUEUE_SIZE = int(os.getenv("SEND_QUEUE_SIZE", 256))
+# What to do when a connection's queue is full: "drop" the frame for that
+# client only, or "disconnect" the client so it can reconnect and catch up.
+OVERFLOW_POLICY = os.getenv("SEND_OVERFLOW_POLICY", "disconnect")
+# Close code sent to clients disconnected because they fell behind
+# (1013: try again later).
+OVERFLOW_CLOSE_CODE = 1013
+# Close code for players still connected when a drain times out (1012: service restart).
+SERVICE_RESTART_CLOSE_CODE = 1012
+
+
+class Handoff:
+    """Queued last on a draining connection: tells the player to reconnect elsewhere.
+
+    The control message is built when the writer reaches it, so the resume
+    token carries the last event the player actually received. Players whose
+    name no token vouched for get no resume token when tokens are required;
+    they rejoin with their own token and ?last_seq instead.
+    """
+
+    seq = 0
+
+    def __init__(self, session_id: str, name: str, resumable: bool = True):
+        self.session_id = session_id
+        self.name = name
+        self.resumable = resumable
+
+    def control(self, last_seq: int) -> Control:
+        message = {
+            "reconnect": True,
+            "session_id": self.session_id,
+            "last_seq": last_seq,
+        }
+        if self.resumable:
+            message["resume_token"] = issue_resume_token(
+                self.session_id, self.name, last_seq
+            )
+        return Control(message)
+
+
+class Connection:
+    def __init__(
+        self,
+        websocket,
+        name: str,
+        queue_size: int = SEND_QUEUE_SIZE,
+        sequenced: bool = False,
+        binary: bool = False,
+        resumable: bool = True,
+    ):
+        self.websocket = websocket
+        self.name = name
+        # Whether a resume token may be issued for this player on a handoff.
+        self.resumable = resumable
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        # Sequenced connections get "<seq>#" in front of every chat frame.
+        self.sequenced = sequenced
+        # Binary connections negotiated the msgpack subprotocol; frames coalesce.
+        self.binary = binary
+        # Highest sequence number sent to the player, carried by its resume token.
+        self.last_seq = 0
+        self.dropped = 0
+        self.closed = False
+        # Set once the connection is out of its room, whichever way it left.
+        self.removed = False
+        self.writer = None
+        self.bucket = TokenBucket(RATE_LIMIT, RATE_BURST)
+        # Set while the player is over its rate limit, so it's told once per streak.
+        self.throttled = False
+        self.last_seen = time.monotonic()
+        self.pinged = False
+
+    def start(self):
+        self.writer = asyncio.create_task(self._write_loop())
+
+    def offer(self, frame) -> bool:
+        """Queue an Event, Control or raw text frame without waiting.
+
+        Returns False if the queue is full.
+        """
+        if self.closed:
+            return False
+        try:
+            self.queue.put_nowait(frame)
+        except asyncio.QueueFull:
+            self.dropped += 1
+            return False
+        return True
+
+    async def _write_loop(self):
+        try:
+            while True:
+                item = await self.queue.get()
+                if isinstance(item, Handoff):
+                    # Nothing is sent after this; the next replica replays from here.
+                    await self.send_event(item.control(self.last_seq))
+                    return
+                if not self.binary:
+                    if isinstance(item, str):
+                        await self.websocket.send_text(item)
+                    else:
+                        await self.send_event(item)
+                    continue
+                batch = [item]
+                if COALESCE_WINDOW > 0:
+                    # Let a burst of small events pile up, then ship them as one frame.
+                    await asyncio.sleep(COALESCE_WINDOW)
+                while len(batch) < COALESCE_MAX and not self.queue.empty():
+                    batch.append(self.queue.get_nowait())
+                    if isinstance(batch[-1], Handoff):
+                        self.queue.put_nowait(batch.pop())
+                        break
+                await self.send_batch(batch)
+        except asyncio.CancelledError:
+            pass
+        except Exception:
+            # The socket is gone; the receive loop will notice and leave the room.
+            pass
+        finally:
+            self.closed = True
+
+    async def send_event(self, event):
+        """Send one Event or Control frame in this connection's encoding."""
+        if self.binary:
+            await self.websocket.send_bytes(event.packed)
+        else:
+            await self.websocket.send_text(
+                event.sequenced_text if self.sequenced else event.text
+            )
+        self.last_seq = max(self.last_seq, event.seq)
+
+    async def send_batch(self, items: list):
+        """Send several items as one msgpack array frame (binary connections only)."""
+        packed = []
+        for item in items:
+            if isinstance(item, str):
+                item = Control(item)
+            packed.append(item.packed)
+            self.last_seq = max(self.last_seq, item.seq)
+        if packed:
+            await self.websocket.send_bytes(pack_batch(packed))
+
+    def discard_replayed(self, seqs: set):
+        """Drop queued events a resume replay already sent; call before `start()`."""
+        queued = []
+        while not self.queue.empty():
+            item = self.queue.get_nowait()
+            if not (isinstance(item, Event) and item.seq in seqs):
+                queued.append(item)
+        for item in queued:
+            self.queue.put_nowait(item)
+
+    async def close(self, code: int = 1000):
+        self.closed = True
+        if self.writer is not None:
+            self.writer.cancel()
+            try:
+                await self.writer
+            except asyncio.CancelledError:
+                pass
+        try:
+            await self.websocket.close(code=code)
+        except Exception:
+            pass
+
+
+class BroadcastHub:
+    """Per-session fan-out of events to the connected players.
+
+    With a backplane attached, local broadcasts are also relayed to the other
+    session-service replicas and their broadcasts are delivered here. With an
+    event log attached, every event gets a sequence number and is recorded so
+    reconnecting players can resume. With a presence writer attached, joins and
+    leaves are written to the sessions' active_users.
+    """
+
+    def __init__(
+        self,
+        overflow_policy: str = OVERFLOW_POLICY,
+        backplane=None,
+        event_log=None,
+        presence=None,
+    ):
+        self.overflow_policy = overflow_policy
+        self.backplane = backplane
+        self.event_log = event_log
+        self.presence = presence
+        # Keys are session IDs; values map each WebSocket to its Connection.
+        self.rooms = {}
+        # When each empty room was last left (or opened); the reaper evicts idle ones.
+        self.emptied_at = {}
+        self.session_buckets = {}
+        self._reaper = None
+        # Set once shutdown begins: no new joins, players are handed off elsewhere.
+        self.draining = False
+        self.messages_received = 0
+        self.frames_sent = 0
+        self.frames_dropped = 0
+        # Set while the shared sequence counter is out and events are numbered
+        # here, so the switch is logged once each way.
+        self.numbering_locally = False
+
+    async def start(self):
+        if self.backplane is not None:
+            await self.backplane.start(self.handle_remote_event, self.session_ids)
+        if self.event_log is not None:
+            await self.event_log.start(self.session_ids)
+        if self.presence is not None:
+            await self.presence.start()
+        if HEARTBEAT_INTERVAL > 0:
+            self._reaper = asyncio.create_task(self._reap_loop())
+
+    async def stop(self):
+        if self._reaper is not None:
+            self._reaper.cancel()
+            self._reaper = None
+        if self.backplane is not None:
+            await self.backplane.stop()
+        if self.event_log is not None:
+            await self.event_log.stop()
+        if self.presence is not None:
+            await self.presence.stop()
+
+    def open_room(self, session_id: str):
+        if session_id not in self.rooms:
+            self.rooms[session_id] = {}
+            self.emptied_at[session_id] = time.monotonic()
+        if self.backplane is not None:
+            self.backplane.announce(session_id)
+
+    async def close_room(self, session_id: str, relay: bool = True):
+        room = self.rooms.pop(session_id, None)
+        self.emptied_at.pop(session_id, None)
+        self.session_buckets.pop(session_id, None)
+        if self.event_log is not None:
+            self.event_log.forget(session_id)
+        if self.presence is not None:
+            self.presence.forget(session_id)
+        if self.backplane is not None and relay:
+            self.backplane.retire(session_id)
+            self.backplane.publish({"session_id": session_id, "close": True})
+        if room:
+            for conn in room.values():
+                conn.removed = True
+            await asyncio.gather(*(conn.close() for conn in room.values()))
+
+    def session_ids(self) -> list:
+        return list(self.rooms.keys())
+
+    def stats(self) -> dict:
+        return {
+            "rooms": {
+                session_id: {
+                    "connections": len(room),
+                    "queue_depth": sum(conn.queue.qsize() for conn in room.values()),
+                }
+                for session_id, room in self.rooms.items()
+            },
+            "messages_received": self.messages_received,
+            "frames_sent": self.frames_sent,
+            "frames_dropped": self.frames_dropped,
+        }
+
+    async def active_session_ids(self) -> set:
+        """Sessions with a room (even an empty one) on this or, via the backplane,
+        any other replica."""
+        active = set(self.rooms.keys())
+        if self.backplane is not None:
+            active |= await self.backplane.active_session_ids()
+        return active
+
+    def handle_remote_event(self, event: dict):
+        session_id = event["session_id"]
+        if event.get("close"):
+            asyncio.create_task(self.close_room(session_id, relay=False))
+            return
+        event = Event.from_dict(event)
+        if self.event_log is not None:
+            self.event_log.record(event, local=False)
+        self.publish(session_id, event)
+
+    def join(
+        self,
+        session_id: str,
+        websocket,
+        name: str,
+        sequenced: bool = False,
+        binary: bool = False,
+        start: bool = True,
+        resumable: bool = True,
+    ) -> Connection:
+        """Add a connection to the room.
+
+        With start=False, frames queue up until `connection.start()`.
+        """
+        if session_id not in self.rooms:
+            self.open_room(session_id)
+        connection = Connection(
+            websocket, name, sequenced=sequenced, binary=binary, resumable=resumable
+        )
+        if start:
+            connection.start()
+        self.rooms[session_id][websocket] = connection
+        self.emptied_at.pop(session_id, None)
+        if self.presence is not None:
+            self.presence.joined(session_id, name)
+        return connection
+
+    async def leave(self, session_id: str, connection: Connection):
+        self._remove(session_id, connection)
+        if connection.writer is not None:
+            connection.writer.cancel()
+        connection.closed = True
+
+    def _remove(self, session_id: str, connection: Connection):
+        """Take a connection out of its room, once, however it left.
+
+        Leaving, reaping, overflowing and draining all end up here.
+        """
+        if connection.removed:
+            return
+        connection.removed = True
+        room = self.rooms.get(session_id)
+        if room is not None:
+            room.pop(connection.websocket, None)
+            if not room:
+                self.emptied_at[session_id] = time.monotonic()
+        if self.presence is not None:
+            self.presence.left(session_id, connection.name)
+
+    def evict_idle_rooms(self, idle_for: float) -> int:
+        """Drop rooms empty for `idle_for` seconds; the sessions stay in Mongo."""
+        now = time.monotonic()
+        for session_id, room in self.rooms.items():
+            if not room:
+                # An empty room must always be on the idle clock, or it is never freed.
+                self.emptied_at.setdefault(session_id, now)
+        cutoff = now - idle_for
+        idle = [
+            session_id
+            for session_id, since in self.emptied_at.items()
+            if since <= cutoff and not self.rooms.get(session_id)
+        ]
+        for session_id in idle:
+            self.rooms.pop(session_id, None)
+            self.emptied_at.pop(session_id, None)
+            self.session_buckets.pop(session_id, None)
+            if self.event_log is not None:
+                self.event_log.forget(session_id)
+            if self.backplane is not None:
+                # Other replicas keep their own rooms; this one stops announcing it.
+                self.backplane.retire(session_id)
+        return len(idle)
+
+    def admit(self, session_id: str, connection: Connection) -> bool:
+        """Charge one message to the player's and the session's rate limits."""
+        self.touch(connection)
+        scope = None
+        if not connection.bucket.take():
+            scope = "connection"
+        else:
+            bucket = self.session_buckets.get(session_id)
+            if bucket is None:
+                bucket = self.session_buckets[session_id] = TokenBucket(
+                    SESSION_RATE_LIMIT, SESSION_RATE_BURST
+                )
+            if not bucket.take():
+                scope = "session"
+        if scope is None:
+            connection.throttled = False
+            return True
+        MESSAGES_THROTTLED.labels(scope=scope).inc()
+        if not connection.throttled:
+            connection.throttled = True
+            connection.offer(Control({"error": "rate limited", "scope": scope}))
+        return False
+
+    def touch(self, connection: Connection):
+        """Note that the player is alive (any frame, including a "pong")."""
+        connection.last_seen = time.monotonic()
+        connection.pinged = False
+
+    async def _reap_loop(self):
+        while True:
+            await asyncio.sleep(min(HEARTBEAT_INTERVAL, HEARTBEAT_TIMEOUT))
+            await self.reap()
+
+    async def reap(self):
+        """Ping silent players; close connections that are dead or stopped answering."""
+        if self.draining:
+            return
+        now = time.monotonic()
+        reaped = []
+        for session_id, room in self.rooms.items():
+            for connection in room.values():
+                if connection.closed:
+                    # The writer failed, so the socket is gone, disconnect or not.
+                    reaped.append((session_id, connection, "dead"))
+                elif (
+                    now - connection.last_seen >= HEARTBEAT_INTERVAL + HEARTBEAT_TIMEOUT
+                    and connection.pinged
+                ):
+                    reaped.append((session_id, connection, "heartbeat"))
+                elif (
+                    now - connection.last_seen >= HEARTBEAT_INTERVAL
+                    and not connection.pinged
+                ):
+                    connection.pinged = True
+                    connection.offer(Control("ping"))
+        for session_id, connection, reason in reaped:
+            self._remove(session_id, connection)
+            CONNECTIONS_REAPED.labels(reason=reason).inc()
+        await asyncio.gather(
+            *(conn.close(code=REAPED_CLOSE_CODE) for _, conn, _ in reaped)
+        )
+
+    async def drain(self, timeout: float):
+        """Hand every player off to another replica; wait up to `timeout` for them."""
+        self.draining = True
+        if self.event_log is not None:
+            # Other replicas replay from the durable log, so it must have everything.
+            await self.event_log.flush()
+        if self.presence is not None:
+            # Written before the handoff, so it can't land after their join elsewhere.
+            self.presence.release_all()
+            await self.presence.flush()
+        lagging = []
+        for session_id, room in self.rooms.items():
+            for connection in room.values():
+                if connection.writer is None:
+                    connection.start()
+                # Queued behind the frames already pending for the player.
+                handoff = Handoff(
+                    session_id, connection.name, resumable=connection.resumable
+                )
+                if not connection.offer(handoff):
+                    # Too far behind to be told; it resumes by last_seq after the close.
+                    lagging.append(connection)
+        await asyncio.gather(
+            *(conn.close(code=SERVICE_RESTART_CLOSE_CODE) for conn in lagging)
+        )
+        deadline = time.monotonic() + timeout
+        while any(self.rooms.values()) and time.monotonic() < deadline:
+            await asyncio.sleep(0.1)
+        remaining = [
+            (session_id, conn)
+            for session_id, room in self.rooms.items()
+            for conn in room.values()
+        ]
+        if remaining:
+            print(f"Drain deadline reached, closing {len(remaining)} connections")
+        for session_id, conn in remaining:
+            self._remove(session_id, conn)
+        await asyncio.gather(
+            *(conn.close(code=SERVICE_RESTART_CLOSE_CODE) for _, conn in remaining)
+        )
+
+    async def next_seq(self, session_id: str) -> int:
+        if self.backplane is not None:
+            # The counter is raised to what this replica has seen, so numbers
+            # handed out locally while it was unreachable are never repeated.
+            floor = self.event_log.last_seq.get(session_id, 0)
+            try:
+                seq = await self.backplane.next_seq(session_id, floor)
+            except Exception as exc:
+                if not self.numbering_locally:
+                    self.numbering_locally = True
+                    print(f"Shared sequence unavailable, numbering locally: {exc!r}")
+            else:
+                if self.numbering_locally:
+                    self.numbering_locally = False
+                    print("Shared sequence is back")
+                return seq
+        return self.event_log.next_seq(session_id)
+
+    async def broadcast(
+        self, session_id: str, sender: Connection, data, event_type: str = "chat"
+    ) -> int:
+        """Send an event (chat by default) from `sender` to the rest of the room."""
+        self.messages_received += 1
+        seq = await self.next_seq(session_id) if self.event_log is not None else 0
+        # The event caches its encodings, so each frame is built once however many
+        # players listen.
+        event = Event(session_id, seq, sender.name, data, event_type)
+        if self.event_log is not None:
+            self.event_log.record(event, local=True)
+        if self.backplane is not None:
+            self.backplane.publish(event.to_dict())
+        return self.publish(session_id, event, exclude=sender)
+
+    async def replay(self, session_id: str, connection: Connection, last_seq: int):
+        """Send a resuming player what it missed since `last_seq`; start its writer.
+
+        Live events queued since the join are delivered after the replay,
+        except those the replay already included.
+        """
+        snapshot, events = await self.event_log.resume(session_id, last_seq)
+        sent = {event.seq for event in events}
+        if snapshot is not None:
+            if connection.binary:
+                await connection.send_event(Control({"snapshot": snapshot}))
+            else:
+                await connection.send_event(Control(f"snapshot {json.dumps(snapshot)}"))
+            connection.last_seq = snapshot["seq"]
+            sent.update(event["seq"] for event in snapshot.get("recent", ()))
+        if connection.binary:
+            # Binary clients get the whole delta as one msgpack array frame.
+            await connection.send_batch(events)
+        else:
+            for event in events:
+                await connection.send_event(event)
+        connection.last_seq = max(connection.last_seq, last_seq)
+        connection.discard_replayed(sent)
+        connection.start()
+
+    def publish(self, session_id: str, frame, exclude: Connection = None) -> int:
+        room = self.rooms.get(session_id)
+        if not room:
+            return 0
+        delivered = 0
+        lagging = []
+        for connection in room.values():
+            if connection is exclude:
+                continue
+            if connection.offer(frame):
+                delivered += 1
+                continue
+            self.frames_dropped += 1
+            if self.overflow_policy == "disconnect":
+                lagging.append(connection)
+        for connection in lagging:
+            self._remove(session_id, connection)
+            asyncio.create_task(connection.close(code=OVERFLOW_CLOSE_CODE))
+        self.frames_sent += delivered
+        return delivered
@@ -0,0 +1,167 @@
+import os
+import time
+import asyncio
+from collections import OrderedDict
+
+from prometheus_client import Counter
+from pymongo.errors import OperationFailure, PyMongoError
+
+# --- Session cache settings ---
+SESSION_CACHE_SIZE = int(os.getenv("SESSION_CACHE_SIZE", 10_000))
+# Upper bound on staleness when change streams aren't available (standalone mongod).
+SESSION_CACHE_TTL = float(os.getenv("SESSION_CACHE_TTL", 30))
+# Written on every join and leave (by the presence writer) and never read from
+# the cache, so updates touching nothing else don't invalidate entries.
+PRESENCE_FIELDS = ["presence", "active_users", "active", "last_activity", "expire_at"]
+
+# --- Prometheus Metrics ---
+SESSION_CACHE_HITS = Counter("session_cache_hits", "Session document cache hits")
+SESSION_CACHE_MISSES = Counter("session_cache_misses", "Session document cache misses")
+SESSION_CACHE_EVICTIONS = Counter(
+    "session_cache_evictions",
+    "Session documents dropped from the cache",
+    ["reason"],
+)
+
+
+def _top_level(paths) -> dict:
+    # "active_users.3" -> "active_users"
+    return {
+        "$map": {
+            "input": {"$ifNull": [paths, []]},
+            "in": {"$arrayElemAt": [{"$split": ["$$this", "."]}, 0]},
+        }
+    }
+
+
+def watch_pipeline() -> list:
+    """Change events that may affect a cached session: all but presence-only updates."""
+    description = "$updateDescription"
+    touched = {
+        "$setUnion": [
+            _top_level(
+                {
+                    "$map": {
+                        "input": {
+                            "$objectToArray": {
+                                "$ifNull": [f"{description}.updatedFields", {}]
+                            }
+                        },
+                        "in": "$$this.k",
+                    }
+                }
+            ),
+            _top_level(f"{description}.removedFields"),
+            _top_level(
+                {
+                    "$map": {
+                        "input": {"$ifNull": [f"{description}.truncatedArrays", []]},
+                        "in": "$$this.field",
+                    }
+                }
+            ),
+        ]
+    }
+    return [
+        {
+            "$match": {
+                "$or": [
+                    {"operationType": {"$in": ["replace", "delete"]}},
+                    {
+                        "operationType": "update",
+                        "$expr": {
+                            "$gt": [
+                                {
+                                    "$size": {
+                                        "$setDifference": [touched, PRESENCE_FIELDS]
+                                    }
+                                },
+                                0,
+                            ]
+                        },
+                    },
+                ]
+            }
+        }
+    ]
+
+
+def freeze(doc: dict) -> dict:
+    """Cached form of a session document: allowed_users becomes a frozenset."""
+    doc = dict(doc)
+    doc["allowed_users"] = frozenset(doc.get("allowed_users") or ())
+    return doc
+
+
+class SessionCache:
+    """LRU + TTL cache of session documents keyed by session_id."""
+
+    def __init__(
+        self,
+        collection,
+        maxsize: int = SESSION_CACHE_SIZE,
+        ttl: float = SESSION_CACHE_TTL,
+    ):
+        self.collection = collection
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()  # session_id -> (expires_at, doc)
+        self._object_ids = {}  # Mongo _id -> session_id, to map change events back
+
+    async def get(self, session_id: str):
+        """Return the cached session document, reading it from Mongo on a miss."""
+        entry = self._entries.get(session_id)
+        if entry is not None:
+            expires_at, doc = entry
+            if expires_at > time.monotonic():
+                self._entries.move_to_end(session_id)
+                SESSION_CACHE_HITS.inc()
+                return doc
+            self._drop(session_id, "expired")
+        SESSION_CACHE_MISSES.inc()
+        doc = await self.collection.find_one({"session_id": session_id})
+        if doc is None:
+            return None
+        doc = freeze(doc)
+        self._store(session_id, doc)
+        return doc
+
+    def invalidate(self, session_id: str):
+        if session_id in self._entries:
+            self._drop(session_id, "invalidated")
+
+    def _store(self, session_id: str, doc: dict):
+        if session_id in self._entries:
+            self._drop(session_id, "replaced")
+        self._entries[session_id] = (time.monotonic() + self.ttl, doc)
+        self._object_ids[doc.get("_id")] = session_id
+        while len(self._entries) > self.maxsize:
+            oldest = next(iter(self._entries))
+            self._drop(oldest, "capacity")
+
+    def _drop(self, session_id: str, reason: str):
+        _, doc = self._entries.pop(session_id)
+        self._object_ids.pop(doc.get("_id"), None)
+        if reason != "replaced":
+            SESSION_CACHE_EVICTIONS.labels(reason=reason).inc()
+
+    async def watch(self):
+        """Invalidate entries changed by any replica; needs Mongo as a replica set."""
+        pipeline = watch_pipeline()
+        while True:
+            try:
+                async with self.collection.watch(pipeline) as stream:
+                    async for change in stream:
+                        session_id = self._object_ids.get(change["documentKey"]["_id"])
+                        if session_id is not None:
+                            self.invalidate(session_id)
+            except OperationFailure as exc:
+                # Standalone mongod: no change streams, entries expire after the TTL.
+                print(f"Session cache change stream unavailable, relying on TTL: {exc}")
+                return
+            except PyMongoError as exc:
+                # Events may have been missed while disconnected, so start over cold.
+                print(f"Session cache change stream interrupted, retrying: {exc}")
+                self._entries.clear()
+                self._object_ids.clear()
+                await asyncio.sleep(1)
@@ -0,0 +1,207 @@
+import os
+import time
+import bisect
+import asyncio
+from collections import deque
+
+from pymongo.errors import DuplicateKeyError, PyMongoError
+
+from utils.protocol import Event
+
+# --- Event log settings ---
+# Recent events per session kept in memory; most resumes are served from here.
+EVENT_RING_SIZE = int(os.getenv("EVENT_RING_SIZE", 512))
+# Events are written to Mongo in batches, off the broadcast path.
+EVENT_FLUSH_INTERVAL = float(os.getenv("EVENT_FLUSH_INTERVAL", 0.05))
+SNAPSHOT_INTERVAL = float(os.getenv("SNAPSHOT_INTERVAL", 30))
+# Events carried in a snapshot, so a player far behind still gets recent context.
+SNAPSHOT_TAIL = int(os.getenv("SNAPSHOT_TAIL", 50))
+# Resumes further behind than this get the latest snapshot instead of the full delta.
+REPLAY_LIMIT = int(os.getenv("REPLAY_LIMIT", 1000))
+
+
+class EventLog:
+    """Append-only per-session log: an in-memory ring before a capped Mongo collection.
+
+    Sequence numbers come from the backplane's per-session counter, so they
+    strictly increase across replicas; relayed events may still arrive after
+    newer local ones, so the ring is kept in sequence order. Only the replica
+    where an event originated writes it to Mongo.
+    """
+
+    def __init__(self, events_collection, snapshots_collection):
+        self.events_collection = events_collection
+        self.snapshots_collection = snapshots_collection
+        self.rings = {}
+        self.last_seq = {}
+        # When each ring last got an event, so rings of idle sessions can be dropped.
+        self.touched = {}
+        self._pending = []
+        self._changed = set()
+        self._tasks = []
+        self.local_sessions = None
+
+    async def start(self, local_sessions):
+        self.local_sessions = local_sessions
+        self._tasks = [
+            asyncio.create_task(self._flush_loop()),
+            asyncio.create_task(self._snapshot_loop()),
+        ]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        await self.flush()
+
+    def next_seq(self, session_id: str) -> int:
+        """Sequence number from this replica alone, when the shared counter is out.
+
+        Counts on from the highest number seen here, so it stays in step with
+        the shared counter, which is pushed past it again once reachable. A
+        session new to this replica starts at the clock (in microseconds), above
+        the numbers of events logged before.
+        """
+        last = self.last_seq.get(session_id)
+        seq = last + 1 if last is not None else time.time_ns() // 1000
+        self.last_seq[session_id] = seq
+        return seq
+
+    def record(self, event: Event, local: bool):
+        """Add an event to the ring; local events are also queued for Mongo."""
+        ring = self.rings.get(event.session_id)
+        if ring is None:
+            ring = self.rings[event.session_id] = deque(maxlen=EVENT_RING_SIZE)
+        if ring and event.seq < ring[-1].seq:
+            # A relayed event that raced a newer local one; keep the ring ordered.
+            index = bisect.bisect([e.seq for e in ring], event.seq)
+            if len(ring) == ring.maxlen:
+                # A full deque refuses insert(); make room at the old end first.
+                # An event older than all of the ring is left to the durable log.
+                if index > 0:
+                    ring.popleft()
+                    ring.insert(index - 1, event)
+            else:
+                ring.insert(index, event)
+        else:
+            ring.append(event)
+        self.last_seq[event.session_id] = max(
+            self.last_seq.get(event.session_id, 0), event.seq
+        )
+        self.touched[event.session_id] = time.monotonic()
+        self._changed.add(event.session_id)
+        if local:
+            self._pending.append(event.to_dict())
+
+    def forget(self, session_id: str):
+        self.rings.pop(session_id, None)
+        self.last_seq.pop(session_id, None)
+        self.touched.pop(session_id, None)
+        self._changed.discard(session_id)
+
+    def forget_idle(self, keep, idle_for: float) -> int:
+        """Drop rings of sessions outside `keep`, idle for `idle_for` seconds."""
+        cutoff = time.monotonic() - idle_for
+        idle = [
+            session_id
+            for session_id in self.rings
+            if session_id not in keep and self.touched.get(session_id, 0) < cutoff
+        ]
+        for session_id in idle:
+            self.forget(session_id)
+        return len(idle)
+
+    async def flush(self):
+        batch, self._pending = self._pending, []
+        if not batch:
+            return
+        try:
+            await self.events_collection.insert_many(batch, ordered=False)
+        except PyMongoError as exc:
+            # The ring still holds these, so only resumes from far behind lose them.
+            print(f"Event log flush failed, dropped {len(batch)} events: {exc}")
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(EVENT_FLUSH_INTERVAL)
+            await self.flush()
+
+    async def snapshot(self, session_id: str):
+        ring = self.rings.get(session_id)
+        if not ring:
+            return
+        recent = [event.to_dict() for event in list(ring)[-SNAPSHOT_TAIL:]]
+        doc = {
+            "session_id": session_id,
+            "seq": ring[-1].seq,
+            "created_at": time.time(),
+            "participants": sorted({event["name"] for event in recent}),
+            "recent": recent,
+        }
+        try:
+            # Only ever move a session's snapshot forward; replicas may race here.
+            await self.snapshots_collection.update_one(
+                {"session_id": session_id, "seq": {"$lt": doc["seq"]}},
+                {"$set": doc},
+                upsert=True,
+            )
+        except DuplicateKeyError:
+            pass  # Another replica already stored a newer snapshot.
+        except PyMongoError as exc:
+            print(f"Snapshot of session {session_id} failed: {exc}")
+
+    async def _snapshot_loop(self):
+        while True:
+            await asyncio.sleep(SNAPSHOT_INTERVAL)
+            changed, self._changed = self._changed, set()
+            for session_id in changed & set(self.local_sessions()):
+                await self.snapshot(session_id)
+
+    async def resume(self, session_id: str, last_seq: int):
+        """(snapshot or None, events after it) for a player who last saw `last_seq`."""
+        ring = self.rings.get(session_id)
+        if ring and ring[0].seq <= last_seq:
+            return None, [event for event in ring if event.seq > last_seq]
+
+        # Older than what's in memory: read the durable log, including our own
+        # unflushed events.
+        await self.flush()
+        docs = await self._events_after(session_id, last_seq)
+        snapshot = None
+        if len(docs) > REPLAY_LIMIT:
+            snapshot = await self.snapshots_collection.find_one(
+                {"session_id": session_id}, projection={"_id": 0}
+            )
+            floor = snapshot["seq"] if snapshot is not None else last_seq
+            docs = await self._latest_events(session_id, floor)
+
+        # Relayed events may still be waiting in their origin replica's buffer,
+        # so merge the ring in.
+        events = {doc["seq"]: Event.from_dict(doc) for doc in docs}
+        floor = snapshot["seq"] if snapshot is not None else last_seq
+        for event in ring or ():
+            if event.seq > floor:
+                events[event.seq] = event
+        return snapshot, [events[seq] for seq in sorted(events)]
+
+    async def _events_after(self, session_id: str, seq: int) -> list:
+        cursor = (
+            self.events_collection.find(
+                {"session_id": session_id, "seq": {"$gt": seq}}, projection={"_id": 0}
+            )
+            .sort("seq", 1)
+            .limit(REPLAY_LIMIT + 1)
+        )
+        return await cursor.to_list(length=REPLAY_LIMIT + 1)
+
+    async def _latest_events(self, session_id: str, seq: int) -> list:
+        # The newest REPLAY_LIMIT events after `seq`, oldest first.
+        cursor = (
+            self.events_collection.find(
+                {"session_id": session_id, "seq": {"$gt": seq}}, projection={"_id": 0}
+            )
+            .sort("seq", -1)
+            .limit(REPLAY_LIMIT)
+        )
+        return list(reversed(await cursor.to_list(length=REPLAY_LIMIT)))
@@ -0,0 +1,173 @@
+import os
+import time
+import random
+import asyncio
+import datetime
+
+from prometheus_client import Counter, Gauge
+from pymongo import ASCENDING, ReplaceOne
+from pymongo.errors import PyMongoError
+
+# --- Expiry settings ---
+# How often each replica runs the reaper (jittered, so replicas don't run in lockstep).
+SESSION_REAP_INTERVAL = float(os.getenv("SESSION_REAP_INTERVAL", 60))
+# Rooms, rate limit buckets and event rings of sessions nobody on this replica
+# has been in for this long are dropped from memory; the sessions stay in Mongo.
+ROOM_IDLE_TIMEOUT = float(os.getenv("ROOM_IDLE_TIMEOUT", 300))
+# Sessions with nobody connected and no activity for this long are moved to
+# the archive (0 turns archiving off).
+SESSION_ARCHIVE_AFTER = float(os.getenv("SESSION_ARCHIVE_AFTER", 7 * 24 * 3600))
+SESSION_ARCHIVE_BATCH = int(os.getenv("SESSION_ARCHIVE_BATCH", 500))
+# Caps the work of one run; the rest waits for the next.
+SESSION_ARCHIVE_MAX_BATCHES = int(os.getenv("SESSION_ARCHIVE_MAX_BATCHES", 20))
+# Sessions left alone this long are deleted by the TTL index even if never archived.
+SESSION_TTL = float(os.getenv("SESSION_TTL", 30 * 24 * 3600))
+
+# --- Prometheus Metrics ---
+RECLAIMED = Counter(
+    "session_reaper_reclaimed",
+    "Entries removed by the session reaper",
+    ["kind"],
+)
+COLLECTION_DOCUMENTS = Gauge(
+    "session_collection_documents",
+    "Documents per collection, as last sampled by the reaper",
+    ["collection"],
+    multiprocess_mode="max",
+)
+COLLECTION_BYTES = Gauge(
+    "session_collection_storage_bytes",
+    "On-disk size per collection, as last sampled by the reaper",
+    ["collection"],
+    multiprocess_mode="max",
+)
+ROOMS_IN_MEMORY = Gauge(
+    "session_rooms_in_memory",
+    "Rooms held in memory, empty ones included",
+    multiprocess_mode="livesum",
+)
+
+
+def expiry_date() -> datetime.datetime:
+    """New expire_at for a session written now."""
+    return datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(
+        seconds=SESSION_TTL
+    )
+
+
+class SessionReaper:
+    """Periodically frees idle rooms and archives finished sessions in batches."""
+
+    def __init__(self, hub, sessions, archive, snapshots, on_archived=None):
+        self.hub = hub
+        self.sessions = sessions
+        self.archive = archive
+        self.snapshots = snapshots
+        # Called with the IDs of archived sessions, e.g. to drop them from caches.
+        self.on_archived = on_archived
+
+    async def run(self, interval: float = SESSION_REAP_INTERVAL):
+        while True:
+            await asyncio.sleep(interval * random.uniform(0.8, 1.2))
+            try:
+                await self.reap()
+            except PyMongoError as exc:
+                print(f"Session reaper run failed: {exc}")
+
+    async def reap(self) -> dict:
+        reclaimed = {"rooms": self.hub.evict_idle_rooms(ROOM_IDLE_TIMEOUT)}
+        if self.hub.event_log is not None:
+            # Rings filled by events relayed from rooms only on other replicas.
+            reclaimed["event_rings"] = self.hub.event_log.forget_idle(
+                self.hub.rooms, ROOM_IDLE_TIMEOUT
+            )
+        if self.hub.presence is not None:
+            # First, so sessions a crashed replica left active can be archived.
+            reclaimed["orphaned_presence"] = await self.clear_orphaned_presence()
+        if SESSION_ARCHIVE_AFTER > 0:
+            reclaimed["sessions_archived"] = await self.archive_finished()
+        for kind, count in reclaimed.items():
+            RECLAIMED.labels(kind=kind).inc(count)
+        ROOMS_IN_MEMORY.set(len(self.hub.rooms))
+        await self.sample_sizes()
+        return reclaimed
+
+    async def clear_orphaned_presence(self) -> int:
+        try:
+            live = await self.hub.active_session_ids()
+        except Exception as exc:
+            # Without the registry a live session can't be told from an orphaned one.
+            print(f"Active session registry unavailable, presence left as is: {exc}")
+            return 0
+        return await self.hub.presence.clear_orphaned(live)
+
+    async def archive_finished(self) -> int:
+        """Archive sessions idle for SESSION_ARCHIVE_AFTER; returns how many."""
+        cutoff = time.time() - SESSION_ARCHIVE_AFTER
+        finished = {"active": False, "last_activity": {"$lt": cutoff}}
+        archived = 0
+        for _ in range(SESSION_ARCHIVE_MAX_BATCHES):
+            docs = await (
+                self.sessions.find(finished, projection={"_id": 0, "expire_at": 0})
+                .sort("last_activity", ASCENDING)
+                .limit(SESSION_ARCHIVE_BATCH)
+                .to_list(SESSION_ARCHIVE_BATCH)
+            )
+            if not docs:
+                break
+            session_ids = [doc["session_id"] for doc in docs]
+            snapshots = {
+                snapshot["session_id"]: snapshot
+                async for snapshot in self.snapshots.find(
+                    {"session_id": {"$in": session_ids}}, projection={"_id": 0}
+                )
+            }
+            archived_at = datetime.datetime.now(datetime.timezone.utc)
+            # Upserts, so a batch another replica archived at the same time is harmless.
+            await self.archive.bulk_write(
+                [
+                    ReplaceOne(
+                        {"session_id": doc["session_id"]},
+                        {
+                            **doc,
+                            "archived_at": archived_at,
+                            "snapshot": snapshots.get(doc["session_id"]),
+                        },
+                        upsert=True,
+                    )
+                    for doc in docs
+                ],
+                ordered=False,
+            )
+            # Same filter again: a player may have joined since the find.
+            await self.sessions.delete_many(
+                {"session_id": {"$in": session_ids}, **finished}
+            )
+            revived = set(
+                await self.sessions.distinct(
+                    "session_id", {"session_id": {"$in": session_ids}}
+                )
+            )
+            if revived:
+                await self.archive.delete_many({"session_id": {"$in": list(revived)}})
+            gone = [
+                session_id for session_id in session_ids if session_id not in revived
+            ]
+            await self.snapshots.delete_many({"session_id": {"$in": gone}})
+            if self.on_archived is not None:
+                self.on_archived(gone)
+            archived += len(gone)
+            if len(docs) < SESSION_ARCHIVE_BATCH:
+                break
+        return archived
+
+    async def sample_sizes(self):
+        for collection in (self.sessions, self.archive):
+            documents = storage = 0
+            async for stats in collection.aggregate(
+                [{"$collStats": {"storageStats": {}}}]
+            ):
+                documents += stats["storageStats"].get("count", 0)
+                storage += stats["storageStats"].get("storageSize", 0)
+            COLLECTION_DOCUMENTS.labels(collection=collection.name).set(documents)
+            COLLECTION_BYTES.labels(collection=collection.name).set(storage)
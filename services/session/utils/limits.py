@@ -0,0 +1,73 @@
+import os
+import time
+
+from prometheus_client import Counter
+
+# --- Connection limits ---
+# Messages per second a single player may send, with bursts up to RATE_BURST
+# (0 disables).
+RATE_LIMIT = float(os.getenv("RATE_LIMIT", 20))
+RATE_BURST = float(os.getenv("RATE_BURST", 40))
+# Messages per second a whole session may fan out, across all of its players.
+SESSION_RATE_LIMIT = float(os.getenv("SESSION_RATE_LIMIT", 200))
+SESSION_RATE_BURST = float(os.getenv("SESSION_RATE_BURST", 400))
+# Larger frames close the connection with 1009 (message too big). uvicorn
+# enforces it as the frame arrives (ws_max_size); the check on received
+# messages covers servers started some other way.
+MAX_MESSAGE_BYTES = int(os.getenv("MAX_MESSAGE_BYTES", 16 * 1024))
+MESSAGE_TOO_BIG_CLOSE_CODE = 1009
+# Seconds a new socket gets to send the player's name before it is closed.
+HANDSHAKE_TIMEOUT = float(os.getenv("HANDSHAKE_TIMEOUT", 10))
+# Opt-in app-level heartbeat, for clients that answer it: players silent for
+# HEARTBEAT_INTERVAL are pinged ("server:: ping"); any frame, e.g. "pong", counts
+# as an answer. Still silent HEARTBEAT_TIMEOUT later, the connection is reaped.
+# Off (0) by default, since older clients never answer; half-open sockets are
+# caught by uvicorn's protocol-level pings (WS_PING_INTERVAL) instead.
+HEARTBEAT_INTERVAL = float(os.getenv("HEARTBEAT_INTERVAL", 0))
+HEARTBEAT_TIMEOUT = float(os.getenv("HEARTBEAT_TIMEOUT", 30))
+# Close code for connections reaped by the heartbeat or the handshake timeout
+# (policy violation).
+REAPED_CLOSE_CODE = 1008
+
+# --- Prometheus Metrics ---
+MESSAGES_THROTTLED = Counter(
+    "websocket_messages_throttled",
+    "Player messages dropped by a rate limit",
+    ["scope"],
+)
+MESSAGES_OVERSIZED = Counter(
+    "websocket_messages_oversized",
+    "Player messages over MAX_MESSAGE_BYTES; the connection is closed",
+)
+CONNECTIONS_REAPED = Counter(
+    "websocket_connections_reaped",
+    "WebSocket connections closed by the server for being silent, dead or slow to join",
+    ["reason"],
+)
+
+
+class MessageTooBig(Exception):
+    """Raised for a player frame larger than MAX_MESSAGE_BYTES."""
+
+
+class TokenBucket:
+    """Allows `rate` events per second on average and up to `burst` at once."""
+
+    __slots__ = ("rate", "burst", "tokens", "updated")
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+
+    def take(self) -> bool:
+        if self.rate <= 0:
+            return True
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
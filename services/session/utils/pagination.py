@@ -0,0 +1,51 @@
+import json
+import base64
+import binascii
+
+# Sessions are paged in (created_at, session_id) order; session_id breaks ties
+# between sessions created in the same instant.
+SORT_ORDER = [("created_at", 1), ("session_id", 1)]
+# Never fetch Mongo's internal _id or the TTL date, they aren't JSON serializable
+# and clients don't need them.
+# Per-replica presence entries are internal; active_users is derived from them.
+PROJECTION = {"_id": 0, "expire_at": 0, "presence": 0}
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+
+def encode_cursor(doc: dict) -> str:
+    """Opaque continuation token pointing just past `doc`."""
+    raw = json.dumps([doc["created_at"], doc["session_id"]]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(token: str) -> tuple:
+    """Inverse of `encode_cursor`; raises ValueError for malformed tokens."""
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        created_at, session_id = json.loads(base64.urlsafe_b64decode(padded))
+    except (
+        binascii.Error,
+        json.JSONDecodeError,
+        UnicodeDecodeError,
+        TypeError,
+        ValueError,
+    ):
+        raise ValueError("Invalid cursor.")
+    if not isinstance(created_at, (int, float)) or not isinstance(session_id, str):
+        raise ValueError("Invalid cursor.")
+    return created_at, session_id
+
+
+def after_cursor(query: dict, token: str = None) -> dict:
+    """Extend `query` so it only matches sessions sorted after the cursor."""
+    if not token:
+        return query
+    created_at, session_id = decode_cursor(token)
+    keyset = {
+        "$or": [
+            {"created_at": {"$gt": created_at}},
+            {"created_at": created_at, "session_id": {"$gt": session_id}},
+        ]
+    }
+    return {"$and": [query, keyset]} if query else keyset
@@ -0,0 +1,213 @@
+import os
+import time
+import uuid
+import asyncio
+
+from prometheus_client import Counter
+from pymongo import UpdateOne
+
+from utils.expiry import expiry_date
+
+# --- Presence settings ---
+# Joins and leaves are buffered and written to the session documents together
+# once per interval, so connecting and disconnecting never wait on Mongo.
+PRESENCE_FLUSH_INTERVAL = float(os.getenv("PRESENCE_FLUSH_INTERVAL", 0.5))
+# Sessions updated per bulk_write; a larger backlog is written in several.
+PRESENCE_MAX_BATCH = int(os.getenv("PRESENCE_MAX_BATCH", 500))
+# A session still marked active with no presence write for this long, and no
+# room on any replica in the backplane registry, lost its players without a
+# leave being written (e.g. their replica crashed); its presence is reset.
+PRESENCE_ORPHAN_AFTER = float(os.getenv("PRESENCE_ORPHAN_AFTER", 120))
+# Node recorded for players added through the REST API rather than a socket.
+API_NODE = "api"
+
+# --- Prometheus Metrics ---
+PRESENCE_UPDATES = Counter(
+    "session_presence_updates",
+    "Player joins and leaves by what became of them",
+    ["outcome"],
+)
+
+
+def presence_update(node_id: str, joined=(), left=(), everywhere=False) -> list:
+    """Update pipeline applying one replica's joins and leaves to a session.
+
+    `presence` holds one {"node", "user"} entry per replica a player is
+    connected through, so a leave on one replica can't hide the same player
+    still connected through another. active_users and `active` are derived
+    from it. With everywhere=True the leaves remove the players from every
+    replica's entries.
+    """
+    # $literal, so a name starting with "$" isn't read as a field path.
+    changed = {"$literal": list(joined) + list(left)}
+    replaced = {
+        "$and": [
+            {"$eq": ["$$this.node", node_id]},
+            {"$in": ["$$this.user", changed]},
+        ]
+    }
+    if everywhere:
+        replaced = {
+            "$or": [replaced, {"$in": ["$$this.user", {"$literal": list(left)}]}]
+        }
+    return [
+        {
+            "$set": {
+                "presence": {
+                    "$concatArrays": [
+                        {
+                            "$filter": {
+                                "input": {"$ifNull": ["$presence", []]},
+                                "cond": {"$not": [replaced]},
+                            }
+                        },
+                        {
+                            "$literal": [
+                                {"node": node_id, "user": user} for user in joined
+                            ]
+                        },
+                    ]
+                }
+            }
+        },
+        {"$set": {"active_users": {"$setUnion": ["$presence.user"]}}},
+        {
+            "$set": {
+                "active": {"$gt": [{"$size": "$active_users"}, 0]},
+                "last_activity": time.time(),
+                "expire_at": expiry_date(),
+            }
+        },
+    ]
+
+
+class PresenceWriter:
+    """Write-behind buffer for the players connected to each session on this replica.
+
+    Players are counted per (session, name), so a second tab joining or leaving
+    doesn't change anything. Changes made between two flushes collapse into the
+    player's latest state, so a quick reconnect is one write, not two. Entries
+    are written under this replica's `node_id` (see `presence_update`).
+    """
+
+    def __init__(
+        self,
+        collection,
+        interval: float = PRESENCE_FLUSH_INTERVAL,
+        max_batch: int = PRESENCE_MAX_BATCH,
+        node_id: str = None,
+    ):
+        self.collection = collection
+        self.node_id = node_id or uuid.uuid4().hex
+        self.interval = interval
+        self.max_batch = max_batch
+        self.connected = {}  # (session_id, name) -> open connections on this replica
+        self._pending = {}  # session_id -> {name: True (joined) / False (left)}
+        self._wakeup = asyncio.Event()
+        self._flusher = None
+
+    async def start(self):
+        self._flusher = asyncio.create_task(self._flush_loop())
+
+    async def stop(self):
+        if self._flusher is not None:
+            self._flusher.cancel()
+            self._flusher = None
+        await self.flush()
+
+    def joined(self, session_id: str, name: str):
+        key = (session_id, name)
+        self.connected[key] = self.connected.get(key, 0) + 1
+        if self.connected[key] == 1:
+            self._mark(session_id, name, True)
+
+    def left(self, session_id: str, name: str):
+        key = (session_id, name)
+        count = self.connected.get(key, 0) - 1
+        if count > 0:
+            self.connected[key] = count
+        elif self.connected.pop(key, None) is not None:
+            self._mark(session_id, name, False)
+
+    def forget(self, session_id: str):
+        """Drop a deleted session's players without writing anything."""
+        for key in [key for key in self.connected if key[0] == session_id]:
+            del self.connected[key]
+        self._pending.pop(session_id, None)
+
+    def release_all(self):
+        """Mark every local player as gone, e.g. before handing them off elsewhere."""
+        for session_id, name in list(self.connected):
+            self._mark(session_id, name, False)
+        self.connected.clear()
+
+    async def clear_orphaned(
+        self, live_sessions: set, limit: int = PRESENCE_MAX_BATCH
+    ) -> int:
+        """Reset active sessions no replica has a room for; returns how many."""
+        orphaned = {
+            "active": True,
+            "last_activity": {"$lt": time.time() - PRESENCE_ORPHAN_AFTER},
+        }
+        docs = await (
+            self.collection.find(orphaned, projection={"_id": 0, "session_id": 1})
+            .limit(limit)
+            .to_list(limit)
+        )
+        session_ids = [
+            doc["session_id"] for doc in docs if doc["session_id"] not in live_sessions
+        ]
+        if not session_ids:
+            return 0
+        # last_activity stays as it was, so the session still archives on time.
+        result = await self.collection.update_many(
+            {"session_id": {"$in": session_ids}, **orphaned},
+            {"$set": {"presence": [], "active_users": [], "active": False}},
+        )
+        return result.modified_count
+
+    def _mark(self, session_id: str, name: str, present: bool):
+        changes = self._pending.setdefault(session_id, {})
+        if name in changes:
+            PRESENCE_UPDATES.labels(outcome="coalesced").inc()
+        changes[name] = present
+        self._wakeup.set()
+
+    async def flush(self):
+        pending, self._pending = self._pending, {}
+        items = list(pending.items())
+        for start in range(0, len(items), self.max_batch):
+            batch = items[start : start + self.max_batch]
+            operations = [
+                UpdateOne(
+                    {"session_id": session_id},
+                    presence_update(
+                        self.node_id,
+                        joined=[name for name, present in changes.items() if present],
+                        left=[name for name, present in changes.items() if not present],
+                    ),
+                )
+                for session_id, changes in batch
+            ]
+            changed = sum(len(changes) for _, changes in batch)
+            try:
+                await self.collection.bulk_write(operations, ordered=False)
+                PRESENCE_UPDATES.labels(outcome="written").inc(changed)
+            except Exception as exc:
+                print(f"Presence flush failed, retrying {changed} changes: {exc}")
+                PRESENCE_UPDATES.labels(outcome="failed").inc(changed)
+                self._requeue(batch)
+
+    def _requeue(self, batch):
+        # Changes made since the failed flush are newer, so they win.
+        for session_id, changes in batch:
+            self._pending[session_id] = {**changes, **self._pending.get(session_id, {})}
+        self._wakeup.set()
+
+    async def _flush_loop(self):
+        while True:
+            await self._wakeup.wait()
+            # Let joins and leaves pile up so one bulk_write carries the whole burst.
+            await asyncio.sleep(self.interval)
+            self._wakeup.clear()
+            await self.flush()
@@ -0,0 +1,152 @@
+import os
+import json
+
+import msgpack
+
+# --- Wire protocols ---
+# Plain clients speak the original text protocol ("name::  message"). Clients
+# that offer this WebSocket subprotocol get msgpack envelopes instead:
+#   {"t": type, "n": sender name, "s": sequence number, "d": payload}
+# Events in a room always arrive as a msgpack array of envelopes, several of
+# them when the writer coalesced a burst into one frame.
+BINARY_SUBPROTOCOL = "dnd.msgpack.v1"
+# Event types players may send; "control" is reserved for the server.
+EVENT_TYPES = frozenset({"chat", "dice", "move", "state"})
+# Answer to a heartbeat ping; text clients just send "pong". Never broadcast.
+PONG = "pong"
+# Binary connections gather events arriving within this window into one frame.
+COALESCE_WINDOW = float(os.getenv("COALESCE_WINDOW", 0.002))
+COALESCE_MAX = int(os.getenv("COALESCE_MAX", 64))
+
+
+def pack_envelope(event_type: str, data, name: str = None, seq: int = 0) -> bytes:
+    return msgpack.packb(
+        {"t": event_type, "n": name, "s": seq, "d": data}, use_bin_type=True
+    )
+
+
+def pack_batch(packed: list) -> bytes:
+    """Join already packed envelopes into one msgpack array without re-encoding them."""
+    count = len(packed)
+    if count < 16:
+        header = bytes([0x90 | count])
+    elif count < 0x10000:
+        header = b"\xdc" + count.to_bytes(2, "big")
+    else:
+        header = b"\xdd" + count.to_bytes(4, "big")
+    return header + b"".join(packed)
+
+
+def unpack_client_frame(payload: bytes, types=None) -> tuple:
+    """Decode a player's binary frame into (type, data); ValueError if malformed."""
+    try:
+        envelope = msgpack.unpackb(payload, raw=False)
+    except (msgpack.UnpackException, ValueError) as exc:
+        raise ValueError("Malformed msgpack frame.") from exc
+    if not isinstance(envelope, dict) or envelope.get("t") not in (
+        types or EVENT_TYPES
+    ):
+        raise ValueError('Frames must be maps with a known "t" event type.')
+    return envelope["t"], envelope.get("d")
+
+
+class Event:
+    """One event in a session; each wire encoding is built once, for all recipients."""
+
+    __slots__ = (
+        "session_id",
+        "seq",
+        "name",
+        "type",
+        "data",
+        "_text",
+        "_sequenced_text",
+        "_packed",
+    )
+
+    def __init__(
+        self, session_id: str, seq: int, name: str, data, event_type: str = "chat"
+    ):
+        self.session_id = session_id
+        self.seq = seq
+        self.name = name
+        self.type = event_type
+        self.data = data
+        self._text = None
+        self._sequenced_text = None
+        self._packed = None
+
+    @property
+    def text(self) -> str:
+        if self._text is None:
+            if self.type == "chat":
+                self._text = f"{self.name}::  {self.data}"
+            else:
+                # Structured events reach text clients as "name::  /dice {...}".
+                self._text = f"{self.name}::  /{self.type} {json.dumps(self.data)}"
+        return self._text
+
+    @property
+    def sequenced_text(self) -> str:
+        # "<seq>#<name>::  <message>", for clients that track their position to resume.
+        if self._sequenced_text is None:
+            self._sequenced_text = f"{self.seq}#{self.text}"
+        return self._sequenced_text
+
+    @property
+    def packed(self) -> bytes:
+        if self._packed is None:
+            self._packed = pack_envelope(self.type, self.data, self.name, self.seq)
+        return self._packed
+
+    def to_dict(self) -> dict:
+        return {
+            "session_id": self.session_id,
+            "seq": self.seq,
+            "name": self.name,
+            "type": self.type,
+            "data": self.data,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "Event":
+        # Events logged before typed events existed carry their text under "message".
+        payload = data["data"] if "data" in data else data.get("message")
+        return cls(
+            data["session_id"],
+            data["seq"],
+            data["name"],
+            payload,
+            data.get("type", "chat"),
+        )
+
+
+class Control:
+    """A message from the server itself ("server:: ..." for text clients)."""
+
+    __slots__ = ("message", "seq", "_text", "_packed")
+
+    def __init__(self, message):
+        self.message = message
+        self.seq = 0
+        self._text = None
+        self._packed = None
+
+    @property
+    def text(self) -> str:
+        if self._text is None:
+            message = (
+                self.message
+                if isinstance(self.message, str)
+                else json.dumps(self.message)
+            )
+            self._text = f"server:: {message}"
+        return self._text
+
+    sequenced_text = text
+
+    @property
+    def packed(self) -> bytes:
+        if self._packed is None:
+            self._packed = pack_envelope("control", self.message, "server")
+        return self._packed
@@ -0,0 +1,71 @@
+import os
+import hmac
+import json
+import time
+import base64
+import hashlib
+
+# --- Resume tokens ---
+# Handed to players when a replica drains, so they can rejoin any other replica
+# as the same player, from where they left off, without the name handshake.
+# Every replica must share the secret; without RESUME_TOKEN_SECRET it is derived
+# from JWT_SECRET, and with neither set the service refuses to start.
+RESUME_TOKEN_TTL = float(os.getenv("RESUME_TOKEN_TTL", 300))
+
+
+def load_secret():
+    secret = os.getenv("RESUME_TOKEN_SECRET")
+    if secret:
+        return secret.encode()
+    jwt_secret = os.getenv("JWT_SECRET")
+    if jwt_secret:
+        # A key of its own, so a resume token never verifies as a JWT or vice versa.
+        return hmac.new(
+            jwt_secret.encode(), b"session-resume-token", hashlib.sha256
+        ).digest()
+    return None
+
+
+RESUME_TOKEN_SECRET = load_secret()
+
+
+def check_resume_secret():
+    if RESUME_TOKEN_SECRET is None:
+        raise RuntimeError(
+            "Set RESUME_TOKEN_SECRET or JWT_SECRET, resume tokens can't be signed."
+        )
+
+
+def _sign(payload: bytes) -> bytes:
+    return hmac.new(RESUME_TOKEN_SECRET, payload, hashlib.sha256).digest()
+
+
+def issue_resume_token(session_id: str, name: str, last_seq: int) -> str:
+    payload = json.dumps(
+        {
+            "s": session_id,
+            "n": name,
+            "q": last_seq,
+            "e": int(time.time() + RESUME_TOKEN_TTL),
+        },
+        separators=(",", ":"),
+    ).encode()
+    token = payload + _sign(payload)
+    return base64.urlsafe_b64encode(token).decode().rstrip("=")
+
+
+def read_resume_token(token: str, session_id: str) -> tuple:
+    """(name, last_seq) from a token for `session_id`; ValueError if it isn't valid."""
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+    except (ValueError, TypeError):
+        raise ValueError("Malformed resume token.")
+    payload, signature = raw[:-32], raw[-32:]
+    if len(raw) <= 32 or not hmac.compare_digest(signature, _sign(payload)):
+        raise ValueError("Invalid resume token.")
+    data = json.loads(payload)
+    if data["s"] != session_id:
+        raise ValueError("Resume token is for another session.")
+    if data["e"] < time.time():
+        raise ValueError("Resume token expired.")
+    return data["n"], data["q"]
@@ -0,0 +1,96 @@
+"""Pick the password hashing cost that fits a latency budget on this CPU.
+
+Times single hashes at increasing cost and reports the highest cost whose
+median stays within the target, as the setting to deploy. Run it on the same
+hardware (and under the same CPU limits) as the user service:
+
+    python calibrate_hashing.py --target-ms 250
+    python calibrate_hashing.py --scheme argon2 --target-ms 250 --memory-cost 65536
+
+Stored hashes at another cost are upgraded as users log in.
+"""
+
+import time
+import argparse
+import statistics
+
+from utils.hashing import build_context
+
+BCRYPT_ROUNDS_RANGE = range(4, 18)
+ARGON2_TIME_COST_RANGE = range(1, 21)
+
+
+def time_hash(context, samples: int) -> float:
+    """Median seconds per hash."""
+    durations = []
+    for _ in range(samples):
+        started = time.perf_counter()
+        context.hash("calibration-password")
+        durations.append(time.perf_counter() - started)
+    return statistics.median(durations)
+
+
+def calibrate(
+    scheme: str, target: float, samples: int, memory_cost: int, parallelism: int
+):
+    def build(cost):
+        if scheme == "bcrypt":
+            return build_context(["bcrypt"], bcrypt_rounds=cost)
+        return build_context(
+            ["argon2"],
+            argon2_time_cost=cost,
+            argon2_memory_cost=memory_cost,
+            argon2_parallelism=parallelism,
+        )
+
+    if scheme == "bcrypt":
+        setting, costs = "BCRYPT_ROUNDS", BCRYPT_ROUNDS_RANGE
+    else:
+        setting, costs = "ARGON2_TIME_COST", ARGON2_TIME_COST_RANGE
+    chosen = None
+    for cost in costs:
+        seconds = time_hash(build(cost), samples)
+        fits = seconds <= target
+        note = "" if fits else "  (over budget)"
+        print(f"{setting}={cost:<3} {seconds * 1000:>9.1f} ms{note}")
+        if not fits:
+            break
+        chosen = cost
+    return setting, chosen
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scheme", choices=["bcrypt", "argon2"], default="bcrypt")
+    parser.add_argument(
+        "--target-ms", type=float, default=250, help="budget for one hash"
+    )
+    parser.add_argument("--samples", type=int, default=5, help="hashes timed per cost")
+    parser.add_argument(
+        "--memory-cost", type=int, default=65536, help="argon2 memory in KiB"
+    )
+    parser.add_argument("--parallelism", type=int, default=1, help="argon2 lanes")
+    args = parser.parse_args(argv)
+
+    setting, chosen = calibrate(
+        args.scheme,
+        args.target_ms / 1000,
+        args.samples,
+        args.memory_cost,
+        args.parallelism,
+    )
+    if chosen is None:
+        print(f"Even the lowest cost is over {args.target_ms:.0f} ms on this CPU.")
+        return 1
+    print()
+    print(f"{setting}={chosen}")
+    if args.scheme == "argon2":
+        # bcrypt stays listed so existing hashes still verify until they're upgraded.
+        print("PASSWORD_SCHEMES=argon2,bcrypt")
+        print(f"ARGON2_MEMORY_COST={args.memory_cost}")
+        print(f"ARGON2_PARALLELISM={args.parallelism}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -1,44 +1,85 @@
 import os
+import asyncio
 import datetime
-import uvicorn
-from fastapi import FastAPI, Depends, HTTPException, Request
+from typing import Optional
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Depends, Header, HTTPException, Request
 from fastapi.responses import JSONResponse, Response
-from sqlalchemy.orm import Session
-from prometheus_client import Counter, generate_latest, CONTENT_TYPE_LATEST
+from sqlalchemy import delete, func, select, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from utils.token import create_jwt, is_token_valid
-from models.user import UserRegisterRequest, UserLoginRequest, UserTokenValidation
-from models.db import Users, pwd_context
-from repository.db import get_db, Base, engine
+from common.instrumentation import (
+    PrometheusMiddleware,
+    mark_started,
+    metrics_response,
+    shutdown_metrics,
+)
+from common.server import RUN_MIGRATIONS, serve, warm_up
+from common.token import create_jwt, is_token_valid, verify_token
+from migrate import migrate
+from models.user import (
+    UserRegisterRequest,
+    UserLoginRequest,
+    UserTokenValidation,
+    UserTokenBatchValidation,
+    UserBulkRegisterRequest,
+    UserBulkLookupRequest,
+)
+from models.db import Users
+from utils.hashing import hasher, HashingSaturated, PASSWORD_REHASHES
+from utils.cache import profile_cache, MISSING
+from repository.db import SessionLocal, get_db, warm_up as warm_up_db
 
-app = FastAPI(docs_url="/user/docs", openapi_url="/user/openapi.json")
 
-# --- Prometheus Metrics ---
-REQUEST_COUNT = Counter(
-    "request_count",
-    "Total number of HTTP requests",
-    ["method", "endpoint", "http_status"],
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Tables are created by migrate.py, run once per deploy.
+    if RUN_MIGRATIONS:
+        await migrate()
+    await asyncio.gather(
+        warm_up("postgres", warm_up_db()),
+        warm_up("redis", profile_cache.warm_up()),
+    )
+    # Worker processes take longest to start and aren't needed to serve reads.
+    hashing_warmer = asyncio.create_task(
+        warm_up("hashing pool", hasher.warm_up(), timeout=30)
+    )
+    mark_started()
+    yield
+    hashing_warmer.cancel()
+    for task in list(rehash_tasks.values()):
+        task.cancel()
+    hasher.shutdown()
+    await profile_cache.close()
+    shutdown_metrics()
+
+
+app = FastAPI(
+    docs_url="/user/docs",
+    openapi_url="/user/openapi.json",
+    lifespan=lifespan,
 )
 
+# --- Prometheus Metrics ---
+# Request count, latency, response size and in-flight requests per route template.
+app.add_middleware(PrometheusMiddleware)
 
-# --- Middleware for Request Counting ---
-@app.middleware("http")
-async def metrics_middleware(request: Request, call_next):
-    response = await call_next(request)
-    # Increment the counter with the method, path, and response status code.
-    REQUEST_COUNT.labels(
-        method=request.method,
-        endpoint=request.url.path,
-        http_status=response.status_code,
-    ).inc()
-    return response
+
+# --- Load shedding for the password hashing pool ---
+@app.exception_handler(HashingSaturated)
+async def hashing_saturated_handler(request: Request, exc: HashingSaturated):
+    return JSONResponse(
+        content={"message": "Server is busy, please retry."},
+        status_code=503,
+        headers={"Retry-After": "1"},
+    )
 
 
 # --- Metrics Endpoint for Prometheus ---
 @app.get("/metrics")
 async def metrics():
-    metrics_data = generate_latest()
-    return Response(content=metrics_data, media_type=CONTENT_TYPE_LATEST)
+    return metrics_response()
 
 
 @app.get("/user/status")
@@ -46,26 +87,80 @@ async def status():
     return JSONResponse(content={"message": "healthy"}, status_code=200)
 
 
+# --- Background rehash ---
+# Hashes made under an older policy (scheme or cost) are replaced after a
+# successful login, the only time the plain password is at hand, without
+# making that login wait for a second hash. Keyed by user_id, so a login storm
+# rehashes each user once.
+rehash_tasks = {}
+
+
+async def rehash_password(user_id: int, password: str, old_hash: str):
+    try:
+        new_hash = await hasher.hash(password)
+        async with SessionLocal() as db:
+            # Only replace the hash that was verified, in case the password
+            # changed meanwhile.
+            result = await db.execute(
+                update(Users)
+                .where(Users.user_id == user_id, Users.password == old_hash)
+                .values(password=new_hash)
+            )
+            await db.commit()
+        PASSWORD_REHASHES.labels(result="updated" if result.rowcount else "stale").inc()
+    except HashingSaturated:
+        # The pool is busy serving logins; the next login tries again.
+        PASSWORD_REHASHES.labels(result="skipped").inc()
+    except Exception as exc:
+        print(f"Rehashing the password of user {user_id} failed: {exc!r}")
+        PASSWORD_REHASHES.labels(result="failed").inc()
+
+
+def rehash_in_background(user_id: int, password: str, old_hash: str):
+    if user_id in rehash_tasks:
+        return
+    task = asyncio.create_task(rehash_password(user_id, password, old_hash))
+    rehash_tasks[user_id] = task
+    task.add_done_callback(lambda _: rehash_tasks.pop(user_id, None))
+
+
 @app.post("/register")
-async def register_user(request: UserRegisterRequest, db: Session = Depends(get_db)):
-    existing_user = db.query(Users).filter(Users.user_id == request.user_id).first()
+async def register_user(
+    request: UserRegisterRequest, db: AsyncSession = Depends(get_db)
+):
+    existing_user = await db.scalar(
+        select(Users.user_id).where(Users.user_id == request.user_id)
+    )
     if existing_user:
         raise HTTPException(status_code=400, detail="User already registered")
 
-    new_user = Users(
-        user_id=request.user_id,
-        name=request.user_name,
-        password=request.user_password,
-        bio=request.user_bio,
-        archtype=request.user_archtype,
+    # Hash on the worker pool so bcrypt doesn't block the event loop.
+    hashed_password = await hasher.hash(request.user_password)
+    # Names are unique regardless of case; a taken name (or a user_id that was
+    # registered in the meantime) inserts nothing instead of raising.
+    user_id = await db.scalar(
+        insert(Users)
+        .values(
+            user_id=request.user_id,
+            name=request.user_name,
+            login_name=func.lower(request.user_name),
+            password=hashed_password,
+            bio=request.user_bio,
+            archtype=request.user_archtype,
+        )
+        .on_conflict_do_nothing()
+        .returning(Users.user_id)
     )
-    db.add(new_user)
-    db.commit()
-    db.refresh(new_user)
+    if user_id is None:
+        await db.rollback()
+        raise HTTPException(status_code=400, detail="User name already taken")
+    await db.commit()
+    # Drop any cached 404 for this id.
+    await profile_cache.invalidate(user_id)
     return JSONResponse(
         content={
             "message": "The user was successfully registered.",
-            "user_id": new_user.user_id,
+            "user_id": user_id,
         },
         status_code=201,
     )
@@ -86,15 +181,23 @@ async def register_user(request: UserRegisterRequest, db: Session = Depends(get_
 
 
 @app.post("/login")
-async def login_user(request: UserLoginRequest, db: Session = Depends(get_db)):
-    # Find the user by name
-    user = db.query(Users).filter(Users.name == request.user_name).first()
+async def login_user(request: UserLoginRequest, db: AsyncSession = Depends(get_db)):
+    # One index lookup on the unique login name, fetching only what login needs.
+    user = (
+        await db.execute(
+            select(Users.user_id, Users.name, Users.password)
+            .where(Users.login_name == func.lower(request.user_name))
+            .limit(1)
+        )
+    ).first()
     if not user:
         raise HTTPException(status_code=400, detail="Invalid credentials")
 
     # Verify the provided password against the stored hashed password
-    if not pwd_context.verify(request.user_password, user.password):
+    if not await hasher.verify(request.user_password, user.password):
         raise HTTPException(status_code=400, detail="Invalid credentials")
+    if hasher.needs_rehash(user.password):
+        rehash_in_background(user.user_id, request.user_password, user.password)
 
     # Create a JWT token (using a timestamp for 'iat')
     token = create_jwt(
@@ -140,10 +243,42 @@ async def validate_token(request: UserTokenValidation):
     return JSONResponse(content={"message": "Token is invalid."}, status_code=200)
 
 
+@app.post("/validate/batch")
+async def validate_tokens(request: UserTokenBatchValidation):
+    # Results are returned in the same order as the submitted tokens.
+    return JSONResponse(
+        content={"results": [is_token_valid(token) for token in request.user_tokens]},
+        status_code=200,
+    )
+
+
+@app.get("/validate")
+async def validate_bearer_token(authorization: Optional[str] = Header(default=None)):
+    # Validates "Authorization: Bearer <token>" and hands back the claims, so
+    # callers don't need a second round trip to find out who the token is for.
+    scheme, _, token = (authorization or "").partition(" ")
+    claims = verify_token(token) if scheme.lower() == "bearer" and token else None
+    if claims is None:
+        return JSONResponse(
+            content={"message": "Token is invalid.", "claims": None}, status_code=401
+        )
+    return JSONResponse(
+        content={"message": "Token is valid.", "claims": claims}, status_code=200
+    )
+
+
 @app.get("/user/{user_id}")
-async def get_user_info(user_id: str, db: Session = Depends(get_db)):
-    user = db.query(Users).filter(Users.user_id == user_id).first()
+async def get_user_info(user_id: int, db: AsyncSession = Depends(get_db)):
+    # Cache hits return the stored body as-is, skipping both the DB and JSON encoding.
+    body = await profile_cache.get(user_id)
+    if body == MISSING:
+        raise HTTPException(status_code=404, detail="User not found")
+    if body is not None:
+        return Response(content=body, status_code=200, media_type="application/json")
+
+    user = await db.get(Users, user_id)
     if not user:
+        await profile_cache.set_missing(user_id)
         raise HTTPException(status_code=404, detail="User not found")
     # Manually convert the SQLAlchemy model to a dictionary (or use a Pydantic model)
     user_data = {
@@ -152,13 +287,15 @@ async def get_user_info(user_id: str, db: Session = Depends(get_db)):
         "bio": user.bio,
         "archtype": user.archtype,
     }
-    return JSONResponse(
+    response = JSONResponse(
         content={
             "message": "Successfully returned the user data.",
             "user": user_data,
         },
         status_code=200,
     )
+    await profile_cache.set(user_id, response.body)
+    return response
     # return JSONResponse(
     #     content={
     #         "message": "Succsesfully returned the user data.",
@@ -169,12 +306,13 @@ async def get_user_info(user_id: str, db: Session = Depends(get_db)):
 
 
 @app.delete("/user/{user_id}")
-async def delete_user(user_id: str, db: Session = Depends(get_db)):
-    user = db.query(Users).filter(Users.user_id == user_id).first()
-    if not user:
+async def delete_user(user_id: int, db: AsyncSession = Depends(get_db)):
+    # A single DELETE; the affected row count tells us whether the user existed.
+    result = await db.execute(delete(Users).where(Users.user_id == user_id))
+    if result.rowcount == 0:
         raise HTTPException(status_code=404, detail="User not found")
-    db.delete(user)
-    db.commit()
+    await db.commit()
+    await profile_cache.invalidate(user_id)
     return JSONResponse(
         content={"message": "User deleted successfully."},
         status_code=200,
@@ -185,6 +323,107 @@ async def delete_user(user_id: str, db: Session = Depends(get_db)):
     # )
 
 
+@app.post("/users/bulk")
+async def register_users(
+    request: UserBulkRegisterRequest, db: AsyncSession = Depends(get_db)
+):
+    # Every item gets its own result, so one bad entry doesn't sink the batch.
+    results = [None] * len(request.users)
+    seen = set()
+    seen_names = set()
+    pending = []
+    for index, user in enumerate(request.users):
+        if user.user_id in seen:
+            message = "Duplicate user_id in request."
+        elif user.user_name.lower() in seen_names:
+            message = "Duplicate user_name in request."
+        else:
+            seen.add(user.user_id)
+            seen_names.add(user.user_name.lower())
+            pending.append((index, user))
+            continue
+        results[index] = {
+            "user_id": user.user_id,
+            "status": "failed",
+            "message": message,
+        }
+
+    created = set()
+    registered = set()
+    if pending:
+        hashed_passwords = await hasher.hash_many(
+            [user.user_password for _, user in pending]
+        )
+        rows = [
+            {
+                "user_id": user.user_id,
+                "name": user.user_name,
+                "login_name": func.lower(user.user_name),
+                "password": hashed_password,
+                "bio": user.user_bio,
+                "archtype": user.user_archtype,
+            }
+            for (_, user), hashed_password in zip(pending, hashed_passwords)
+        ]
+        # One INSERT for the whole batch; rows whose user_id or name is taken
+        # are skipped and RETURNING tells us which ones went in.
+        result = await db.execute(
+            insert(Users).values(rows).on_conflict_do_nothing().returning(Users.user_id)
+        )
+        created = set(result.scalars())
+        await db.commit()
+        await profile_cache.invalidate(*created)
+        # Only failed batches pay for finding out which conflict it was.
+        skipped = [user.user_id for _, user in pending if user.user_id not in created]
+        if skipped:
+            registered = set(
+                await db.scalars(
+                    select(Users.user_id).where(Users.user_id.in_(skipped))
+                )
+            )
+
+    for index, user in pending:
+        if user.user_id in created:
+            status, message = "created", "The user was successfully registered."
+        elif user.user_id in registered:
+            status, message = "failed", "User already registered"
+        else:
+            status, message = "failed", "User name already taken"
+        results[index] = {"user_id": user.user_id, "status": status, "message": message}
+    return JSONResponse(
+        content={
+            "message": f"Registered {len(created)} of {len(request.users)} users.",
+            "results": results,
+        },
+        status_code=200,
+    )
+
+
+@app.post("/users/lookup")
+async def lookup_users(
+    request: UserBulkLookupRequest, db: AsyncSession = Depends(get_db)
+):
+    rows = await db.execute(
+        select(Users.user_id, Users.name, Users.bio, Users.archtype).where(
+            Users.user_id.in_(set(request.user_ids))
+        )
+    )
+    found = {row.user_id: dict(row._mapping) for row in rows}
+    return JSONResponse(
+        content={
+            "message": f"Found {len(found)} of {len(request.user_ids)} users.",
+            "results": [
+                {
+                    "user_id": user_id,
+                    "found": user_id in found,
+                    "user": found.get(user_id),
+                }
+                for user_id in request.user_ids
+            ],
+        },
+        status_code=200,
+    )
+
+
 if __name__ == "__main__":
-    Base.metadata.create_all(bind=engine)
-    uvicorn.run(app, host="0.0.0.0", port=os.getenv("PORT", 8002))
+    serve("main:app", port=os.getenv("PORT", 8002))
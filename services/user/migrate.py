@@ -0,0 +1,114 @@
+"""Create and migrate the user service's schema.
+
+Run once per deploy, before the replicas start (the compose `user-migrate`
+service does this). Applied migrations are recorded in `schema_migrations`,
+and an advisory lock keeps two migrators from racing each other.
+
+    python migrate.py
+"""
+
+import asyncio
+
+from sqlalchemy import text
+from sqlalchemy.exc import DBAPIError
+
+import models.db  # noqa: F401  (registers the tables on Base.metadata)
+from repository.db import Base, engine
+
+# Any constant works, as long as nothing else takes the same advisory lock.
+MIGRATION_LOCK_ID = 72_010
+
+
+async def create_tables(conn):
+    await conn.run_sync(Base.metadata.create_all)
+
+
+async def add_login_name(conn):
+    """Backfill `login_name` = lower(name) and make it unique.
+
+    Names were never unique, so case-insensitive duplicates are possible. The
+    oldest account (lowest user_id) keeps the plain name; the others log in
+    as "<name>#<user_id>" from now on.
+    """
+    await conn.execute(
+        text("ALTER TABLE users ADD COLUMN IF NOT EXISTS login_name VARCHAR")
+    )
+    await conn.execute(
+        text(
+            "UPDATE users SET login_name = lower(name) "
+            "WHERE login_name IS NULL AND user_id IN "
+            "(SELECT min(user_id) FROM users GROUP BY lower(name))"
+        )
+    )
+    renamed = await conn.execute(
+        text(
+            "UPDATE users SET login_name = lower(name) || '#' || user_id "
+            "WHERE login_name IS NULL RETURNING user_id, name"
+        )
+    )
+    for user_id, name in renamed:
+        print(
+            f"Duplicate login name {name!r}: "
+            f"user {user_id} now logs in as '{name.lower()}#{user_id}'"
+        )
+    await conn.execute(text("ALTER TABLE users ALTER COLUMN login_name SET NOT NULL"))
+    await conn.execute(
+        text(
+            "CREATE UNIQUE INDEX IF NOT EXISTS ix_users_login_name "
+            "ON users (login_name)"
+        )
+    )
+
+
+# Append only; versions are applied in order and never re-run.
+MIGRATIONS = [
+    ("0001_create_tables", create_tables),
+    ("0002_login_name", add_login_name),
+]
+
+
+async def migrate():
+    async with engine.begin() as conn:
+        await conn.execute(
+            text("SELECT pg_advisory_xact_lock(:id)"), {"id": MIGRATION_LOCK_ID}
+        )
+        await conn.execute(
+            text(
+                "CREATE TABLE IF NOT EXISTS schema_migrations ("
+                "version VARCHAR PRIMARY KEY, "
+                "applied_at TIMESTAMPTZ NOT NULL DEFAULT now())"
+            )
+        )
+        applied = set(
+            (
+                await conn.execute(text("SELECT version FROM schema_migrations"))
+            ).scalars()
+        )
+        for version, step in MIGRATIONS:
+            if version in applied:
+                continue
+            print(f"Applying migration {version}")
+            await step(conn)
+            await conn.execute(
+                text("INSERT INTO schema_migrations (version) VALUES (:version)"),
+                {"version": version},
+            )
+
+
+async def main(attempts: int = 30):
+    # Postgres may still be starting when the deploy runs this.
+    for attempt in range(1, attempts + 1):
+        try:
+            await migrate()
+            break
+        except (OSError, DBAPIError) as exc:
+            if attempt == attempts:
+                raise
+            print(f"Postgres not ready ({exc.__class__.__name__}), retrying...")
+            await asyncio.sleep(1)
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
+    print("User schema is up to date.")
@@ -1,18 +1,20 @@
 from sqlalchemy import Column, Integer, String
 from sqlalchemy.types import TypeDecorator
-from passlib.context import CryptContext
 
 from repository.db import Base
-
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+from utils.hashing import pwd_context
 
 
 class PasswordType(TypeDecorator):
     impl = String
 
     def process_bind_param(self, value, dialect):
-        """Hash password before storing it in the database."""
-        if value is not None:
+        """Hash password before storing it in the database.
+
+        Values that are already hashes (the handlers hash on the worker pool
+        before binding) are stored as they are.
+        """
+        if value is not None and pwd_context.identify(value) is None:
             return pwd_context.hash(value)
         return value
 
@@ -29,6 +31,10 @@ class Users(Base):
 
     user_id = Column(Integer, primary_key=True, nullable=False)
     name = Column(String, nullable=False)
+    # lower(name), unique, so login is a single index lookup and names are
+    # unique regardless of case. Set with func.lower() so it always matches
+    # Postgres' own lowercasing (see migrate.py for existing rows).
+    login_name = Column(String, nullable=False, unique=True, index=True)
     password = Column(PasswordType, nullable=False)
     bio = Column(String, server_default="nil")
     archtype = Column(String, server_default="nil")
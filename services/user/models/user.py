@@ -4,19 +4,23 @@ import uuid
 from pydantic import BaseModel, Field
 
 
+def random_name() -> str:
+    return "".join(random.choices(string.ascii_lowercase, k=200))
+
+
 class User(BaseModel):
-    user_id: str = Field(default=str(uuid.uuid4()), validate_default=True)
-    name: str = Field(
-        default="".join([random.choice(string.ascii_lowercase) for _ in range(200)]),
-        validate_default=True,
+    # Factories, so defaults are generated per instance instead of once at import.
+    user_id: str = Field(
+        default_factory=lambda: str(uuid.uuid4()), validate_default=True
     )
+    name: str = Field(default_factory=random_name, validate_default=True)
     password: str
     bio: str = Field(default="")
     archtype: str = Field(default="")
 
 
 class UserRegisterRequest(BaseModel):
-    user_id: str
+    user_id: int
     user_name: str
     user_password: str
     user_bio: str
@@ -30,3 +34,15 @@ class UserLoginRequest(BaseModel):
 
 class UserTokenValidation(BaseModel):
     user_token: str
+
+
+class UserTokenBatchValidation(BaseModel):
+    user_tokens: list[str] = Field(max_length=1000)
+
+
+class UserBulkRegisterRequest(BaseModel):
+    users: list[UserRegisterRequest] = Field(max_length=500)
+
+
+class UserBulkLookupRequest(BaseModel):
+    user_ids: list[int] = Field(max_length=1000)
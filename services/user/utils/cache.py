@@ -0,0 +1,128 @@
+import os
+import time
+from collections import OrderedDict
+
+import redis.asyncio as redis
+from prometheus_client import Counter
+
+# --- Profile cache settings ---
+# A small per-process LRU in front of a Redis tier shared by every replica.
+# Both tiers hold the fully serialized GET /user/{user_id} response body.
+REDIS_URL = os.getenv("REDIS_URL", "redis://redis:6379/0")
+PROFILE_CACHE_SIZE = int(os.getenv("PROFILE_CACHE_SIZE", 1024))
+# The local tier isn't invalidated on other replicas, so keep its TTL short.
+PROFILE_LOCAL_TTL = float(os.getenv("PROFILE_LOCAL_TTL", 5))
+PROFILE_REDIS_TTL = int(os.getenv("PROFILE_REDIS_TTL", 300))
+# 404s are cached too, briefly, so lookups of unknown ids don't hammer Postgres.
+PROFILE_NEGATIVE_TTL = int(os.getenv("PROFILE_NEGATIVE_TTL", 5))
+# Invalidated profiles are replaced by a tombstone for this long, so a read that
+# missed before the change can't write the old profile back after it.
+PROFILE_TOMBSTONE_TTL = int(os.getenv("PROFILE_TOMBSTONE_TTL", 5))
+
+# Stored in place of a body for users that don't exist.
+MISSING = b""
+# Stored in place of a body for invalidated users; reads treat it as a miss.
+TOMBSTONE = b"\x00"
+
+# --- Prometheus Metrics ---
+PROFILE_CACHE_REQUESTS = Counter(
+    "profile_cache_requests",
+    "Profile cache lookups by tier and result",
+    ["tier", "result"],
+)
+
+
+class ProfileCache:
+    def __init__(self, redis_url: str = REDIS_URL, maxsize: int = PROFILE_CACHE_SIZE):
+        self.redis = redis.from_url(redis_url) if redis_url else None
+        self.maxsize = maxsize
+        self._local = OrderedDict()  # user_id -> (expires_at, body)
+
+    @staticmethod
+    def _key(user_id) -> str:
+        return f"user:profile:{user_id}"
+
+    async def get(self, user_id):
+        """Return the cached body, MISSING for a cached 404, or None on a miss."""
+        entry = self._local.get(user_id)
+        if entry is not None and entry[0] > time.monotonic() and entry[1] != TOMBSTONE:
+            self._local.move_to_end(user_id)
+            PROFILE_CACHE_REQUESTS.labels(tier="local", result="hit").inc()
+            return entry[1]
+        PROFILE_CACHE_REQUESTS.labels(tier="local", result="miss").inc()
+        if self.redis is None:
+            return None
+        try:
+            body = await self.redis.get(self._key(user_id))
+        except redis.RedisError as exc:
+            print(f"Profile cache unavailable: {exc}")
+            return None
+        if body is None or body == TOMBSTONE:
+            PROFILE_CACHE_REQUESTS.labels(tier="redis", result="miss").inc()
+            return None
+        PROFILE_CACHE_REQUESTS.labels(tier="redis", result="hit").inc()
+        self._store_local(
+            user_id,
+            body,
+            PROFILE_NEGATIVE_TTL if body == MISSING else PROFILE_LOCAL_TTL,
+        )
+        return body
+
+    async def set(self, user_id, body: bytes):
+        await self._store(user_id, body, PROFILE_LOCAL_TTL, PROFILE_REDIS_TTL)
+
+    async def set_missing(self, user_id):
+        await self._store(user_id, MISSING, PROFILE_NEGATIVE_TTL, PROFILE_NEGATIVE_TTL)
+
+    async def invalidate(self, *user_ids):
+        """Replace the users' entries with tombstones in both tiers."""
+        for user_id in user_ids:
+            self._store_local(user_id, TOMBSTONE, PROFILE_TOMBSTONE_TTL, force=True)
+        if self.redis is None or not user_ids:
+            return
+        try:
+            async with self.redis.pipeline(transaction=False) as pipe:
+                for user_id in user_ids:
+                    pipe.set(self._key(user_id), TOMBSTONE, ex=PROFILE_TOMBSTONE_TTL)
+                await pipe.execute()
+        except redis.RedisError as exc:
+            print(f"Profile cache invalidation failed: {exc}")
+
+    async def warm_up(self):
+        if self.redis is not None:
+            await self.redis.ping()
+
+    async def close(self):
+        if self.redis is not None:
+            await self.redis.aclose()
+
+    async def _store(self, user_id, body: bytes, local_ttl: float, redis_ttl: int):
+        """Write back a body read after a miss, unless the user was invalidated since.
+
+        Only called after a miss, so the key is either absent or a tombstone;
+        NX leaves a tombstone in place.
+        """
+        if self.redis is not None:
+            try:
+                stored = await self.redis.set(
+                    self._key(user_id), body, ex=redis_ttl, nx=True
+                )
+            except redis.RedisError as exc:
+                print(f"Profile cache write failed: {exc}")
+                stored = True
+            if not stored:
+                return
+        self._store_local(user_id, body, local_ttl)
+
+    def _store_local(self, user_id, body: bytes, ttl: float, force: bool = False):
+        entry = self._local.get(user_id)
+        now = time.monotonic()
+        if not force and entry is not None and entry[1] == TOMBSTONE and entry[0] > now:
+            return
+        self._local[user_id] = (now + ttl, body)
+        self._local.move_to_end(user_id)
+        while len(self._local) > self.maxsize:
+            self._local.popitem(last=False)
+
+
+profile_cache = ProfileCache()
@@ -0,0 +1,178 @@
+import os
+import time
+import asyncio
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from passlib.context import CryptContext
+from prometheus_client import Counter, Histogram
+
+# --- Hashing policy ---
+# New hashes use the first scheme; hashes in the others still verify and are
+# replaced on the user's next successful login, as are hashes whose cost no
+# longer matches the settings below. Pick the costs with calibrate_hashing.py.
+PASSWORD_SCHEMES = [
+    scheme.strip() for scheme in os.getenv("PASSWORD_SCHEMES", "bcrypt").split(",")
+]
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", 12))
+ARGON2_TIME_COST = int(os.getenv("ARGON2_TIME_COST", 3))
+ARGON2_MEMORY_COST = int(os.getenv("ARGON2_MEMORY_COST", 65536))  # KiB
+ARGON2_PARALLELISM = int(os.getenv("ARGON2_PARALLELISM", 1))
+
+
+def build_context(
+    schemes=PASSWORD_SCHEMES,
+    bcrypt_rounds: int = BCRYPT_ROUNDS,
+    argon2_time_cost: int = ARGON2_TIME_COST,
+    argon2_memory_cost: int = ARGON2_MEMORY_COST,
+    argon2_parallelism: int = ARGON2_PARALLELISM,
+) -> CryptContext:
+    settings = {}
+    if "bcrypt" in schemes:
+        # Pinned both ways, so raising or lowering the cost migrates stored hashes.
+        settings.update(
+            bcrypt__rounds=bcrypt_rounds,
+            bcrypt__min_rounds=bcrypt_rounds,
+            bcrypt__max_rounds=bcrypt_rounds,
+        )
+    if "argon2" in schemes:
+        settings.update(
+            argon2__rounds=argon2_time_cost,
+            argon2__min_rounds=argon2_time_cost,
+            argon2__memory_cost=argon2_memory_cost,
+            argon2__parallelism=argon2_parallelism,
+        )
+    return CryptContext(schemes=list(schemes), deprecated="auto", **settings)
+
+
+pwd_context = build_context()
+
+# --- Hashing pool settings ---
+# bcrypt is CPU bound, so by default it runs in worker processes ("thread" is
+# also accepted).
+HASH_EXECUTOR = os.getenv("HASH_EXECUTOR", "process")
+HASH_WORKERS = int(os.getenv("HASH_WORKERS", os.cpu_count() or 1))
+# Hash jobs allowed in flight (running or queued) before new ones are turned
+# away with a 503.
+HASH_MAX_PENDING = int(os.getenv("HASH_MAX_PENDING", HASH_WORKERS * 8))
+
+# --- Prometheus Metrics ---
+HASH_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.2, 0.3, 0.5, 1.0, 2.5, 5.0)
+HASH_QUEUE_WAIT = Histogram(
+    "password_hash_queue_wait_seconds",
+    "Time a password hash job waited for a worker",
+    ["operation"],
+    buckets=HASH_BUCKETS,
+)
+HASH_DURATION = Histogram(
+    "password_hash_duration_seconds",
+    "Time spent hashing or verifying a password in a worker",
+    ["operation"],
+    buckets=HASH_BUCKETS,
+)
+PASSWORD_REHASHES = Counter(
+    "password_rehashes_total",
+    "Stored password hashes upgraded to the current policy after a login",
+    ["result"],
+)
+
+
+class HashingSaturated(Exception):
+    """Raised when the hashing queue is full; the caller should shed the request."""
+
+
+def _timed(operation, *args):
+    # Runs inside the worker: returns the result and when the worker picked the job up.
+    started = time.time()
+    result = operation(*args)
+    return result, started, time.time() - started
+
+
+def _hash(password: str) -> str:
+    return pwd_context.hash(password)
+
+
+def _verify(password: str, hashed: str) -> bool:
+    return pwd_context.verify(password, hashed)
+
+
+def _noop():
+    return None
+
+
+class PasswordHasher:
+    """Runs password hashing (bcrypt, argon2) off the event loop on a bounded pool."""
+
+    def __init__(
+        self,
+        kind: str = HASH_EXECUTOR,
+        workers: int = HASH_WORKERS,
+        max_pending: int = HASH_MAX_PENDING,
+    ):
+        self.kind = kind
+        self.workers = workers
+        self.max_pending = max_pending
+        self.pending = 0
+        self._executor = None
+
+    @property
+    def executor(self):
+        if self._executor is None:
+            if self.kind == "thread":
+                self._executor = ThreadPoolExecutor(max_workers=self.workers)
+            else:
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+        return self._executor
+
+    async def warm_up(self):
+        """Start the workers ahead of the first login; spawning them takes a while."""
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(
+            *(loop.run_in_executor(self.executor, _noop) for _ in range(self.workers))
+        )
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    async def _submit(self, name: str, operation, *args):
+        if self.pending >= self.max_pending:
+            raise HashingSaturated(f"{self.pending} password hash jobs already pending")
+        self.pending += 1
+        submitted = time.time()
+        try:
+            loop = asyncio.get_running_loop()
+            result, started, duration = await loop.run_in_executor(
+                self.executor, _timed, operation, *args
+            )
+        finally:
+            self.pending -= 1
+        HASH_QUEUE_WAIT.labels(operation=name).observe(max(started - submitted, 0))
+        HASH_DURATION.labels(operation=name).observe(duration)
+        return result
+
+    async def hash(self, password: str) -> str:
+        return await self._submit("hash", _hash, password)
+
+    async def verify(self, password: str, hashed: str) -> bool:
+        return await self._submit("verify", _verify, password, hashed)
+
+    def needs_rehash(self, hashed: str) -> bool:
+        """Whether a stored hash predates the current scheme or cost.
+
+        Cheap: it only parses the hash.
+        """
+        return pwd_context.needs_update(hashed)
+
+    async def hash_many(self, passwords: list) -> list:
+        """Hash a batch in parallel, keeping at most one job per worker in flight."""
+        limit = asyncio.Semaphore(self.workers)
+
+        async def hash_one(password):
+            async with limit:
+                return await self.hash(password)
+
+        return await asyncio.gather(*(hash_one(password) for password in passwords))
+
+
+hasher = PasswordHasher()